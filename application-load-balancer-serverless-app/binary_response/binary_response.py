@@ -1,24 +1,149 @@
 import base64
+import hashlib
+import os
+from urllib.parse import unquote
 
+import boto3
+from botocore.exceptions import ClientError
 
-def lambda_handler(event, context):
-	print('\n==event==')
-	print(event)
+IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "image1.png")
+CONTENT_TYPE = "image/png"
+# Browsers and caches in front of the ALB revalidate the image after max-age seconds
+CACHE_CONTROL = os.environ.get("CACHE_CONTROL", "public, max-age=86400")
+
+# With BUCKET set, the path of the request is the key of an S3 object under KEY_PREFIX
+BUCKET = os.environ.get("BUCKET", "")
+KEY_PREFIX = os.environ.get("KEY_PREFIX", "")
+# A Lambda response to an ALB is at most 1 MB, headers included, and base64 adds a third:
+# larger objects are sent in ranges of MAX_BODY_BYTES or redirected to a presigned URL
+MAX_BODY_BYTES = int(os.environ.get("MAX_BODY_BYTES", "700000"))
+PRESIGNED_URL_EXPIRY = int(os.environ.get("PRESIGNED_URL_EXPIRY", "300"))
+
+# Read and encoded once per Lambda container instead of on every request
+with open(IMAGE, "rb") as imageFile:
+	raw_data = imageFile.read()
+ENCODED_DATA = base64.b64encode(raw_data).decode("ascii")
+# Strong ETag: the same bytes give the same ETag in every container
+ETAG = '"{}"'.format(hashlib.sha256(raw_data).hexdigest()[:32])
+
+s3 = boto3.client("s3")
+
+
+def request_header(event, name):
+	# ALB sends lower case header names, in multiValueHeaders when the target group has
+	# multi-value headers enabled
+	if event.get("multiValueHeaders"):
+		return ", ".join(event["multiValueHeaders"].get(name, []))
+	return (event.get("headers") or {}).get(name, "")
 
+
+def etag_matches(if_none_match, etag):
+	# If-None-Match holds "*" or a list of ETags, weak ones (W/"...") match as well
+	for tag in if_none_match.split(","):
+		tag = tag.strip()
+		if tag == "*" or tag == etag or tag == "W/" + etag:
+			return True
+	return False
+
+
+def parse_range(range_header, size):
+	# (first, last) byte of a single "bytes=first-last", "bytes=first-" or "bytes=-suffix" range,
+	# None when there is no range to serve (no header, several ranges or a syntax error), and
+	# ValueError when the range starts after the end of the object
+	unit, _, ranges = range_header.partition("=")
+	if unit.strip() != "bytes" or "," in ranges:
+		return None
+	first, separator, last = ranges.strip().partition("-")
+	if not separator or not (first.isdigit() or last.isdigit()):
+		return None
+	if not first.isdigit():
+		if int(last) == 0:
+			raise ValueError(range_header)
+		return max(size - int(last), 0), size - 1
+	if int(first) >= size:
+		raise ValueError(range_header)
+	if not last.isdigit():
+		last = size - 1
+	if int(first) > int(last):
+		return None
+	return int(first), min(int(last), size - 1)
+
+
+def build_response(event, status, description, headers, body="", is_base64_encoded=False):
 	response = {
-		"statusCode": 200,
-		"statusDescription": "200 OK",
-		"isBase64Encoded": True,
-		"headers": {
-			"Content-Type": "image/png;"
-		}
+		"statusCode": status,
+		"statusDescription": description,
+		"isBase64Encoded": is_base64_encoded,
+		"body": body
+	}
+	if "multiValueHeaders" in event:
+		response["multiValueHeaders"] = {name: [value] for name, value in headers.items()}
+	else:
+		response["headers"] = headers
+	return response
+
+
+def object_response(event, key):
+	try:
+		head = s3.head_object(Bucket=BUCKET, Key=key)
+	except ClientError as e:
+		if e.response["Error"]["Code"] in ("404", "NoSuchKey", "403"):
+			return build_response(event, 404, "404 Not Found", {"Content-Type": "text/plain"}, "Not Found")
+		raise
+	size = head["ContentLength"]
+	headers = {
+		"ETag": head["ETag"],
+		"Cache-Control": CACHE_CONTROL,
+		"Accept-Ranges": "bytes"
 	}
 
-	with open("./image1.png", "rb") as imageFile:
-		raw_data = imageFile.read()
-		encoded_data = base64.b64encode(raw_data)
+	if etag_matches(request_header(event, "if-none-match"), head["ETag"]):
+		return build_response(event, 304, "304 Not Modified", headers)
 
-	response['body']=encoded_data
-	return response
+	try:
+		byte_range = parse_range(request_header(event, "range"), size)
+	except ValueError:
+		headers["Content-Range"] = "bytes */{}".format(size)
+		return build_response(event, 416, "416 Range Not Satisfiable", headers)
+
+	headers["Content-Type"] = head.get("ContentType", "binary/octet-stream")
+	if byte_range is None and size <= MAX_BODY_BYTES:
+		body = s3.get_object(Bucket=BUCKET, Key=key, IfMatch=head["ETag"])["Body"].read()
+		return build_response(event, 200, "200 OK", headers, base64.b64encode(body).decode("ascii"), True)
+
+	if byte_range is None:
+		# Too large for a Lambda response: the client downloads it from S3
+		url = s3.generate_presigned_url("get_object", Params={"Bucket": BUCKET, "Key": key},
+			ExpiresIn=PRESIGNED_URL_EXPIRY)
+		return build_response(event, 302, "302 Found", {"Location": url, "Cache-Control": "no-store"})
+
+	# Ranges are cut at MAX_BODY_BYTES, the client asks for the rest from the Content-Range
+	first, last = byte_range
+	last = min(last, first + MAX_BODY_BYTES - 1)
+	body = s3.get_object(Bucket=BUCKET, Key=key, IfMatch=head["ETag"],
+		Range="bytes={}-{}".format(first, last))["Body"].read()
+	headers["Content-Range"] = "bytes {}-{}/{}".format(first, last, size)
+	return build_response(event, 206, "206 Partial Content", headers, base64.b64encode(body).decode("ascii"), True)
+
+
+def lambda_handler(event, context):
+	if BUCKET:
+		# ALB passes the path URL-encoded (%20, %2F...), S3 keys are decoded
+		path = unquote(event.get("path", "/")).lstrip("/")
+		if ".." in path.split("/"):
+			return build_response(event, 400, "400 Bad Request", {"Content-Type": "text/plain"}, "Bad Request")
+		key = KEY_PREFIX + path
+		if not key or key.endswith("/"):
+			return build_response(event, 404, "404 Not Found", {"Content-Type": "text/plain"}, "Not Found")
+		return object_response(event, key)
+
+	headers = {
+		"ETag": ETAG,
+		"Cache-Control": CACHE_CONTROL
+	}
 
+	if etag_matches(request_header(event, "if-none-match"), ETAG):
+		return build_response(event, 304, "304 Not Modified", headers)
 
+	headers["Content-Type"] = CONTENT_TYPE
+	return build_response(event, 200, "200 OK", headers, ENCODED_DATA, True)
@@ -0,0 +1,91 @@
+import io
+import re
+from collections import namedtuple
+
+# Parser of multipart/form-data bodies (RFC 7578): parts are yielded one by one while the body is
+# scanned, and their content is a memoryview of the body, not a copy.
+
+Part = namedtuple("Part", ["name", "filename", "content_type", "content"])
+
+# Browsers send quoted values as they are, with " as %22 and without backslash escapes
+PARAMETER = re.compile(r';\s*([\w*-]+)\s*=\s*(?:"([^"]*)"|([^;]*))')
+
+
+def boundary(content_type):
+	# The boundary of a "multipart/form-data; boundary=..." Content-Type, None for other types
+	media_type, _, parameters = content_type.partition(";")
+	if media_type.strip().lower() != "multipart/form-data":
+		return None
+	value = header_parameters(";" + parameters).get("boundary")
+	return value.encode("latin-1") if value else None
+
+
+def header_parameters(value):
+	# {name: value} of the "; name=value" or '; name="value"' parameters of a header
+	return {match.group(1).lower(): match.group(3).strip() if match.group(2) is None else match.group(2)
+		for match in PARAMETER.finditer(value)}
+
+
+def iter_parts(body, boundary):
+	# Yields the parts of body (bytes) in order, raises ValueError when the body is not a
+	# complete multipart body of the boundary
+	view = memoryview(body)
+	delimiter = b"--" + boundary
+	position = body.find(delimiter)
+	if position < 0:
+		raise ValueError("No multipart boundary in the body")
+	while True:
+		position += len(delimiter)
+		if body[position:position + 2] == b"--":
+			return
+		if body[position:position + 2] != b"\r\n":
+			raise ValueError("Invalid multipart boundary line")
+		headers_end = body.find(b"\r\n\r\n", position + 2)
+		if headers_end < 0:
+			raise ValueError("Truncated multipart headers")
+		headers = {}
+		for line in body[position + 2:headers_end].decode("utf-8", "replace").split("\r\n"):
+			name, _, value = line.partition(":")
+			headers[name.strip().lower()] = value.strip()
+		start = headers_end + 4
+		end = body.find(b"\r\n" + delimiter, start)
+		if end < 0:
+			raise ValueError("Truncated multipart body")
+		disposition = header_parameters(headers.get("content-disposition", ""))
+		yield Part(disposition.get("name", ""), disposition.get("filename"),
+			headers.get("content-type", "text/plain"), view[start:end])
+		position = end + 2
+
+
+class PartReader(io.RawIOBase):
+	# Seekable file over a memoryview, so that the content of a part is uploaded without a copy
+
+	def __init__(self, view):
+		self.view = view
+		self.position = 0
+
+	def readable(self):
+		return True
+
+	def seekable(self):
+		return True
+
+	def readinto(self, buffer):
+		size = max(0, min(len(buffer), len(self.view) - self.position))
+		buffer[:size] = self.view[self.position:self.position + size]
+		self.position += size
+		return size
+
+	def seek(self, offset, whence=io.SEEK_SET):
+		if whence == io.SEEK_CUR:
+			offset += self.position
+		elif whence == io.SEEK_END:
+			offset += len(self.view)
+		self.position = max(0, offset)
+		return self.position
+
+	def tell(self):
+		return self.position
+
+	def __len__(self):
+		return len(self.view)
@@ -1,49 +1,246 @@
 import base64
+import json
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote_plus
+
 import boto3
+from botocore.exceptions import BotoCoreError, ClientError
 
+from multipart import PartReader, boundary, iter_parts
 
-def lambda_handler(event, context):
-	print('\n==event==')
-	print(event)
+# Parts of the presigned multipart uploads (S3 parts are at least 5 MiB, except the last one)
+PART_SIZE = max(int(os.environ.get("PART_SIZE", str(8 * 1024 * 1024))), 5 * 1024 * 1024)
+MAX_PARTS = 10000
+
+# Handoff modes (?mode=...): the client uploads straight to S3 with presigned requests that
+# expire after PRESIGNED_URL_EXPIRY seconds
+HANDOFF_MODES = ("post", "put", "multipart", "parts", "complete", "abort")
+PRESIGNED_URL_EXPIRY = int(os.environ.get("PRESIGNED_URL_EXPIRY", "300"))
+# Largest object of a presigned POST, a single PUT is limited to 5 GiB by S3
+MAX_UPLOAD_SIZE = int(os.environ.get("MAX_UPLOAD_SIZE", str(5 * 1024 * 1024 * 1024)))
+# Part URLs per response, each URL carries the session token of the function and is over 1 KB,
+# and a response to an ALB is at most 1 MB
+MAX_PART_URLS = int(os.environ.get("MAX_PART_URLS", "200"))
+# Buckets the function uploads to or presigns for; when empty, direct uploads go to any bucket the
+# role can write and the presigned modes are refused
+ALLOWED_BUCKETS = [bucket.strip() for bucket in os.environ.get("ALLOWED_BUCKETS", "").split(",") if bucket.strip()]
+
+# Files of a multipart/form-data body uploaded at the same time
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", "8"))
+
+# Kept between invocations of the same Lambda environment
+s3 = boto3.client("s3")
+
+
+def request_header(event, name):
+	# ALB sends lower case header names, in multiValueHeaders when the target group has
+	# multi-value headers enabled
+	if event.get("multiValueHeaders"):
+		return ", ".join(event["multiValueHeaders"].get(name, []))
+	return (event.get("headers") or {}).get(name, "")
+
+
+def query_parameter(event, name):
+	# ALB passes query string parameters as sent, still URL encoded
+	if event.get("multiValueQueryStringParameters"):
+		values = event["multiValueQueryStringParameters"].get(name)
+		return unquote_plus(values[-1]) if values else ""
+	return unquote_plus((event.get("queryStringParameters") or {}).get(name, ""))
+
+
+def int_parameter(event, name):
+	try:
+		return int(query_parameter(event, name))
+	except ValueError:
+		raise ValueError(name)
 
+
+def build_response(event, body, status=200, description="200 OK", content_type="text/html;"):
+	headers = {
+		"Content-Type": content_type,
+		"Cache-Control": "no-store"
+	}
 	response = {
-		"statusCode": 200,
-		"statusDescription": "200 OK",
+		"statusCode": status,
+		"statusDescription": description,
 		"isBase64Encoded": False,
-		"headers": {
-			"Content-Type": "text/html;"
-		}
+		"body": body
 	}
-	encoded_data = event['body']
-	S3KEY = event['queryStringParameters']['objectname']
-	BUCKET_NAME = event['queryStringParameters']['bucketname']
-	LOCALFILE = "/tmp/"+ S3KEY
-	decoded_data = encoded_data.decode('base64')
-
-	imageFile = open(LOCALFILE, "w")
-	imageFile.write(decoded_data)
-	imageFile.close()
-
-	if event['headers']['user-agent']=='ELB-HealthChecker/2.0':
-		print("This is a Health Check Request")
-		response['body'] = 'Response to Health Check Request'
-		return response
-	if event['httpMethod']=='GET':
-		response['body'] = 'Reponse to a GET request'
-		return response
-	if event['httpMethod']=='POST':
-		s3 = boto3.resource('s3')
-		try:
-			s3.meta.client.upload_file(LOCALFILE, BUCKET_NAME, S3KEY)
-			response['body'] = "Upload to S3 -- {} successfully".format(BUCKET_NAME)
-			return response
-		except Exception as e:
-			print(e)
-			response['body'] = "Failed to upload to S3 -- {}".format(BUCKET_NAME)
-			return response
-
-	data = "Default Response"
-	response['body'] = data
+	if "multiValueHeaders" in event:
+		response["multiValueHeaders"] = {name: [value] for name, value in headers.items()}
+	else:
+		response["headers"] = headers
 	return response
 
 
+def request_body(event):
+	# ALB base64 encodes binary bodies, text bodies are passed as they are
+	body = event.get("body") or ""
+	if event.get("isBase64Encoded"):
+		return base64.b64decode(body)
+	return body.encode("utf-8")
+
+
+def upload_bytes(bucket, key, data, content_type=""):
+	# Uploads from memory (bytes or memoryview), no copy to /tmp, with one PutObject: an ALB
+	# sends at most 1 MB of body and a Lambda invocation at most 6 MB, larger files use the
+	# presigned modes
+	extra = {"ContentType": content_type} if content_type else {}
+	s3.put_object(Bucket=bucket, Key=key, Body=PartReader(memoryview(data)), **extra)
+
+
+def upload_file(bucket, key, part):
+	try:
+		upload_bytes(bucket, key, part.content, part.content_type)
+	except (BotoCoreError, ClientError) as e:
+		print(e)
+		error = e.response["Error"].get("Code", "") if isinstance(e, ClientError) else type(e).__name__
+		return {"field": part.name, "filename": part.filename, "key": key, "size": len(part.content),
+			"status": "failed", "error": error}
+	return {"field": part.name, "filename": part.filename, "key": key, "size": len(part.content),
+		"status": "uploaded"}
+
+
+def upload_form(bucket, prefix, body, form_boundary):
+	# Uploads each file of the form as <prefix><file name>, returns a result per file; fields
+	# without a file name are skipped. The whole body is parsed and checked first (the parts are
+	# slices of the body), so that a ValueError means nothing was uploaded
+	files = []
+	for part in iter_parts(body, form_boundary):
+		if part.filename is None:
+			continue
+		filename = part.filename.replace("\\", "/").rsplit("/", 1)[-1]
+		if filename in ("", ".", ".."):
+			raise ValueError("Invalid file name: {}".format(part.filename))
+		files.append((prefix + filename, part))
+	with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+		futures = [executor.submit(upload_file, bucket, key, part) for key, part in files]
+		return [future.result() for future in futures]
+
+
+def part_urls(bucket, key, upload_id, first, last):
+	return [{
+		"partNumber": number,
+		"url": s3.generate_presigned_url("upload_part", Params={"Bucket": bucket, "Key": key,
+			"UploadId": upload_id, "PartNumber": number}, ExpiresIn=PRESIGNED_URL_EXPIRY)
+	} for number in range(first, last + 1)]
+
+
+def handoff(event, mode, bucket, key):
+	# Presigned requests for the object, returned as JSON; raises ValueError on a bad parameter
+	if mode not in HANDOFF_MODES:
+		raise ValueError("mode")
+	content_type = query_parameter(event, "contenttype")
+	if mode == "post":
+		conditions = [["content-length-range", 0, MAX_UPLOAD_SIZE]]
+		fields = {}
+		if content_type:
+			conditions.append({"Content-Type": content_type})
+			fields["Content-Type"] = content_type
+		post = s3.generate_presigned_post(bucket, key, Fields=fields, Conditions=conditions,
+			ExpiresIn=PRESIGNED_URL_EXPIRY)
+		return {"method": "POST", "url": post["url"], "fields": post["fields"]}
+
+	if mode == "put":
+		params = {"Bucket": bucket, "Key": key}
+		headers = {}
+		if content_type:
+			params["ContentType"] = headers["Content-Type"] = content_type
+		url = s3.generate_presigned_url("put_object", Params=params, ExpiresIn=PRESIGNED_URL_EXPIRY)
+		return {"method": "PUT", "url": url, "headers": headers}
+
+	if mode == "multipart":
+		# Parts of PART_SIZE bytes, larger when the object needs more than MAX_PARTS parts
+		size = int_parameter(event, "size")
+		if size < 0:
+			raise ValueError("size")
+		part_size = max(PART_SIZE, int(math.ceil(size / float(MAX_PARTS))))
+		part_count = max(1, int(math.ceil(size / float(part_size))))
+		extra = {"ContentType": content_type} if content_type else {}
+		upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key, **extra)["UploadId"]
+		return {
+			"uploadId": upload_id,
+			"partSize": part_size,
+			"partCount": part_count,
+			"parts": part_urls(bucket, key, upload_id, 1, min(part_count, MAX_PART_URLS))
+		}
+
+	upload_id = query_parameter(event, "uploadid")
+	if not upload_id:
+		raise ValueError("uploadid")
+
+	if mode == "parts":
+		# The URLs of the parts after the first MAX_PART_URLS: ?mode=parts&first=201&last=400
+		first = int_parameter(event, "first")
+		last = min(int_parameter(event, "last"), first + MAX_PART_URLS - 1, MAX_PARTS)
+		if first < 1 or last < first:
+			raise ValueError("first")
+		return {"uploadId": upload_id, "parts": part_urls(bucket, key, upload_id, first, last)}
+
+	if mode == "complete":
+		# The parts are listed from S3, so clients do not need to read the ETag of each part
+		parts = []
+		paginator = s3.get_paginator("list_parts")
+		for page in paginator.paginate(Bucket=bucket, Key=key, UploadId=upload_id):
+			parts.extend({"PartNumber": part["PartNumber"], "ETag": part["ETag"]} for part in page.get("Parts", []))
+		result = s3.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,
+			MultipartUpload={"Parts": parts})
+		return {"bucket": bucket, "key": key, "etag": result.get("ETag"), "parts": len(parts)}
+
+	s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+	return {"bucket": bucket, "key": key, "aborted": upload_id}
+
+
+def lambda_handler(event, context):
+	# Health checks and GETs are answered before the body is touched
+	if request_header(event, "user-agent") == "ELB-HealthChecker/2.0":
+		return build_response(event, "Response to Health Check Request")
+	method = event.get("httpMethod")
+	if method == "GET":
+		return build_response(event, "Reponse to a GET request")
+	if method != "POST":
+		return build_response(event, "Default Response")
+
+	S3KEY = query_parameter(event, "objectname")
+	BUCKET_NAME = query_parameter(event, "bucketname")
+	mode = query_parameter(event, "mode")
+	form_boundary = None if mode else boundary(request_header(event, "content-type"))
+	if not BUCKET_NAME or not (S3KEY or form_boundary):
+		return build_response(event, "The bucketname and objectname query string parameters "
+			"(or bucketname and a multipart/form-data body) are required",
+			400, "400 Bad Request")
+	if ALLOWED_BUCKETS and BUCKET_NAME not in ALLOWED_BUCKETS:
+		return build_response(event, "Uploads to {} are not allowed".format(BUCKET_NAME), 403, "403 Forbidden")
+	# Presigned requests are only handed out for an explicit list of buckets
+	if mode and not ALLOWED_BUCKETS:
+		return build_response(event, "Presigned uploads need ALLOWED_BUCKETS", 403, "403 Forbidden")
+
+	if form_boundary:
+		try:
+			results = upload_form(BUCKET_NAME, query_parameter(event, "prefix"), request_body(event), form_boundary)
+		except ValueError as e:
+			return build_response(event, str(e), 400, "400 Bad Request")
+		if any(result["status"] == "failed" for result in results):
+			return build_response(event, json.dumps(results), 207, "207 Multi-Status", "application/json")
+		return build_response(event, json.dumps(results), content_type="application/json")
+
+	if mode:
+		try:
+			result = handoff(event, mode, BUCKET_NAME, S3KEY)
+		except ValueError as e:
+			return build_response(event, "Missing or invalid parameter: {}".format(e), 400, "400 Bad Request")
+		except (BotoCoreError, ClientError) as e:
+			print(e)
+			return build_response(event, "Failed to {} -- {}".format(mode, BUCKET_NAME), 500,
+				"500 Internal Server Error")
+		return build_response(event, json.dumps(result), content_type="application/json")
+
+	try:
+		upload_bytes(BUCKET_NAME, S3KEY, request_body(event), request_header(event, "content-type"))
+	except (BotoCoreError, ClientError) as e:
+		print(e)
+		return build_response(event, "Failed to upload to S3 -- {}".format(BUCKET_NAME), 500,
+			"500 Internal Server Error")
+	return build_response(event, "Upload to S3 -- {} successfully".format(BUCKET_NAME))
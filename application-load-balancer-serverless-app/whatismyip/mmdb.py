@@ -0,0 +1,150 @@
+import ipaddress
+import mmap
+import struct
+
+# Reader of MaxMind DB files (.mmdb, e.g. GeoLite2 Country / ASN), memory-mapped: the file is
+# read by the page cache on first use, and each lookup walks the search tree and decodes one
+# record without reading or parsing anything else.
+# https://maxmind.github.io/MaxMind-DB/
+
+METADATA_MARKER = b"\xab\xcd\xefMaxMind.com"
+# The metadata is in the last 128 KiB of the file
+METADATA_MAX_SIZE = 128 * 1024
+DATA_SECTION_SEPARATOR_SIZE = 16
+
+
+class InvalidDatabaseError(Exception):
+	pass
+
+
+class Decoder(object):
+	# Decodes the data section types, pointers are relative to pointer_base
+
+	def __init__(self, buffer, pointer_base=0):
+		self.buffer = buffer
+		self.pointer_base = pointer_base
+
+	def decode(self, offset):
+		# Returns (value, offset after the value)
+		buffer = self.buffer
+		ctrl = buffer[offset]
+		offset += 1
+		data_type = ctrl >> 5
+		if data_type == 1:
+			pointer, offset = self.decode_pointer(ctrl, offset)
+			return self.decode(pointer)[0], offset
+		if data_type == 0:
+			data_type = 7 + buffer[offset]
+			offset += 1
+		size = ctrl & 0x1f
+		if size >= 29:
+			extra = size - 28
+			value = int.from_bytes(buffer[offset:offset + extra], "big")
+			offset += extra
+			size = (29, 285, 65821)[extra - 1] + value
+
+		if data_type == 2:
+			return buffer[offset:offset + size].decode("utf-8"), offset + size
+		if data_type == 7:
+			value = {}
+			for _ in range(size):
+				key, offset = self.decode(offset)
+				value[key], offset = self.decode(offset)
+			return value, offset
+		if data_type in (5, 6, 9, 10):
+			return int.from_bytes(buffer[offset:offset + size], "big"), offset + size
+		if data_type == 11:
+			value = []
+			for _ in range(size):
+				item, offset = self.decode(offset)
+				value.append(item)
+			return value, offset
+		if data_type == 3:
+			return struct.unpack(">d", buffer[offset:offset + 8])[0], offset + 8
+		if data_type == 15:
+			return struct.unpack(">f", buffer[offset:offset + 4])[0], offset + 4
+		if data_type == 8:
+			return int.from_bytes(buffer[offset:offset + size].rjust(4, b"\0"), "big", signed=True), offset + size
+		if data_type == 14:
+			return bool(size), offset
+		if data_type == 4:
+			return bytes(buffer[offset:offset + size]), offset + size
+		raise InvalidDatabaseError("Unexpected data type {} at {}".format(data_type, offset))
+
+	def decode_pointer(self, ctrl, offset):
+		size = (ctrl >> 3) & 0x3
+		data = self.buffer[offset:offset + size + 1]
+		if size == 3:
+			pointer = int.from_bytes(data, "big")
+		else:
+			pointer = (((ctrl & 0x7) << (8 * (size + 1))) | int.from_bytes(data, "big")) + (0, 2048, 526336)[size]
+		return self.pointer_base + pointer, offset + size + 1
+
+
+class Reader(object):
+	# reader.get("203.0.113.7") returns (record, prefix length) or (None, prefix length), the
+	# decoded records are kept, so repeated lookups of a network only walk the tree
+
+	def __init__(self, path):
+		with open(path, "rb") as database:
+			self.buffer = mmap.mmap(database.fileno(), 0, access=mmap.ACCESS_READ)
+		start = self.buffer.rfind(METADATA_MARKER, max(0, len(self.buffer) - METADATA_MAX_SIZE))
+		if start < 0:
+			raise InvalidDatabaseError("{} is not a MaxMind DB file".format(path))
+		start += len(METADATA_MARKER)
+		self.metadata = Decoder(self.buffer, start).decode(start)[0]
+		self.node_count = self.metadata["node_count"]
+		self.record_size = self.metadata["record_size"]
+		self.ip_version = self.metadata["ip_version"]
+		if self.record_size not in (24, 28, 32):
+			raise InvalidDatabaseError("Unsupported record size {}".format(self.record_size))
+		self.node_size = self.record_size // 4
+		search_tree_size = self.node_count * self.node_size
+		self.data_section = search_tree_size + DATA_SECTION_SEPARATOR_SIZE
+		self.decoder = Decoder(self.buffer, self.data_section)
+		self.records = {}
+		# IPv4 addresses are under ::/96 of an IPv6 tree
+		self.ipv4_start = 0
+		if self.ip_version == 6:
+			for _ in range(96):
+				if self.ipv4_start >= self.node_count:
+					break
+				self.ipv4_start = self.read_node(self.ipv4_start, 0)
+
+	def read_node(self, node, bit):
+		offset = node * self.node_size
+		buffer = self.buffer
+		if self.record_size == 24:
+			offset += bit * 3
+			return int.from_bytes(buffer[offset:offset + 3], "big")
+		if self.record_size == 28:
+			middle = buffer[offset + 3]
+			if bit:
+				return ((middle & 0x0f) << 24) | int.from_bytes(buffer[offset + 4:offset + 7], "big")
+			return ((middle & 0xf0) << 20) | int.from_bytes(buffer[offset:offset + 3], "big")
+		offset += bit * 4
+		return int.from_bytes(buffer[offset:offset + 4], "big")
+
+	def get(self, ip):
+		address = ipaddress.ip_address(ip)
+		if address.version == 6 and self.ip_version == 4:
+			return None, 0
+		bit_count = address.max_prefixlen
+		node = 0
+		if address.version == 4 and self.ip_version == 6:
+			node = self.ipv4_start
+		value = int(address)
+		depth = 0
+		while depth < bit_count and node < self.node_count:
+			node = self.read_node(node, (value >> (bit_count - 1 - depth)) & 1)
+			depth += 1
+		if node <= self.node_count:
+			return None, depth
+		offset = node - self.node_count - DATA_SECTION_SEPARATOR_SIZE + self.data_section
+		record = self.records.get(offset)
+		if record is None:
+			record = self.records[offset] = self.decoder.decode(offset)[0]
+		return record, depth
+
+	def close(self):
+		self.buffer.close()
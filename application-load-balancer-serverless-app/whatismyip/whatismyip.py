@@ -1,50 +1,159 @@
-import time
+import html
+import ipaddress
 import json
 import os
+from urllib.parse import unquote_plus
 
-TEMPLATE = './whatismyip_template.html'
+import mmdb
 
+FUNCTION_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE = os.path.join(FUNCTION_DIR, "whatismyip_template.html")
+PLACEHOLDER = "<!--whatismyip-->"
+# Proxies in front of the ALB that append to X-Forwarded-For, e.g. 1 behind CloudFront
+TRUSTED_HOPS = int(os.environ.get("TRUSTED_HOPS", "0"))
+
+# MaxMind DB files (.mmdb) bundled with the function, e.g. "GeoLite2-Country.mmdb,GeoLite2-ASN.mmdb",
+# for the country, ASN and prefix of the source IP
+GEOIP_DATABASES = os.environ.get("GEOIP_DATABASES", "")
+
+# Loaded and split once per Lambda container, each page is the two halves around the IP
+with open(TEMPLATE, "r") as template:
+	TEMPLATE_HEAD, _, TEMPLATE_TAIL = template.read().partition(PLACEHOLDER)
+
+# Memory-mapped once per Lambda container, lookups of warm invocations do no I/O
+DATABASES = [mmdb.Reader(os.path.join(FUNCTION_DIR, path.strip()))
+	for path in GEOIP_DATABASES.split(",") if path.strip()]
+
+CONTENT_TYPES = {
+	"html": "text/html; charset=utf-8",
+	"text": "text/plain; charset=utf-8",
+	"json": "application/json"
+}
+ACCEPTED_TYPES = {
+	"text/html": "html",
+	"text/plain": "text",
+	"application/json": "json"
+}
+
+
+def request_header(event, name):
+	# ALB sends lower case header names, in multiValueHeaders when the target group has
+	# multi-value headers enabled
+	if event.get("multiValueHeaders"):
+		return ", ".join(event["multiValueHeaders"].get(name, []))
+	return (event.get("headers") or {}).get(name, "")
+
+
+def query_parameter(event, name):
+	# ALB passes query string parameters as sent, still URL encoded
+	if event.get("multiValueQueryStringParameters"):
+		values = event["multiValueQueryStringParameters"].get(name)
+		return unquote_plus(values[-1]) if values else ""
+	return unquote_plus((event.get("queryStringParameters") or {}).get(name, ""))
+
+
+def parse_ip(value):
+	# "203.0.113.7", "2001:db8::1", "[2001:db8::1]:443" or "203.0.113.7:443" to its normal form
+	value = value.strip()
+	if value.startswith("["):
+		value = value[1:].partition("]")[0]
+	elif value.count(":") == 1:
+		value = value.partition(":")[0]
+	try:
+		return str(ipaddress.ip_address(value))
+	except ValueError:
+		return None
+
+
+def source_ip(event):
+	# The ALB appends the address of the connection to X-Forwarded-For, anything before it was
+	# sent by the client or by the proxies in front of the ALB, so the source IP is counted
+	# from the end: the last entry, or the one before the TRUSTED_HOPS proxies
+	hops = [hop for hop in request_header(event, "x-forwarded-for").split(",") if hop.strip()]
+	if not hops:
+		return None
+	return parse_ip(hops[max(len(hops) - 1 - TRUSTED_HOPS, 0)])
 
-def lambda_handler(event, context):
-	print('==event==')
-	print(event)
-	with open(TEMPLATE, 'rw') as template:
-		template_html = template.read()
 
+def network_details(sourceip):
+	# Country, ASN and prefix of the IP in the databases, the prefix is the network of the ASN
+	# database when there is one, as routed, else the network of the country database
+	details = {}
+	for database in DATABASES:
+		record, prefix_length = database.get(sourceip)
+		if not record:
+			continue
+		network = str(ipaddress.ip_network((sourceip, prefix_length), strict=False))
+		country = record.get("country") or record.get("registered_country")
+		if country and "Country" not in details:
+			details["Country"] = country.get("iso_code")
+		if "autonomous_system_number" in record:
+			details["ASN"] = record["autonomous_system_number"]
+			details["AS Organization"] = record.get("autonomous_system_organization")
+			details["Prefix"] = network
+		elif "Prefix" not in details:
+			details["Prefix"] = network
+	return details
+
+
+def output_format(event):
+	# ?output=text|json|html first, then the preferred type of the Accept header, else HTML
+	output = query_parameter(event, "output").lower()
+	if output in CONTENT_TYPES:
+		return output
+	best, best_quality = "html", 0.0
+	for media_range in request_header(event, "accept").split(","):
+		media_type, _, parameters = media_range.partition(";")
+		output = ACCEPTED_TYPES.get(media_type.strip().lower())
+		if output is None:
+			continue
+		quality = 1.0
+		for parameter in parameters.split(";"):
+			name, _, value = parameter.partition("=")
+			if name.strip() == "q":
+				try:
+					quality = float(value)
+				except ValueError:
+					quality = 0.0
+		if quality > best_quality:
+			best, best_quality = output, quality
+	return best
+
+
+def build_response(event, output, body, status=200, description="200 OK"):
+	headers = {
+		"Content-Type": CONTENT_TYPES[output],
+		"Cache-Control": "no-store"
+	}
 	response = {
-		"statusCode": 200,
-		"headers": {
-			"Content-Type": "text/html;"
-		},
-		"isBase64Encoded": False
+		"statusCode": status,
+		"statusDescription": description,
+		"isBase64Encoded": False,
+		"body": body
 	}
-	if event['headers']['user-agent'] == 'ELB-HealthChecker/2.0':
-		print('HealthCheck Request')
-		data = 'Response to HealthCheck'
-		response['body'] = data
-		return response
-
-	sourceip_list = event['headers']['x-forwarded-for'].split(',')
-	if sourceip_list:
-		sourceip = str(sourceip_list[0])
-		data = "<h3>Your IP is {}</h3>".format(sourceip)
-		if event['queryStringParameters'] == {"output":"text"}:
-			response['body']=sourceip
-			return response
-		if event['queryStringParameters'] == {"output":"json"}:
-			response['body'] = json.dumps({"Source IP":sourceip})
-			return response
+	if "multiValueHeaders" in event:
+		response["multiValueHeaders"] = {name: [value] for name, value in headers.items()}
 	else:
-		data = '<h3>No source IP found</h3>'
-		response_html = template_html.replace("<!--whatismyip-->", data)
-		return response_html
-
+		response["headers"] = headers
+	return response
 
-	print(type(template_html))
-	response_html = template_html.replace("<!--whatismyip-->", data)
 
-	response['body'] = response_html
-	print(response)
-	return response
+def lambda_handler(event, context):
+	if request_header(event, "user-agent") == "ELB-HealthChecker/2.0":
+		return build_response(event, "text", "Response to HealthCheck")
 
+	sourceip = source_ip(event)
+	output = output_format(event)
+	if output == "text":
+		return build_response(event, output, sourceip or "")
+	details = network_details(sourceip) if sourceip and DATABASES else {}
+	if output == "json":
+		return build_response(event, output, json.dumps(dict({"Source IP": sourceip}, **details)))
 
+	if sourceip:
+		data = "<h3>Your IP is {}</h3>".format(sourceip)
+		for name, value in details.items():
+			data += "<p>{}: {}</p>".format(name, html.escape(str(value)))
+	else:
+		data = "<h3>No source IP found</h3>"
+	return build_response(event, output, TEMPLATE_HEAD + data + TEMPLATE_TAIL)
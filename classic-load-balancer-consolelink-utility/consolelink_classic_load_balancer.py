@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 # Copyright 2016. Amazon Web Services, Inc. All Rights Reserved.
 #
 # Licensed under the Apache License, Version 2.0 (the "License");
@@ -20,6 +20,15 @@ import argparse
 import sys
 import botocore
 import csv
+import datetime
+import hashlib
+import json
+import os
+import re
+import time
+from collections import Counter
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
 
 # Classic Load Balancer Console Link utility
 #  version 1.0.0 2017
@@ -28,6 +37,8 @@ import csv
 # This script help create a spreadsheet of Classic Load Balancers' AWS console URL link along with other attributes
 # such as 'Name', 'DNSName', 'Scheme', 'HostedZoneID', 'CreatedTime',
 # 'VPCId', 'AvailabilityZones', 'EC2Platform', 'Subnets', 'SecurityGroup'
+# and, optionally, the number of healthy and unhealthy backend instances and the
+# type, Availability Zone and state of the backend instances
 
 
 # With no parameters or configuration, boto3 looks for access keys here:
@@ -42,10 +53,28 @@ import csv
 # classic_load_balancer_console_link.py
 # --region <value>
 # --format <value>
+# [--instance-health]
+# [--max-workers <value>]
+# [--instance-details]
+# [--cache-dir <value>]
+# [--cache-ttl <value>]
 # [--debug <value>]
 
 VERSION = '1.0.0'
 CONSOLE_PREFIX = 'https://console.aws.amazon.com/ec2/v2/home?region='
+# Number of describe_instance_health calls in flight at the same time
+MAX_WORKERS = 10
+# Throttled calls are retried by botocore with exponential backoff, and adaptive
+# mode slows the shared client down when the API keeps throttling
+RETRY_CONFIG = {'max_attempts': 10, 'mode': 'adaptive'}
+# Maximum number of instance IDs in one describe_instances call
+INSTANCE_BATCH_SIZE = 1000
+# Seconds a cached describe response is served before it is described again
+CACHE_TTL = 3600
+
+# Raw describe pages are cached in <cache_dir>/<account id>/<region>/ when cache_dir is set
+cache_dir = None
+cache_ttl = CACHE_TTL
 
 # Log will be stored in CLBConsoleLink.log file in the same directory as this utility script
 logger = logging.getLogger()
@@ -63,6 +92,68 @@ logger.addHandler(file_handler)
 logger.addHandler(stream_handler)
 
 
+def _encode_datetime(value):
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': value.isoformat()}
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+def _decode_datetime(value):
+    if '__datetime__' in value:
+        return datetime.datetime.fromisoformat(value['__datetime__'])
+    return value
+
+
+def get_account_id():
+    """
+    Return the account ID of the current credentials. The account of every access key is
+    remembered in the cache directory, so that cached responses can be served offline.
+    """
+    credentials = boto3.session.Session().get_credentials()
+    if credentials is None:
+        logger.error('No AWS credentials found. Configure credentials (e.g. aws configure) '
+                     'to use the cache directory')
+        sys.exit(1)
+    access_key = hashlib.sha256(credentials.access_key.encode()).hexdigest()
+    accounts_file = os.path.join(cache_dir, 'accounts.json')
+    accounts = {}
+    if os.path.exists(accounts_file):
+        with open(accounts_file) as f:
+            accounts = json.load(f)
+    if access_key not in accounts:
+        accounts[access_key] = boto3.client('sts').get_caller_identity()['Account']
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(accounts_file, 'w') as f:
+            json.dump(accounts, f)
+    return accounts[access_key]
+
+
+def paginate(client, region, operation_name, **kwargs):
+    """
+    Return all the pages of a paginated describe call. When a cache directory is set, the raw
+    pages are saved per account and region and served from there while they are fresh.
+    """
+    if not cache_dir:
+        return list(client.get_paginator(operation_name).paginate(**kwargs))
+    request_hash = hashlib.sha256(json.dumps(kwargs, sort_keys=True).encode()).hexdigest()[:16]
+    cache_file = os.path.join(cache_dir, get_account_id(), region,
+                              '{}-{}.json'.format(operation_name, request_hash))
+    if os.path.exists(cache_file) and time.time() - os.path.getmtime(cache_file) < cache_ttl:
+        if debug:
+            logger.debug("Serving {} from {}".format(operation_name, cache_file))
+        with open(cache_file) as f:
+            return json.load(f, object_hook=_decode_datetime)
+    pages = list(client.get_paginator(operation_name).paginate(**kwargs))
+    for page in pages:
+        page.pop('ResponseMetadata', None)
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    # Write to a temporary file first so an interrupted run never leaves a truncated cache entry
+    with open(cache_file + '.tmp', 'w') as f:
+        json.dump(pages, f, default=_encode_datetime)
+    os.replace(cache_file + '.tmp', cache_file)
+    return pages
+
+
 def get_elb_data(region):
     """
     Describe the Classic Load Balancer and retrieve attributes
@@ -72,11 +163,12 @@ def get_elb_data(region):
     elbc = boto3.client('elb', region_name=region)
     # Describes the specified Classic Load Balancer.
     try:
-        paginator = elbc.get_paginator('describe_load_balancers')
+        pages = paginate(elbc, region, 'describe_load_balancers')
     except botocore.exceptions.ClientError as e:
         logger.error(e.response['Error']['Message'])
+        raise
     elb_data = []
-    for describe_load_balancers in paginator.paginate():
+    for describe_load_balancers in pages:
         # Render a dictionary that contains the Classic Load Balancer attributes
         for lb in describe_load_balancers['LoadBalancerDescriptions']:
             elb_item = {}
@@ -106,6 +198,107 @@ def get_elb_data(region):
     return elb_data
 
 
+def describe_instance_health(elbc, lb_name):
+    """
+    Count the healthy and unhealthy backend instances of one Classic Load Balancer
+    """
+    try:
+        instance_states = elbc.describe_instance_health(
+            LoadBalancerName=lb_name)['InstanceStates']
+    except botocore.exceptions.ClientError as e:
+        logger.error('Unable to describe instance health of {}: {}'.format(
+            lb_name, e.response['Error']['Message']))
+        return None, None
+    healthy = sum(1 for state in instance_states if state['State'] == 'InService')
+    return healthy, len(instance_states) - healthy
+
+
+def get_instance_health(region, elb_data, max_workers=MAX_WORKERS):
+    """
+    Add the healthy/unhealthy backend instance counts to every Classic Load Balancer.
+    The describe_instance_health calls run concurrently on a bounded thread pool.
+    """
+    if debug:
+        logger.debug("Getting backend instance health")
+    # boto3 clients are thread safe, so the pool shares one client
+    elbc = boto3.client('elb', region_name=region,
+                        config=Config(retries=RETRY_CONFIG,
+                                      max_pool_connections=max_workers))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(lambda elb_item: describe_instance_health(elbc, elb_item['Name']),
+                               elb_data)
+        for elb_item, (healthy, unhealthy) in zip(elb_data, results):
+            elb_item['HealthyInstances'] = healthy
+            elb_item['UnhealthyInstances'] = unhealthy
+    if debug:
+        logger.debug("elb data with instance health:")
+        logger.debug(elb_data)
+    return elb_data
+
+
+def describe_instances(ec2, region, instance_ids):
+    """
+    Describe a batch of EC2 instances, return a dictionary of instance metadata keyed by instance ID
+    """
+    instances = {}
+    while instance_ids:
+        try:
+            for instances_page in paginate(ec2, region, 'describe_instances', InstanceIds=instance_ids):
+                for reservation in instances_page['Reservations']:
+                    for instance in reservation['Instances']:
+                        instances[instance['InstanceId']] = {
+                            'InstanceType': instance['InstanceType'],
+                            'AvailabilityZone': instance['Placement']['AvailabilityZone'],
+                            'State': instance['State']['Name']}
+            break
+        except botocore.exceptions.ClientError as e:
+            # A single instance that no longer exists fails the whole batch,
+            # so drop the IDs named in the error and describe the rest again
+            if e.response['Error']['Code'] != 'InvalidInstanceID.NotFound':
+                logger.error(e.response['Error']['Message'])
+                break
+            missing = set(re.findall(r'i-[0-9a-f]+', e.response['Error']['Message']))
+            if not missing:
+                logger.error(e.response['Error']['Message'])
+                break
+            logger.info('Backend instances not found: {}'.format(', '.join(sorted(missing))))
+            instance_ids = [instance_id for instance_id in instance_ids if instance_id not in missing]
+    return instances
+
+
+def get_instance_data(region, elb_data):
+    """
+    Add the type, Availability Zone and state of the backend instances to every Classic Load Balancer.
+    The backend instances of all Classic Load Balancers are described together, in batches of
+    INSTANCE_BATCH_SIZE instance IDs.
+    """
+    if debug:
+        logger.debug("Getting backend instance data")
+    ec2 = boto3.client('ec2', region_name=region, config=Config(retries=RETRY_CONFIG))
+    instance_ids = sorted(set(instance['InstanceId'] for elb_item in elb_data
+                              for instance in elb_item['BackendInstances']))
+    instances = {}
+    for i in range(0, len(instance_ids), INSTANCE_BATCH_SIZE):
+        instances.update(describe_instances(ec2, region, instance_ids[i:i + INSTANCE_BATCH_SIZE]))
+    for elb_item in elb_data:
+        instance_details = []
+        instance_types = Counter()
+        for instance in elb_item['BackendInstances']:
+            metadata = instances.get(instance['InstanceId'])
+            if metadata is None:
+                continue
+            instance_details.append('{} ({}, {}, {})'.format(
+                instance['InstanceId'], metadata['InstanceType'],
+                metadata['AvailabilityZone'], metadata['State']))
+            instance_types[metadata['InstanceType']] += 1
+        elb_item['BackendInstanceDetails'] = instance_details
+        elb_item['BackendInstanceTypes'] = dict(instance_types)
+    if debug:
+        logger.debug("elb data with instance data:")
+        logger.debug(elb_data)
+    return elb_data
+
+
 def get_csv(elb_data):
     '''
     Generate a CSV file with Classic Load Balancers' Attributes and ConsoleLink
@@ -153,6 +346,19 @@ def get_html(elb_data):
         html_file.write(html)
 
 
+def positive_int(value):
+    """
+    argparse type of the options that need a number of at least 1
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('{!r} is not an integer'.format(value))
+    if number < 1:
+        raise argparse.ArgumentTypeError('{} is less than 1'.format(number))
+    return number
+
+
 def main():
     """
     Taking in args in main function
@@ -165,6 +371,20 @@ def main():
     parser.add_argument("--format", help="The format of the output file that you "
                                          "want to retrieve. Current "
                                          "supported formats are CSV and HTML", required=True)
+    parser.add_argument("--instance-health", help="Add the number of healthy and unhealthy "
+                                                  "backend instances of each Classic Load Balancer",
+                        action='store_true')
+    parser.add_argument("--max-workers", help="The maximum number of concurrent "
+                                              "describe_instance_health calls",
+                        type=positive_int, default=MAX_WORKERS)
+    parser.add_argument("--instance-details", help="Add the type, Availability Zone and state "
+                                                   "of the backend instances",
+                        action='store_true')
+    parser.add_argument("--cache-dir", help="Cache the describe responses in this directory "
+                                            "and serve later runs from it")
+    parser.add_argument("--cache-ttl", help="The number of seconds the cached describe "
+                                            "responses are served (default {})".format(CACHE_TTL),
+                        type=int, default=CACHE_TTL)
     parser.add_argument("--debug", help="debug mode", action='store_true')
     # if no options, print help
     if len(sys.argv[1:]) == 0:
@@ -180,11 +400,18 @@ def main():
         parser.exit()
     global debug
     debug = args.debug
+    global cache_dir, cache_ttl
+    cache_dir = args.cache_dir
+    cache_ttl = args.cache_ttl
     global client
     session = botocore.session.get_session()
     session.user_agent_name = 'CLBConsoleLink/' + VERSION
     # Obtain Classic Load Balancer data
     elb_data = get_elb_data(region)
+    if args.instance_health:
+        get_instance_health(region, elb_data, args.max_workers)
+    if args.instance_details:
+        get_instance_data(region, elb_data)
     if format == 'csv':
         get_csv(elb_data)
     if format == 'html':
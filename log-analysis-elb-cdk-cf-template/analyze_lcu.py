@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# Measures the LCUs (load balancer capacity units) of ALBs per minute from downloaded access log
+# files, and reports per ALB the peak and the percentiles of the LCUs, the dimension of the peak
+# (new connections, active connections, processed bytes, rule evaluations) and an LCU-SET value
+# for the LCU reservation automation, like the LCU saved queries of AthenaStack.
+#
+# Usage:
+# analyze_lcu.py <directory or file> [<directory or file> ...]
+# [--start <time>] [--end <time>] [--rules <value>] [--hourly] [--minutes]
+# [--workers <value>] [--format text|json]
+#
+# e.g. a week of logs of an ALB, with 25 rules on its listener:
+# aws s3 sync s3://<bucket>/AWSLogs/<account>/elasticloadbalancing/<region>/2024/05/ logs/
+# analyze_lcu.py logs/ --start 2024-05-01 --end 2024-05-08 --rules 25 --hourly
+
+import argparse
+import json
+import logging
+import sys
+import time
+
+from analyze_logs import print_report
+from elb_logs.analyzer import find_log_files
+from elb_logs.lcu import DIMENSIONS, hourly_peaks, measure, minute_lcus, summary
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_COLUMNS = ('elb', 'minutes', 'peak_lcu', 'peak_minute', 'peak_dimension', 'p50_lcu', 'p90_lcu',
+                   'p99_lcu', *[f'peak_{dimension}_lcu' for dimension in DIMENSIONS], 'lcu_set')
+HOURLY_COLUMNS = ('elb', 'hour_utc', 'peak_lcu', 'lcu_set')
+MINUTE_COLUMNS = ('elb', 'minute', *[f'{dimension}_lcu' for dimension in DIMENSIONS], 'lcu')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='LCUs per minute of ALBs from their access logs')
+    parser.add_argument('paths', nargs='+', help='ALB log files (.log.gz) or directories with log files')
+    parser.add_argument('--start', help='First time, ISO 8601 (e.g. 2024-05-01T10:00)')
+    parser.add_argument('--end', help='Last time, ISO 8601')
+    parser.add_argument('--rules', type=int,
+                        help='Rules of the listeners, default the number of matched rule priorities in the logs')
+    parser.add_argument('--hourly', action='store_true', help='Also the peak LCUs per hour of the day (UTC)')
+    parser.add_argument('--minutes', action='store_true', help='Also the LCUs of every minute')
+    parser.add_argument('--workers', type=int, help='Number of processes, default number of CPUs')
+    parser.add_argument('--format', choices=['text', 'json'], default='text')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    paths = find_log_files(args.paths).get('alb')
+    if not paths:
+        logger.error('No ALB log files (.log.gz) found')
+        sys.exit(1)
+
+    started = time.time()
+    minutes, priorities, invalid_lines = measure(paths, args.workers, args.start, args.end)
+    logger.info('%d files, %d minutes (%d invalid lines) in %.1f s', len(paths), len(minutes), invalid_lines,
+                time.time() - started)
+    rows = minute_lcus(minutes, priorities, args.rules)
+
+    reports = [('LCU summary', SUMMARY_COLUMNS, [tuple(item.values()) for item in summary(rows)])]
+    if args.hourly:
+        reports.append(('Peak LCU per hour of the day (UTC)', HOURLY_COLUMNS, hourly_peaks(rows)))
+    if args.minutes:
+        reports.append(('LCU per minute', MINUTE_COLUMNS,
+                        [(elb, minute, *[round(dimensions[dimension], 3) for dimension in DIMENSIONS], round(lcu, 3))
+                         for elb, minute, dimensions, lcu in rows]))
+
+    if args.format == 'json':
+        json.dump({title: [dict(zip(columns, row)) for row in report_rows] for title, columns, report_rows in reports},
+                  sys.stdout, indent=2)
+        print()
+    else:
+        for title, columns, report_rows in reports:
+            print_report(title, columns, report_rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# Runs local equivalents of the named queries of AthenaStack (TLS versions and cipher suites,
+# request types, top talkers, target distribution, 4xx/5xx errors, request size) over downloaded
+# ELB access log files, without Athena.
+#
+# The log type of each file (ALB, CLB or NLB) is taken from its file name, and the files are
+# parsed by a pool of processes.
+#
+# With --approximate the distinct clients and top talkers are counted in fixed size sketches
+# instead of a counter per client. The sketches can be saved (--save-sketches) and merged with the
+# sketches of other days (--load-sketches) without reading their log files again.
+#
+# Usage:
+# analyze_logs.py <directory or file> [<directory or file> ...]
+# [--report <name> ...] [--start <time>] [--end <time>] [--limit <value>]
+# [--workers <value>] [--format text|json]
+# analyze_logs.py --approximate [<directory or file> ...] [--save-sketches <file>]
+# [--load-sketches <file> ...] [--report <name> ...] [--limit <value>] [--format text|json]
+#
+# e.g. the logs of an hour of an ALB:
+# aws s3 sync s3://<bucket>/AWSLogs/<account>/elasticloadbalancing/<region>/2024/05/01/ logs/
+# analyze_logs.py logs/ --start 2024-05-01T10:00 --end 2024-05-01T11:00
+#
+# e.g. distinct clients and top talkers of a week, one day at a time:
+# analyze_logs.py --approximate logs/2024/05/07/ --save-sketches 2024-05-07.json \
+#     --load-sketches 2024-05-01.json 2024-05-02.json 2024-05-03.json 2024-05-04.json 2024-05-05.json 2024-05-06.json
+
+import argparse
+import json
+import logging
+import sys
+import time
+
+from elb_logs.analyzer import (APPROXIMATE_REPORTS, REPORTS, UNSUPPORTED_REPORTS, analyze, approximate_report,
+                               find_log_files, load_sketches, merge_sketches, report, save_sketches)
+
+logger = logging.getLogger(__name__)
+
+
+def print_report(title, columns, rows):
+    print(f'\n{title}')
+    table = [tuple(str(value) for value in row) for row in [columns] + rows]
+    widths = [max(len(row[i]) for row in table) for i in range(len(columns))]
+    for row in table:
+        print('  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local equivalents of the AthenaStack named queries')
+    parser.add_argument('paths', nargs='*', help='Log files (.log.gz) or directories with log files')
+    parser.add_argument('--report', action='append', choices=list(REPORTS) + list(APPROXIMATE_REPORTS),
+                        help='Report to print, repeat for several, default all')
+    parser.add_argument('--start', help='First time, ISO 8601 (e.g. 2024-05-01T10:00)')
+    parser.add_argument('--end', help='Last time, ISO 8601')
+    parser.add_argument('--limit', type=int, help='Rows per report, default all (10 for top talkers)')
+    parser.add_argument('--workers', type=int, help='Number of processes, default number of CPUs')
+    parser.add_argument('--format', choices=['text', 'json'], default='text')
+    parser.add_argument('--approximate', action='store_true',
+                        help='Distinct clients and top talkers from sketches, with bounded memory')
+    parser.add_argument('--save-sketches', help='JSON file to save the sketches to (--approximate)')
+    parser.add_argument('--load-sketches', nargs='+', default=[],
+                        help='JSON files of saved sketches to merge (--approximate)')
+    args = parser.parse_args()
+    if (args.save_sketches or args.load_sketches) and not args.approximate:
+        parser.error('--save-sketches and --load-sketches need --approximate')
+    if not args.paths and not args.load_sketches:
+        parser.error('log files or --load-sketches are required')
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    files = find_log_files(args.paths)
+    if not files and not args.load_sketches:
+        logger.error('No log files (.log.gz) found')
+        sys.exit(1)
+
+    if args.approximate:
+        approximate(args, files)
+        return
+
+    output = {}
+    for log_type, paths in sorted(files.items()):
+        started = time.time()
+        aggregates, lines, invalid_lines = analyze(log_type, paths, args.workers, args.start, args.end)
+        logger.info('%s: %d files, %d lines (%d invalid) in %.1f s', log_type.upper(), len(paths), lines,
+                    invalid_lines, time.time() - started)
+
+        for name in args.report or REPORTS:
+            if name not in REPORTS or name in UNSUPPORTED_REPORTS[log_type]:
+                continue
+            title, columns, _ = REPORTS[name]
+            rows = report(aggregates, name, args.limit)
+            if args.format == 'json':
+                output.setdefault(log_type, {})[name] = [dict(zip(columns, row)) for row in rows]
+            else:
+                print_report(f'{log_type.upper()} - {title}', columns, rows)
+
+    if args.format == 'json':
+        json.dump(output, sys.stdout, indent=2)
+        print()
+
+
+def approximate(args, files):
+    results = {}
+    for log_type, paths in sorted(files.items()):
+        started = time.time()
+        results[log_type] = analyze(log_type, paths, args.workers, args.start, args.end, approximate=True)
+        logger.info('%s: %d files, %d lines (%d invalid) in %.1f s', log_type.upper(), len(paths),
+                    results[log_type][1], results[log_type][2], time.time() - started)
+    if args.save_sketches:
+        save_sketches(args.save_sketches, results)
+    for path in args.load_sketches:
+        for log_type, loaded in load_sketches(path).items():
+            results[log_type] = merge_sketches([results[log_type], loaded] if log_type in results else [loaded])
+
+    output = {}
+    for log_type, (sketches, lines, invalid_lines) in sorted(results.items()):
+        logger.info('%s: %d lines in total', log_type.upper(), lines)
+        for name in args.report or APPROXIMATE_REPORTS:
+            if name not in APPROXIMATE_REPORTS:
+                continue
+            title, columns, _ = APPROXIMATE_REPORTS[name]
+            rows = approximate_report(sketches, name, args.limit)
+            if args.format == 'json':
+                output.setdefault(log_type, {})[name] = [dict(zip(columns, row)) for row in rows]
+            else:
+                print_report(f'{log_type.upper()} - {title}', columns, rows)
+
+    if args.format == 'json':
+        json.dump(output, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -17,7 +17,11 @@ app = App()
 
 
 # Define the stack 
-stack = AthenaStack(app, 'AthenaElbLogStack', env={'region': region})
+stack = AthenaStack(app, 'AthenaElbLogStack', env={'region': region},
+                    bytes_scanned_cutoff_per_query=defaults.getint('bytes_scanned_cutoff_per_query', fallback=None),
+                    daily_bytes_scanned_limit=defaults.getint('daily_bytes_scanned_limit', fallback=None),
+                    alarm_email=defaults.get('alarm_email'),
+                    nested_stacks=defaults.getboolean('nested_stacks', fallback=False))
 stack.template_options.description = 'Athena & Glue resources for ELB Access Logs analysis'
 
 # Example for ALB 
@@ -40,4 +44,33 @@ stack.athena_alb('main_logs_cross_account', alb_bucket_name, bucket_account='123
 alb_bucket_name = 'amzn-s3-demo-bucket-alb-access-log' # replace this value with your actual bucket name
 stack.athena_alb('main_logs_cross_account', alb_bucket_name, bucket_prefix='myalb1')
 
+# Example for ALB with a Parquet copy of the logs, converted every day, that the named queries read
+# alb_bucket_name = 'amzn-s3-demo-bucket-alb-access-log' # replace this value with your actual bucket name
+# stack.athena_alb('main_logs_parquet', alb_bucket_name, parquet=True)
+
+# Example for ALB with hourly and daily rollup tables for dashboard queries
+# alb_bucket_name = 'amzn-s3-demo-bucket-alb-access-log' # replace this value with your actual bucket name
+# stack.athena_alb('main_logs_rollups', alb_bucket_name, rollups=True)
+
+# Example for ALB logs of several accounts and regions delivered to the same bucket
+# alb_bucket_name = 'amzn-s3-demo-bucket-alb-access-log' # replace this value with your actual bucket name
+# stack.athena_alb('central_logs', alb_bucket_name, accounts=['111111111111', '222222222222'], regions=['us-east-1', 'eu-west-1'])
+
+# Example for ALB with a Parquet table filled by a Lambda function as the log files are delivered
+# alb_bucket_name = 'amzn-s3-demo-bucket-alb-access-log' # replace this value with your actual bucket name
+# stack.athena_alb('main_logs_live', alb_bucket_name, live_parquet=True,
+#                  pyarrow_layer_arn='arn:aws:lambda:us-east-1:336392948345:layer:AWSSDKPandas-Python312:13')
+
+# Example for ALB with CloudWatch latency percentiles per target IP and URL path prefix
+# alb_bucket_name = 'amzn-s3-demo-bucket-alb-access-log' # replace this value with your actual bucket name
+# stack.athena_alb('main_logs_latency', alb_bucket_name, latency_metrics=True)
+
+# Example for ALB with the LCU queries counting the 25 rules of its listener
+# alb_bucket_name = 'amzn-s3-demo-bucket-alb-access-log' # replace this value with your actual bucket name
+# stack.athena_alb('main_logs_lcu', alb_bucket_name, lcu_rules=25)
+
+# Example for ALB connection logs (TLS handshake latency, mTLS verification), delivered to their own prefix
+# connection_bucket_name = 'amzn-s3-demo-bucket-alb-connection-log' # replace this value with your actual bucket name
+# stack.athena_alb_connection('main_connections', connection_bucket_name, bucket_prefix='connections')
+
 app.synth()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# Measures the lines/sec and bytes/sec of the regexes of the log tables (elb_logs.formats) and
+# of the local parser, on synthetic logs (elb_logs.generator) or on given log files, and the
+# number of lines that do not match, so that regex and schema changes are judged on measurements.
+#
+# Usage:
+# benchmark_parser.py [--type alb|clb|nlb ...] [--lines <value>] [--escape-rate <value>] [--seed <value>]
+# benchmark_parser.py --type alb --files <log file> [<log file> ...]
+
+import argparse
+import os
+import re
+import tempfile
+import time
+
+from elb_logs.formats import FORMATS
+from elb_logs.generator import LogGenerator
+from elb_logs.parser import LogParser, open_log
+
+# Fields of a typical query: top talkers and errors
+QUERY_FIELDS = ('elb', 'client_ip', 'elb_status_code', 'received_bytes')
+
+
+def measure(function):
+    started = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - started
+
+
+def benchmark(log_type, paths):
+    # Returns the size of the lines and [(benchmark, lines, invalid lines, seconds)]
+    lines = []
+    for path in paths:
+        with open_log(path) as f:
+            lines.extend(f)
+    size = sum(len(line) for line in lines)
+    results = []
+
+    # Regex of the table only, on lines in memory
+    match = re.compile(FORMATS[log_type][1]).fullmatch
+    matched, seconds = measure(lambda: sum(1 for line in lines if match(line.rstrip('\n'))))
+    results.append(('table regex (in memory)', len(lines), len(lines) - matched, seconds))
+
+    # Local parser, typed values of all the fields / of a few fields, on lines in memory
+    names = [name for name, _ in FORMATS[log_type][0]]
+    query_fields = [name for name in QUERY_FIELDS if name in names]
+    for name, fields in (('parser, all fields (in memory)', None),
+                         (f'parser, {len(query_fields)} fields (in memory)', query_fields)):
+        parser = LogParser(log_type, fields=fields)
+        _, seconds = measure(lambda: sum(1 for _ in parser.parse(lines)))
+        results.append((name, len(lines), parser.invalid_lines, seconds))
+
+    # Local parser on the gzip files, decompression included
+    parser = LogParser(log_type)
+    _, seconds = measure(lambda: sum(1 for path in paths for _ in parser.parse_file(path)))
+    results.append(('parser, all fields (gzip files)', len(lines), parser.invalid_lines, seconds))
+    return size, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the log table regexes and the local parser')
+    parser.add_argument('--type', action='append', choices=['alb', 'clb', 'nlb'],
+                        help='Log type, repeat for several, default all')
+    parser.add_argument('--lines', type=int, default=200000, help='Number of synthetic lines per log type')
+    parser.add_argument('--escape-rate', type=float, default=0.001,
+                        help='Rate of synthetic user agents with escaped double quotes')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--files', nargs='+', help='Log files to use instead of synthetic logs (one --type)')
+    args = parser.parse_args()
+    log_types = args.type or ['alb', 'clb', 'nlb']
+    if args.files and len(log_types) != 1:
+        parser.error('--files needs one --type')
+
+    print(f"{'log':<4} {'benchmark':<34} {'lines':>9} {'invalid':>8} {'lines/s':>10} {'MB/s':>7}")
+    with tempfile.TemporaryDirectory() as directory:
+        for log_type in log_types:
+            paths = args.files
+            if not paths:
+                generator = LogGenerator(log_type, escape_rate=args.escape_rate, seed=args.seed)
+                paths = generator.write_files(os.path.join(directory, log_type), args.lines)
+            size, results = benchmark(log_type, paths)
+            for name, lines, invalid_lines, seconds in results:
+                print(f'{log_type:<4} {name:<34} {lines:>9} {invalid_lines:>8} {lines / seconds:>10.0f} '
+                      f'{size / seconds / 1024 ** 2:>7.1f}')
+
+
+if __name__ == '__main__':
+    main()
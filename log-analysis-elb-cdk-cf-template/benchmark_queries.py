@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# Runs every named query of AthenaStack once and records the bytes scanned, the engine time
+# and the queue time of each query, so that changes to the query pack are judged on their
+# measured cost.
+#
+# Result reuse is disabled, each query scans the logs. The INSERT queries (Parquet and rollup
+# backfills) are not run. The prepared statements are run with the --param values, in the order
+# of their '?', and are skipped when no --param is given.
+#
+# Usage:
+# benchmark_queries.py [--stack <value>] [--region <value>] [--filter <value>]
+# [--param <value> ...] [--output <file>] [--compare <previous output file>]
+#
+# e.g. benchmark_queries.py --filter tls_version --param -30 --param "'app/my-alb/1234567890abcdef'"
+
+import argparse
+import csv
+import logging
+import os
+import sys
+from configparser import ConfigParser
+
+import boto3
+from botocore.exceptions import ClientError
+
+from query_runner import STACK_NAME, list_queries, stack_names, wait_for_query
+
+FIELDS = ['name', 'state', 'data_scanned_bytes', 'engine_time_ms', 'queue_time_ms',
+          'total_time_ms', 'query_execution_id']
+
+logger = logging.getLogger(__name__)
+
+
+def benchmark_query(athena, work_group, database, sql, parameters=()):
+    kwargs = {}
+    if parameters:
+        kwargs['ExecutionParameters'] = list(parameters)
+    execution_id = athena.start_query_execution(
+        QueryString=sql,
+        QueryExecutionContext={'Database': database},
+        WorkGroup=work_group,
+        **kwargs)['QueryExecutionId']
+    execution = wait_for_query(athena, execution_id)
+    statistics = execution.get('Statistics', {})
+    return {
+        'state': execution['Status']['State'],
+        'data_scanned_bytes': statistics.get('DataScannedInBytes', 0),
+        'engine_time_ms': statistics.get('EngineExecutionTimeInMillis', 0),
+        'queue_time_ms': statistics.get('QueryQueueTimeInMillis', 0),
+        'total_time_ms': statistics.get('TotalExecutionTimeInMillis', 0),
+        'query_execution_id': execution_id,
+    }
+
+
+def run_benchmark(athena, work_group, database, name_filter=None, parameters=()):
+    results = []
+    queries = list_queries(athena, work_group)
+    for name, (query_database, sql, prepared, _) in sorted(queries.items()):
+        if prepared and not parameters:
+            continue
+        if not prepared and sql.lstrip().upper().startswith('INSERT'):
+            continue
+        if name_filter and name_filter not in name:
+            continue
+        if prepared:
+            result = benchmark_query(athena, work_group, database, f'EXECUTE {name}', parameters)
+        else:
+            result = benchmark_query(athena, work_group, query_database, sql)
+        result['name'] = name
+        logger.info('%s: %s, %d bytes, engine %d ms, queue %d ms', name, result['state'],
+                    result['data_scanned_bytes'], result['engine_time_ms'], result['queue_time_ms'])
+        results.append(result)
+    return results
+
+
+def compare(results, previous_file):
+    with open(previous_file, newline='') as f:
+        previous = {row['name']: row for row in csv.DictReader(f)}
+    print(f"{'query':<80} {'scanned MB':>12} {'delta':>8} {'engine ms':>10} {'delta':>8}")
+    for result in results:
+        before = previous.get(result['name'])
+        scanned = result['data_scanned_bytes'] / 1024 ** 2
+        line = f"{result['name'][:80]:<80} {scanned:>12.1f}"
+        if before:
+            line += f" {change(int(before['data_scanned_bytes']), result['data_scanned_bytes']):>8}"
+            line += f" {result['engine_time_ms']:>10}"
+            line += f" {change(int(before['engine_time_ms']), result['engine_time_ms']):>8}"
+        else:
+            line += f" {'new':>8} {result['engine_time_ms']:>10}"
+        print(line)
+
+
+def change(before, after):
+    if not before:
+        return '-'
+    return f'{(after - before) * 100 / before:+.0f}%'
+
+
+def main():
+    config_object = ConfigParser()
+    config_object.read(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.ini'))
+    default_region = config_object['defaults']['region'] if config_object.has_section('defaults') else None
+
+    parser = argparse.ArgumentParser(description='Run the named queries of AthenaStack and record their cost')
+    parser.add_argument('--stack', default=STACK_NAME, help='Name of the AthenaStack stack')
+    parser.add_argument('--region', default=default_region, help='Region of the stack')
+    parser.add_argument('--filter', help='Run only the queries with this text in the name')
+    parser.add_argument('--param', action='append', default=[],
+                        help='Prepared statement parameter (SQL literal), repeat in order')
+    parser.add_argument('--output', help='CSV file for the results, default stdout')
+    parser.add_argument('--compare', help='CSV file of a previous run to compare with')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    athena = boto3.client('athena', region_name=args.region)
+    work_group, database = stack_names(args.stack)
+
+    try:
+        results = run_benchmark(athena, work_group, database, args.filter, args.param)
+    except ClientError as e:
+        logger.error(e)
+        sys.exit(1)
+
+    if args.output:
+        with open(args.output, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
+    if args.compare:
+        compare(results, args.compare)
+    elif not args.output:
+        writer = csv.DictWriter(sys.stdout, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+# Local equivalents of the named queries of AthenaStack, over downloaded log files.
+#
+# Files are split in batches across a process pool, each process aggregates its batch into
+# Counters (partial aggregates) and the Counters of the batches are added up, so the result
+# is the same as a single pass over all the files.
+#
+# The approximate reports count the clients in sketches (elb_logs.sketches) instead of Counters,
+# so memory does not grow with the number of clients. The sketches of the batches are merged the
+# same way, and can be saved and merged with the sketches of other days.
+
+import json
+import os
+import re
+from collections import Counter
+from multiprocessing import Pool
+
+from elb_logs.parser import LogParser
+from elb_logs.sketches import CountMinSketch, DistinctSketch, TopKSketch
+
+# Fields of each log type used by the reports, None when the log type does not have the field
+LOG_FIELDS = {
+    'alb': {'protocol': 'ssl_protocol', 'cipher': 'ssl_cipher', 'type': 'type', 'target': 'target_ip',
+            'status': 'elb_status_code', 'target_status': 'target_status_code', 'tls10': 'TLSv1'},
+    'clb': {'protocol': 'ssl_protocol', 'cipher': 'ssl_cipher', 'type': None, 'target': 'target_ip',
+            'status': 'elb_status_code', 'target_status': 'target_status_code', 'tls10': 'TLSv1'},
+    'nlb': {'protocol': 'tls_protocol_version', 'cipher': 'tls_cipher', 'type': None, 'target': 'destination_ip',
+            'status': None, 'target_status': None, 'tls10': 'tlsv1'},
+}
+
+# Report name: (title, columns, limit), the columns are the key fields followed by the values
+REPORTS = {
+    'tls_versions': ('TLS Version', ('elb', 'tls_protocol', 'percentage', 'requests'), None),
+    'tls_ciphers': ('TLS Ciphersuites', ('elb', 'tls_cipher', 'percentage', 'requests'), None),
+    'tls_combined': ('TLS Version and Ciphersuites combined', ('elb', 'tls_cipher', 'tls_protocol', 'requests'), None),
+    'request_types': ('Request Type', ('elb', 'type', 'percentage', 'requests'), None),
+    'top_talkers': ('Top 10 talkers - Requests', ('elb', 'client_ip', 'requests'), 10),
+    'top_talkers_megabytes': ('Top 10 talkers - Megabytes', ('elb', 'client_ip', 'client_data_received_megabytes'), 10),
+    'tls10_talkers': ('Top 10 TLS 1.0 talkers', ('elb', 'client_ip', 'requests'), 10),
+    'target_distribution': ('Target Distribution', ('elb', 'target_ip', 'backend_traffic_percentage', 'requests'), None),
+    'lb_errors': ('LB 4xx and 5xx errors', ('elb', 'elb_status_code', 'requests'), None),
+    'target_errors': ('Target 4xx and 5xx errors', ('elb', 'target_ip', 'target_status_code', 'requests'), None),
+    'request_size': ('Avg Request/Response size', ('elb', 'avg_request_response_kilobytes', 'requests'), None),
+}
+
+# Approximate reports: (title, columns, limit), max_error is the maximum overcount of the row
+APPROXIMATE_REPORTS = {
+    'distinct_clients': ('Distinct clients (approximate)',
+                         ('elb', 'distinct_clients', 'distinct_tls10_clients', 'requests'), None),
+    'top_talkers': ('Top 10 talkers - Requests (approximate)', ('elb', 'client_ip', 'requests', 'max_error'), 10),
+    'top_talkers_megabytes': ('Top 10 talkers - Megabytes (approximate)',
+                              ('elb', 'client_ip', 'client_data_received_megabytes', 'max_error'), 10),
+    'tls10_talkers': ('Top 10 TLS 1.0 talkers (approximate)', ('elb', 'client_ip', 'requests', 'max_error'), 10),
+}
+
+# Sketches per elb of the approximate reports; the Count-Min sketches bound the counts of the
+# top talkers, which add up the errors of the top-k sketches when days are merged
+SKETCH_TYPES = {
+    'distinct_clients': DistinctSketch,
+    'distinct_tls10_clients': DistinctSketch,
+    'top_talkers': TopKSketch,
+    'top_talkers_megabytes': TopKSketch,
+    'tls10_talkers': TopKSketch,
+    'client_requests': CountMinSketch,
+    'client_received_bytes': CountMinSketch,
+}
+
+# Reports that need fields the log type does not have
+UNSUPPORTED_REPORTS = {
+    'alb': (),
+    'clb': ('request_types',),
+    'nlb': ('request_types', 'lb_errors', 'target_errors'),
+}
+
+# <account>_elasticloadbalancing_<region>_<app|net>.<name>.<id>_<time>_<ip>_<random>.log.gz, CLB
+# file names have the load balancer name only
+LOG_FILE_TYPE = re.compile(r'_elasticloadbalancing_[a-z0-9-]+_(app|net)\.')
+
+
+def log_type_of(path):
+    match = LOG_FILE_TYPE.search(os.path.basename(path))
+    if match is None:
+        return 'clb'
+    return 'alb' if match.group(1) == 'app' else 'nlb'
+
+
+def find_log_files(paths):
+    # Log files of the given files and directories (recursively), grouped by log type
+    files = {}
+    for path in paths:
+        if os.path.isdir(path):
+            candidates = [os.path.join(root, name) for root, _, names in os.walk(path) for name in names]
+        else:
+            candidates = [path]
+        for candidate in candidates:
+            # Connection logs (conn_log.*) have no requests
+            if candidate.endswith(('.log', '.log.gz')) and not os.path.basename(candidate).startswith('conn_log.'):
+                files.setdefault(log_type_of(candidate), []).append(candidate)
+    return files
+
+
+def analyze_files(log_type, paths, start=None, end=None):
+    # Partial aggregates of a batch of files; start / end are ISO 8601 times compared with 'time'
+    fields = LOG_FIELDS[log_type]
+    selected = ['time', 'elb', 'client_ip', 'received_bytes', 'sent_bytes', fields['protocol'], fields['cipher'],
+                fields['type'] or 'elb', fields['target'], fields['status'] or 'elb', fields['target_status'] or 'elb']
+    parser = LogParser(log_type, fields=selected)
+    has_status = fields['status'] is not None
+    tls10 = fields['tls10']
+
+    aggregates = {name: Counter() for name in [*REPORTS, 'requests_per_elb', 'tls_requests_per_elb']}
+    requests, tls_requests = aggregates['requests_per_elb'], aggregates['tls_requests_per_elb']
+    tls_versions, tls_ciphers = aggregates['tls_versions'], aggregates['tls_ciphers']
+    tls_combined, request_types = aggregates['tls_combined'], aggregates['request_types']
+    top_talkers, top_talkers_bytes = aggregates['top_talkers'], aggregates['top_talkers_megabytes']
+    tls10_talkers, targets = aggregates['tls10_talkers'], aggregates['target_distribution']
+    lb_errors, target_errors, request_bytes = aggregates['lb_errors'], aggregates['target_errors'], aggregates['request_size']
+
+    lines = 0
+    for path in paths:
+        for (time, elb, client_ip, received_bytes, sent_bytes, protocol, cipher,
+             request_type, target, status, target_status) in parser.parse_file(path):
+            if (start and time < start) or (end and time > end):
+                continue
+            lines += 1
+            requests[elb] += 1
+            top_talkers[elb, client_ip] += 1
+            top_talkers_bytes[elb, client_ip] += received_bytes or 0
+            request_bytes[elb] += (sent_bytes or 0) + (received_bytes or 0)
+            if protocol != '-':
+                tls_requests[elb] += 1
+                tls_versions[elb, protocol] += 1
+                tls_ciphers[elb, cipher] += 1
+                tls_combined[elb, cipher, protocol] += 1
+                if protocol == tls10:
+                    tls10_talkers[elb, client_ip] += 1
+            if target:
+                targets[elb, target] += 1
+            if log_type == 'alb':
+                request_types[elb, request_type] += 1
+            if has_status:
+                if status is not None and 400 <= status <= 599:
+                    lb_errors[elb, status] += 1
+                if target_status is not None and 400 <= target_status <= 599:
+                    target_errors[elb, target, target_status] += 1
+    return aggregates, lines, parser.invalid_lines
+
+
+def sketch_files(log_type, paths, start=None, end=None):
+    # Partial sketches of a batch of files: {name: {elb: sketch}} and the requests per elb
+    fields = LOG_FIELDS[log_type]
+    parser = LogParser(log_type, fields=['time', 'elb', 'client_ip', 'received_bytes', fields['protocol']])
+    tls10 = fields['tls10']
+
+    sketches = {name: {} for name in SKETCH_TYPES}
+    requests = Counter()
+    elb_sketches = {}
+    lines = 0
+    for path in paths:
+        for time, elb, client_ip, received_bytes, protocol in parser.parse_file(path):
+            if (start and time < start) or (end and time > end):
+                continue
+            lines += 1
+            requests[elb] += 1
+            if elb not in elb_sketches:
+                for name, sketch_type in SKETCH_TYPES.items():
+                    sketches[name][elb] = sketch_type()
+                elb_sketches[elb] = [sketches[name][elb] for name in SKETCH_TYPES]
+            (distinct_clients, distinct_tls10_clients, top_talkers, top_talkers_bytes, tls10_talkers,
+             client_requests, client_received_bytes) = elb_sketches[elb]
+            distinct_clients.add(client_ip)
+            top_talkers.add(client_ip)
+            client_requests.add(client_ip)
+            if received_bytes:
+                top_talkers_bytes.add(client_ip, received_bytes)
+                client_received_bytes.add(client_ip, received_bytes)
+            if protocol == tls10:
+                distinct_tls10_clients.add(client_ip)
+                tls10_talkers.add(client_ip)
+    sketches['requests_per_elb'] = requests
+    return sketches, lines, parser.invalid_lines
+
+
+def _analyze_batch(args):
+    return analyze_files(*args)
+
+
+def _sketch_batch(args):
+    return sketch_files(*args)
+
+
+def split_files(paths, parts):
+    # Batches of about the same size, largest files first so that no batch ends up last with a big file
+    batches = [[] for _ in range(parts)]
+    sizes = [0] * parts
+    for path in sorted(paths, key=os.path.getsize, reverse=True):
+        i = sizes.index(min(sizes))
+        batches[i].append(path)
+        sizes[i] += os.path.getsize(path)
+    return [batch for batch in batches if batch]
+
+
+def analyze(log_type, paths, workers=None, start=None, end=None, approximate=False):
+    # Returns the merged aggregates (sketches when approximate) of the files, the number of lines
+    # and the number of invalid lines
+    workers = workers or os.cpu_count() or 1
+    batch_function, merge_function = (_sketch_batch, merge_sketches) if approximate else (_analyze_batch, merge)
+    # A few batches per process, so that the processes that finish first take the remaining batches
+    batches = split_files(paths, min(len(paths), workers * 4))
+    tasks = [(log_type, batch, start, end) for batch in batches]
+    if workers == 1 or len(batches) == 1:
+        return merge_function(map(batch_function, tasks))
+    with Pool(workers) as pool:
+        return merge_function(pool.imap_unordered(batch_function, tasks))
+
+
+def merge(results):
+    aggregates, lines, invalid_lines = {}, 0, 0
+    for partial, partial_lines, partial_invalid_lines in results:
+        for name, counter in partial.items():
+            aggregates.setdefault(name, Counter()).update(counter)
+        lines += partial_lines
+        invalid_lines += partial_invalid_lines
+    return aggregates, lines, invalid_lines
+
+
+def merge_sketches(results):
+    sketches, lines, invalid_lines = {name: {} for name in SKETCH_TYPES}, 0, 0
+    sketches['requests_per_elb'] = Counter()
+    for partial, partial_lines, partial_invalid_lines in results:
+        for name, elb_sketches in partial.items():
+            if name == 'requests_per_elb':
+                sketches[name].update(elb_sketches)
+                continue
+            for elb, sketch in elb_sketches.items():
+                if elb in sketches[name]:
+                    sketches[name][elb].merge(sketch)
+                else:
+                    sketches[name][elb] = sketch
+        lines += partial_lines
+        invalid_lines += partial_invalid_lines
+    return sketches, lines, invalid_lines
+
+
+def save_sketches(path, results):
+    # results: {log_type: (sketches, lines, invalid lines)}, as JSON
+    data = {}
+    for log_type, (sketches, lines, invalid_lines) in results.items():
+        data[log_type] = {
+            'lines': lines,
+            'invalid_lines': invalid_lines,
+            'requests_per_elb': dict(sketches['requests_per_elb']),
+            'sketches': {name: {elb: sketch.to_dict() for elb, sketch in sketches[name].items()}
+                         for name in SKETCH_TYPES},
+        }
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+
+def load_sketches(path):
+    with open(path) as f:
+        data = json.load(f)
+    results = {}
+    for log_type, saved in data.items():
+        sketches = {name: {elb: SKETCH_TYPES[name].from_dict(sketch) for elb, sketch in elb_sketches.items()}
+                    for name, elb_sketches in saved['sketches'].items()}
+        sketches['requests_per_elb'] = Counter(saved['requests_per_elb'])
+        results[log_type] = (sketches, saved['lines'], saved['invalid_lines'])
+    return results
+
+
+def approximate_report(sketches, name, limit=None):
+    # Rows of an approximate report; the counts of the top talkers are the lowest of the top-k and
+    # Count-Min estimates, and max_error the difference with the lowest possible count
+    _, _, default_limit = APPROXIMATE_REPORTS[name]
+    limit = limit or default_limit
+    requests = sketches['requests_per_elb']
+
+    if name == 'distinct_clients':
+        return [(elb, sketches['distinct_clients'][elb].count(), sketches['distinct_tls10_clients'][elb].count(),
+                 requests[elb]) for elb in sorted(requests)]
+
+    counts = sketches['client_received_bytes' if name == 'top_talkers_megabytes' else 'client_requests']
+    rows = []
+    for elb, sketch in sketches[name].items():
+        for client_ip, count, error in sketch.top(limit):
+            estimate = count if name == 'tls10_talkers' else min(count, counts[elb].estimate(client_ip))
+            rows.append((elb, client_ip, estimate, estimate - (count - error)))
+    rows = sorted(rows, key=lambda row: row[2], reverse=True)[:limit]
+    if name == 'top_talkers_megabytes':
+        rows = [(elb, client_ip, round(count / 1000000.0, 2), round(error / 1000000.0, 2))
+                for elb, client_ip, count, error in rows]
+    return rows
+
+
+def report(aggregates, name, limit=None):
+    # Rows of a report, in the order of the named query
+    _, _, default_limit = REPORTS[name]
+    limit = limit or default_limit
+    counter = aggregates[name]
+    requests, tls_requests = aggregates['requests_per_elb'], aggregates['tls_requests_per_elb']
+
+    if name in ('tls_versions', 'tls_ciphers'):
+        total = sum(tls_requests.values())
+        rows = [(*key, round(count * 100.0 / total, 2), count) for key, count in counter.most_common(limit)]
+    elif name == 'request_types':
+        total = sum(requests.values())
+        rows = [(*key, round(count * 100.0 / total, 2), count) for key, count in counter.most_common(limit)]
+    elif name == 'target_distribution':
+        total = sum(counter.values())
+        rows = [(*key, round(count * 100.0 / total, 2), count) for key, count in counter.most_common(limit)]
+    elif name == 'top_talkers_megabytes':
+        rows = [(*key, round(count / 1000000.0, 2)) for key, count in counter.most_common(limit)]
+    elif name == 'request_size':
+        rows = [(elb, round(count / requests[elb] / 1000.0, 2), requests[elb])
+                for elb, count in sorted(counter.items())]
+    else:
+        rows = [(*key, count) for key, count in counter.most_common(limit)]
+    return rows
@@ -0,0 +1,125 @@
+# Field definitions of the ELB access log formats, shared by the Athena tables of AthenaStack
+# and the local parser (no CDK dependency).
+#
+# Fields are (name, Athena type) in log order, the regexes are the RegexSerDe input.regex of the
+# tables: one group per field, and a line must match the whole regex.
+#
+# https://docs.aws.amazon.com/elasticloadbalancing/latest/application/load-balancer-access-logs.html
+# https://docs.aws.amazon.com/elasticloadbalancing/latest/classic/access-log-collection.html
+# https://docs.aws.amazon.com/elasticloadbalancing/latest/network/load-balancer-access-logs.html
+# https://docs.aws.amazon.com/elasticloadbalancing/latest/application/load-balancer-connection-logs.html
+
+ALB_FIELDS = (
+    ('type', 'string'),
+    ('time', 'string'),
+    ('elb', 'string'),
+    ('client_ip', 'string'),
+    ('client_port', 'int'),
+    ('target_ip', 'string'),
+    ('target_port', 'int'),
+    ('request_processing_time', 'double'),
+    ('target_processing_time', 'double'),
+    ('response_processing_time', 'double'),
+    ('elb_status_code', 'int'),
+    ('target_status_code', 'int'),
+    ('received_bytes', 'bigint'),
+    ('sent_bytes', 'bigint'),
+    ('request_verb', 'string'),
+    ('request_url', 'string'),
+    ('request_proto', 'string'),
+    ('user_agent', 'string'),
+    ('ssl_cipher', 'string'),
+    ('ssl_protocol', 'string'),
+    ('target_group_arn', 'string'),
+    ('trace_id', 'string'),
+    ('domain_name', 'string'),
+    ('chosen_cert_arn', 'string'),
+    ('matched_rule_priority', 'string'),
+    ('request_creation_time', 'string'),
+    ('actions_executed', 'string'),
+    ('redirect_url', 'string'),
+    ('lambda_error_reason', 'string'),
+    ('target_port_list', 'string'),
+    ('target_status_code_list', 'string'),
+    ('classification', 'string'),
+    ('classification_reason', 'string'),
+)
+
+ALB_REGEX = '([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*):([0-9]*) ([^ ]*)[:-]([0-9]*) ([-.0-9]*) ([-.0-9]*) ([-.0-9]*) (|[-0-9]*) (-|[-0-9]*) ([-0-9]*) ([-0-9]*) \"([^ ]*) ([^ ]*) (- |[^ ]*)\" \"([^\"]*)\" ([A-Z0-9_-]+) ([A-Za-z0-9.-]*) ([^ ]*) \"([^\"]*)\" \"([^\"]*)\" \"([^\"]*)\" ([-.0-9]*) ([^ ]*) \"([^\"]*)\" \"([^\"]*)\" \"([^ ]*)\" \"([^s]+?)\" \"([^s]+)\" \"([^ ]*)\" \"([^ ]*)\"'
+
+CLB_FIELDS = (
+    ('time', 'string'),
+    ('elb', 'string'),
+    ('client_ip', 'string'),
+    ('client_port', 'int'),
+    ('target_ip', 'string'),
+    ('target_port', 'int'),
+    ('request_processing_time', 'double'),
+    ('target_processing_time', 'double'),
+    ('response_processing_time', 'double'),
+    ('elb_status_code', 'int'),
+    ('target_status_code', 'int'),
+    ('received_bytes', 'bigint'),
+    ('sent_bytes', 'bigint'),
+    ('request_verb', 'string'),
+    ('request_url', 'string'),
+    ('request_proto', 'string'),
+    ('user_agent', 'string'),
+    ('ssl_cipher', 'string'),
+    ('ssl_protocol', 'string'),
+)
+
+CLB_REGEX = '([^ ]*) ([^ ]*) ([^ ]*):([0-9]*) ([^ ]*)[:\-]([0-9]*) ([-.0-9]*) ([-.0-9]*) ([-.0-9]*) (|[-0-9]*) (-|[-0-9]*) ([-0-9]*) ([-0-9]*) \\\"([^ ]*) ([^ ]*) (- |[^ ]*)\\\" (\"[^\"]*\") ([A-Z0-9_-]+) ([A-Za-z0-9.-]*)$'
+
+NLB_FIELDS = (
+    ('type', 'string'),
+    ('version', 'string'),
+    ('time', 'string'),
+    ('elb', 'string'),
+    ('listener', 'string'),
+    ('client_ip', 'string'),
+    ('client_port', 'int'),
+    ('destination_ip', 'string'),
+    ('destination_port', 'int'),
+    ('connection_time', 'double'),
+    ('tls_handshake_time', 'double'),
+    ('received_bytes', 'bigint'),
+    ('sent_bytes', 'bigint'),
+    ('incoming_tls_alert', 'string'),
+    ('chosen_cert_arn', 'string'),
+    ('chosen_cert_serial', 'string'),
+    ('tls_cipher', 'string'),
+    ('tls_protocol_version', 'string'),
+    ('tls_named_group', 'string'),
+    ('domain_name', 'string'),
+    ('alpn_fe_protocol', 'string'),
+    ('alpn_be_protocol', 'string'),
+    ('alpn_client_preference_list', 'string'),
+)
+
+NLB_REGEX = '([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*):([0-9]*) ([^ ]*)[:-]([0-9]*) ([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*)'
+
+ALB_CONNECTION_FIELDS = (
+    ('time', 'string'),
+    ('client_ip', 'string'),
+    ('client_port', 'int'),
+    ('listener_port', 'int'),
+    ('tls_protocol', 'string'),
+    ('tls_cipher', 'string'),
+    ('tls_handshake_latency', 'double'),
+    ('leaf_client_cert_subject', 'string'),
+    ('leaf_client_cert_validity', 'string'),
+    ('leaf_client_cert_serial_number', 'string'),
+    ('tls_verify_status', 'string'),
+    ('conn_trace_id', 'string'),
+)
+
+# The last group takes the fields that ALB may add at the end of the line
+ALB_CONNECTION_REGEX = '([^ ]*) ([^ ]*) ([0-9]*) ([0-9]*) ([A-Za-z0-9.-]*) ([^ ]*) ([-.0-9]*) \"([^\"]*)\" ([^ ]*) ([^ ]*) ([^ ]*) ?([^ ]*)?( .*)?'
+
+FORMATS = {
+    'alb': (ALB_FIELDS, ALB_REGEX),
+    'clb': (CLB_FIELDS, CLB_REGEX),
+    'nlb': (NLB_FIELDS, NLB_REGEX),
+    'alb_connection': (ALB_CONNECTION_FIELDS, ALB_CONNECTION_REGEX),
+}
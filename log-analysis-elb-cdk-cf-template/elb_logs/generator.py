@@ -0,0 +1,188 @@
+# Synthetic ALB, CLB and NLB access logs, in the formats of elb_logs.formats, to test and
+# benchmark the regexes of the log tables and the local parser.
+#
+# Lines are in time order over the time span, client IPs are skewed so that a few clients are
+# top talkers, and the error rate, the TLS mix and the rate of user agents with escaped quotes
+# (that the regexes of the tables do not match) are configurable.
+
+import gzip
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+# TLS protocol (ALB / CLB names): cipher suite
+TLS_CIPHERS = {
+    'TLSv1.3': 'TLS_AES_128_GCM_SHA256',
+    'TLSv1.2': 'ECDHE-RSA-AES128-GCM-SHA256',
+    'TLSv1.1': 'ECDHE-RSA-AES128-SHA',
+    'TLSv1': 'ECDHE-RSA-AES128-SHA',
+}
+
+# '-' is plain HTTP / TCP
+TLS_MIX = {'-': 0.2, 'TLSv1.2': 0.55, 'TLSv1.3': 0.2, 'TLSv1': 0.05}
+
+USER_AGENTS = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 14_4) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Safari/605.1.15',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148',
+    'curl/8.4.0',
+    'python-requests/2.31.0',
+    'ELB-HealthChecker/2.0',
+    'aws-sdk-java/1.12.700 Linux/5.10 OpenJDK_64-Bit_Server_VM/17.0.10',
+)
+
+# ELB escapes the double quotes of the user agent
+ESCAPED_USER_AGENT = 'Mozilla/5.0 (compatible; \\"Crawler\\"; +https://example.com/bot)'
+
+PATHS = ('/', '/index.html', '/api/v1/items', '/api/v1/items/42', '/api/v1/orders', '/login', '/static/app.js',
+         '/static/style.css', '/health', '/search?q=elb+logs')
+VERBS = ('GET', 'GET', 'GET', 'GET', 'POST', 'PUT', 'DELETE')
+CLIENT_ERRORS = (400, 403, 404, 404, 404)
+SERVER_ERRORS = (500, 502, 503, 504)
+
+
+class LogGenerator:
+
+    def __init__(self, log_type, start=None, span=timedelta(hours=1), error_rate=0.02, tls_mix=None,
+                 escape_rate=0.0, clients=1000, targets=4, elb_name='my-loadbalancer', seed=None):
+        if log_type not in ('alb', 'clb', 'nlb'):
+            raise ValueError(f'Unknown log type {log_type}, expected one of alb, clb, nlb')
+        self.log_type = log_type
+        self.start = start or datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0) - span
+        self.span = span
+        self.error_rate = error_rate
+        self.escape_rate = escape_rate
+        self.random = random.Random(seed)
+        tls_mix = tls_mix or TLS_MIX
+        self.protocols, self.protocol_weights = list(tls_mix), list(tls_mix.values())
+        self.clients = [f'{self.random.randint(1, 223)}.{self.random.randint(0, 255)}.'
+                        f'{self.random.randint(0, 255)}.{self.random.randint(1, 254)}' for _ in range(clients)]
+        self.targets = [f'10.0.{i // 250}.{10 + i % 250}' for i in range(targets)]
+        elb_id = '%016x' % self.random.getrandbits(64)
+        self.elb = {'alb': f'app/{elb_name}/{elb_id}', 'clb': elb_name, 'nlb': f'net/{elb_name}/{elb_id}'}[log_type]
+        self.file_elb = self.elb.replace('/', '.')
+        self.domain = f'{elb_name}-{elb_id[:8]}.elb.us-east-1.amazonaws.com'
+        self.target_group = f'arn:aws:elasticloadbalancing:us-east-1:123456789012:targetgroup/{elb_name}-tg/{elb_id}'
+        self.certificate = 'arn:aws:acm:us-east-1:123456789012:certificate/2a108f19-aded-46b0-8493-c63eb1ef4a99'
+        self._format = getattr(self, f'_{log_type}_line')
+
+    def lines(self, count):
+        # count lines spread over the time span, in time order
+        step = self.span / count
+        for i in range(count):
+            yield self._format(self.start + step * (i + self.random.random()))
+
+    def _client(self):
+        # Cubed uniform index: the first clients of the list get most of the requests
+        return self.clients[int(len(self.clients) * self.random.random() ** 3)]
+
+    def _status(self):
+        # (elb status, target status), '-' when the load balancer did not get a target response
+        value = self.random.random()
+        if value >= self.error_rate:
+            return 200, 200
+        if value < self.error_rate / 2:
+            status = self.random.choice(CLIENT_ERRORS)
+            return status, status
+        status = self.random.choice(SERVER_ERRORS)
+        if status == 500:
+            return status, status
+        return status, '-'
+
+    def _user_agent(self):
+        if self.escape_rate and self.random.random() < self.escape_rate:
+            return ESCAPED_USER_AGENT
+        return self.random.choice(USER_AGENTS)
+
+    def _request(self, protocol):
+        scheme, port = ('http', 80) if protocol == '-' else ('https', 443)
+        path = self.random.choice(PATHS)
+        return f'{self.random.choice(VERBS)} {scheme}://{self.domain}:{port}{path} HTTP/1.1', scheme
+
+    def _times(self):
+        # request, target and response processing times, in seconds
+        return self.random.random() / 1000, self.random.expovariate(1 / 0.05), self.random.random() / 1000
+
+    def _alb_line(self, time):
+        rng = self.random
+        protocol = rng.choices(self.protocols, self.protocol_weights)[0]
+        cipher = TLS_CIPHERS.get(protocol, '-')
+        request, scheme = self._request(protocol)
+        status, target_status = self._status()
+        target = rng.choice(self.targets)
+        request_time, target_time, response_time = self._times()
+        if target_status == '-':
+            target_field, target_time, response_time = '-', -1, -1
+            target_port_list, target_status_list = '-', '-'
+        else:
+            target_field = f'{target}:80'
+            target_port_list, target_status_list = target_field, target_status
+        request_type = 'http' if scheme == 'http' else rng.choice(('https', 'https', 'h2'))
+        received, sent = rng.randint(100, 2000), rng.randint(200, 200000)
+        trace = f'Root=1-{int(time.timestamp()):08x}-{rng.getrandbits(96):024x}'
+        created = (time - timedelta(seconds=request_time + max(target_time, 0))).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        certificate = self.certificate if scheme == 'https' else '-'
+        domain = self.domain if scheme == 'https' else '-'
+        return (f'{request_type} {time.strftime("%Y-%m-%dT%H:%M:%S.%fZ")} {self.elb} {self._client()}:{rng.randint(1024, 65535)} '
+                f'{target_field} {request_time:.3f} {target_time:.3f} {response_time:.3f} {status} {target_status} '
+                f'{received} {sent} "{request}" "{self._user_agent()}" {cipher} {protocol} {self.target_group} '
+                f'"{trace}" "{domain}" "{certificate}" 0 {created} "forward" "-" "-" '
+                f'"{target_port_list}" "{target_status_list}" "-" "-"\n')
+
+    def _clb_line(self, time):
+        rng = self.random
+        protocol = rng.choices(self.protocols, self.protocol_weights)[0]
+        cipher = TLS_CIPHERS.get(protocol, '-')
+        request, _ = self._request(protocol)
+        status, target_status = self._status()
+        request_time, target_time, response_time = self._times()
+        if target_status == '-':
+            target_field, request_time, target_time, response_time = '-', -1, -1, -1
+        else:
+            target_field = f'{rng.choice(self.targets)}:80'
+        return (f'{time.strftime("%Y-%m-%dT%H:%M:%S.%fZ")} {self.elb} {self._client()}:{rng.randint(1024, 65535)} '
+                f'{target_field} {request_time:.6f} {target_time:.6f} {response_time:.6f} {status} {target_status} '
+                f'{rng.randint(0, 2000)} {rng.randint(200, 200000)} "{request}" "{self._user_agent()}" {cipher} {protocol}\n')
+
+    def _nlb_line(self, time):
+        rng = self.random
+        protocol = rng.choices(self.protocols, self.protocol_weights)[0]
+        if protocol == '-':
+            # TLS listener without TLS: handshake failed, the client sent an alert
+            tls = '-', '-', '-', '-', '-'
+            alert, handshake_time = '0x46', '-'
+        else:
+            tls = (self.certificate, '-', TLS_CIPHERS[protocol], protocol.lower().replace('.', ''),
+                   rng.choice(('x25519', 'secp256r1')))
+            alert, handshake_time = '-', rng.randint(1, 30)
+        return (f'tls 2.0 {time.strftime("%Y-%m-%dT%H:%M:%S")} {self.elb} {rng.getrandbits(64):016x} '
+                f'{self._client()}:{rng.randint(1024, 65535)} {rng.choice(self.targets)}:443 '
+                f'{rng.randint(1, 60000)} {handshake_time} {rng.randint(100, 5000)} {rng.randint(200, 500000)} '
+                f'{alert} {" ".join(tls[:4])} {tls[4]} {self.domain} - - -\n')
+
+    def file_name(self, time, node_ip):
+        # Name of a log file delivered by ELB, so that the log type can be told from the name
+        return (f'123456789012_elasticloadbalancing_us-east-1_{self.file_elb}_'
+                f'{time.strftime("%Y%m%dT%H%MZ")}_{node_ip}_{self.random.getrandbits(32):08x}.log.gz')
+
+    def line_count(self, size):
+        # Number of lines of about size bytes (uncompressed), from the average length of sample lines
+        sample = LogGenerator(self.log_type, self.start, self.span, self.error_rate,
+                              dict(zip(self.protocols, self.protocol_weights)), self.escape_rate, seed=0)
+        average = sum(len(line) for line in sample.lines(1000)) / 1000
+        return max(1, int(size / average))
+
+    def write_files(self, directory, count, files=1):
+        # Writes count lines in files (one per load balancer node), returns the paths
+        os.makedirs(directory, exist_ok=True)
+        handles = []
+        for i in range(files):
+            path = os.path.join(directory, self.file_name(self.start + self.span, f'10.0.100.{i + 1}'))
+            handles.append((path, gzip.open(path, 'wt', compresslevel=6)))
+        try:
+            for i, line in enumerate(self.lines(count)):
+                handles[i % files][1].write(line)
+        finally:
+            for _, handle in handles:
+                handle.close()
+        return [path for path, _ in handles]
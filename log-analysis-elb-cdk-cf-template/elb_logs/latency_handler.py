@@ -0,0 +1,159 @@
+# Lambda function of the ALB latency metrics of AthenaStack (latency_metrics=True): publishes
+# the latency of each new ALB log file per target IP and per URL path prefix as CloudWatch
+# metrics, which CloudWatch only has per load balancer and target group.
+#
+# For each of request_processing_time, target_processing_time and response_processing_time the
+# function builds a LatencySketch per target IP and per path prefix (the first PATH_DEPTH
+# segments of the path) and publishes:
+# - <Metric>P50, <Metric>P90 and <Metric>P99: the percentiles of the file
+# - <Metric>: the sketch bins as a distribution (values and counts), so that the CloudWatch
+#   percentile statistics (p99, ...) merge the files of all the load balancer nodes
+#
+# Dimensions are LoadBalancer and TargetIP or PathPrefix. Times of -1 (no target response) are
+# not counted.
+
+import gzip
+import io
+import logging
+import os
+from collections import Counter
+from datetime import datetime
+
+import boto3
+
+from elb_logs.parser import LogParser
+from elb_logs.s3_events import log_objects
+from elb_logs.sketches import LatencySketch
+
+NAMESPACE = os.environ.get('NAMESPACE', 'ELBLogs/Latency')
+PATH_DEPTH = int(os.environ.get('PATH_DEPTH', '1'))
+# Path prefixes with the most requests get their own metrics, the others are 'other'
+MAX_PATH_PREFIXES = int(os.environ.get('MAX_PATH_PREFIXES', '50'))
+PERCENTILES = (50, 90, 99)
+METRICS = (
+    ('request_processing_time', 'RequestProcessingTime'),
+    ('target_processing_time', 'TargetProcessingTime'),
+    ('response_processing_time', 'ResponseProcessingTime'),
+)
+FIELDS = ('time', 'elb', 'target_ip', 'request_url') + tuple(field for field, _ in METRICS)
+# Metric data per PutMetricData request, and values + counts of their distributions: a request
+# is at most 1 MB, and a distribution datum has up to 150 values and 150 counts
+BATCH_SIZE = 500
+BATCH_VALUES = 1000
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+s3 = boto3.client('s3')
+cloudwatch = boto3.client('cloudwatch')
+
+
+def path_prefix(url, depth=PATH_DEPTH):
+    # 'https://example.com:443/api/v1/items?id=1' is '/api' with depth 1
+    path = url.split('://', 1)[-1]
+    start = path.find('/')
+    path = path[start:].split('?', 1)[0] if start >= 0 else '/'
+    return '/' + '/'.join([segment for segment in path.split('/') if segment][:depth])
+
+
+def sketch_lines(rows):
+    # Returns {(elb, dimension name, dimension value): [sketch per metric]} and the last time
+    sketches = {}
+    last_time = ''
+    for row in rows:
+        time, elb, target_ip, request_url = row[:4]
+        if time > last_time:
+            last_time = time
+        keys = [(elb, 'PathPrefix', path_prefix(request_url))]
+        if target_ip:
+            keys.append((elb, 'TargetIP', target_ip))
+        for key in keys:
+            key_sketches = sketches.get(key)
+            if key_sketches is None:
+                key_sketches = sketches[key] = [LatencySketch() for _ in METRICS]
+            for sketch, value in zip(key_sketches, row[4:]):
+                if value is not None and value >= 0:
+                    sketch.add(value)
+    return sketches, last_time
+
+
+def limit_path_prefixes(sketches, max_path_prefixes=MAX_PATH_PREFIXES):
+    # Path prefixes beyond the busiest max_path_prefixes of each load balancer are merged in 'other'
+    requests = Counter()
+    for (elb, dimension, value), key_sketches in sketches.items():
+        if dimension == 'PathPrefix':
+            requests[elb, value] = max(sketch.count for sketch in key_sketches)
+    busiest = {}
+    for (elb, value), _ in requests.most_common():
+        busiest.setdefault(elb, [])
+        if len(busiest[elb]) < max_path_prefixes:
+            busiest[elb].append(value)
+    limited = {}
+    for (elb, dimension, value), key_sketches in sketches.items():
+        if dimension == 'PathPrefix' and value not in busiest[elb]:
+            key = (elb, dimension, 'other')
+            if key in limited:
+                for sketch, other in zip(limited[key], key_sketches):
+                    sketch.merge(other)
+                continue
+        else:
+            key = (elb, dimension, value)
+        limited[key] = key_sketches
+    return limited
+
+
+def metric_data(sketches, timestamp):
+    for (elb, dimension, value), key_sketches in sketches.items():
+        dimensions = [{'Name': 'LoadBalancer', 'Value': elb}, {'Name': dimension, 'Value': value}]
+        for (_, metric_name), sketch in zip(METRICS, key_sketches):
+            if not sketch.count:
+                continue
+            values, counts = sketch.histogram()
+            yield {'MetricName': metric_name, 'Dimensions': dimensions, 'Timestamp': timestamp,
+                   'Values': values, 'Counts': counts, 'Unit': 'Seconds'}
+            for percentile in PERCENTILES:
+                yield {'MetricName': f'{metric_name}P{percentile}', 'Dimensions': dimensions,
+                       'Timestamp': timestamp, 'Value': sketch.quantile(percentile / 100), 'Unit': 'Seconds'}
+
+
+def batches(data):
+    batch, values = [], 0
+    for datum in data:
+        size = len(datum.get('Values', ())) + len(datum.get('Counts', ())) or 1
+        if batch and (len(batch) == BATCH_SIZE or values + size > BATCH_VALUES):
+            yield batch
+            batch, values = [], 0
+        batch.append(datum)
+        values += size
+    if batch:
+        yield batch
+
+
+def publish(cloudwatch, data, namespace=NAMESPACE):
+    published = 0
+    for batch in batches(data):
+        cloudwatch.put_metric_data(Namespace=namespace, MetricData=batch)
+        published += len(batch)
+    return published
+
+
+def process_lines(lines):
+    parser = LogParser('alb', fields=FIELDS)
+    sketches, last_time = sketch_lines(parser.parse(lines))
+    return limit_path_prefixes(sketches), last_time, parser.invalid_lines
+
+
+def handler(event, context):
+    published = 0
+    for bucket, key in log_objects(event):
+        body = s3.get_object(Bucket=bucket, Key=key)['Body']
+        lines = io.TextIOWrapper(gzip.GzipFile(fileobj=body), encoding='utf-8', errors='replace')
+        sketches, last_time, invalid_lines = process_lines(lines)
+        if not sketches:
+            continue
+        # The entries of a file cover the 5 minutes before its last entry
+        timestamp = datetime.fromisoformat(last_time.rstrip('Z'))
+        count = publish(cloudwatch, metric_data(sketches, timestamp))
+        logger.info('s3://%s/%s: %d metric data, %d invalid lines', bucket, key, count, invalid_lines)
+        published += count
+    return {'statusCode': 200, 'body': str(published)}
@@ -0,0 +1,192 @@
+# Load balancer capacity units (LCU) of ALBs measured from their access logs, per minute, for the
+# LCU queries of AthenaStack and the local LCU analyzer (analyze_lcu.py).
+#
+# An LCU is the highest of the four dimensions below. The logs have no connection events, so a
+# connection is a client ip:port: it is active in the minutes it sends requests, and new when it
+# had no request in the previous minute (the default idle timeout is 60 seconds). Idle connections
+# are not seen, so the active connections are a lower bound.
+#
+# The rules processed per request are not logged: they are the number of rules of the listener
+# when known, else the number of matched rule priorities seen in the period.
+#
+# https://aws.amazon.com/elasticloadbalancing/pricing/
+
+import math
+import os
+import re
+from collections import defaultdict
+from datetime import datetime, timezone
+from multiprocessing import Pool
+
+from elb_logs.parser import LogParser
+
+# One LCU per dimension
+NEW_CONNECTIONS_PER_SECOND = 25
+ACTIVE_CONNECTIONS_PER_MINUTE = 3000
+# 1 GB per hour for instance and IP targets, 0.4 GB for Lambda targets
+PROCESSED_BYTES_PER_HOUR = 1000000000
+RULE_EVALUATIONS_PER_SECOND = 1000
+FREE_RULES = 10
+
+DIMENSIONS = ('new_connections', 'active_connections', 'processed_bytes', 'rule_evaluations')
+
+# <account>_elasticloadbalancing_<region>_app.<name>.<id>_<end time>_<node ip>_<random>.log.gz
+LOG_FILE_NODE = re.compile(r'_elasticloadbalancing_[a-z0-9-]+_(app\.[^_]+)_(\d{8}T\d{4}Z)_([^_]+)_')
+
+# Minutes of a node that are still open: the entries of a file are not in time order, and the
+# files of a node overlap by a few minutes
+OPEN_MINUTES = 10
+
+
+def lcus(new_connections, active_connections, processed_bytes, requests, rules):
+    # LCUs of each dimension of a minute
+    return {
+        'new_connections': new_connections / 60.0 / NEW_CONNECTIONS_PER_SECOND,
+        'active_connections': active_connections / ACTIVE_CONNECTIONS_PER_MINUTE,
+        'processed_bytes': processed_bytes * 60.0 / PROCESSED_BYTES_PER_HOUR,
+        'rule_evaluations': requests / 60.0 * max(rules - FREE_RULES, 0) / RULE_EVALUATIONS_PER_SECOND,
+    }
+
+
+def node_files(paths):
+    # Log files grouped by ALB node, in time order; a connection is always on the same node
+    nodes = defaultdict(list)
+    for path in paths:
+        match = LOG_FILE_NODE.search(os.path.basename(path))
+        if match is None:
+            nodes[path].append((None, path))
+            continue
+        name, end_time, ip = match.groups()
+        nodes[name, ip].append((end_time, path))
+    return [[path for _, path in sorted(files)] for files in nodes.values()]
+
+
+_minute_numbers = {}
+
+
+def _minute_number(minute):
+    # 'YYYY-MM-DDTHH:MM' to minutes since the epoch
+    if minute not in _minute_numbers:
+        _minute_numbers[minute] = int(datetime.fromisoformat(minute).replace(tzinfo=timezone.utc).timestamp()) // 60
+    return _minute_numbers[minute]
+
+
+def measure_node(paths, start=None, end=None):
+    # Per (elb, minute): [requests, processed bytes, new connections, active connections], and the
+    # matched rule priorities per elb, of the files of one node
+    parser = LogParser('alb', fields=('time', 'elb', 'client_ip', 'client_port', 'received_bytes',
+                                      'sent_bytes', 'matched_rule_priority'))
+    minutes = defaultdict(lambda: [0, 0, 0, 0])
+    priorities = defaultdict(set)
+    last_seen = {}
+    open_minutes = defaultdict(set)
+    latest = 0
+
+    def close(before):
+        for key in [key for key in open_minutes if _minute_number(key[1]) < before]:
+            # A minute reopened by a late entry adds the connections seen since it was closed
+            minutes[key][3] += len(open_minutes.pop(key))
+        for connection in [connection for connection, seen in last_seen.items() if seen < before - 1]:
+            del last_seen[connection]
+
+    for path in paths:
+        for time, elb, client_ip, client_port, received_bytes, sent_bytes, priority in parser.parse_file(path):
+            if (start and time < start) or (end and time > end):
+                continue
+            minute = time[:16]
+            number = _minute_number(minute)
+            counts = minutes[elb, minute]
+            counts[0] += 1
+            counts[1] += (received_bytes or 0) + (sent_bytes or 0)
+            if priority != '-':
+                priorities[elb].add(priority)
+            connection = (elb, client_ip, client_port)
+            seen = last_seen.get(connection)
+            if seen is None or number - seen > 1:
+                counts[2] += 1
+            if seen is None or number > seen:
+                last_seen[connection] = number
+            open_minutes[elb, minute].add(connection)
+            if number > latest:
+                latest = number
+                close(latest - OPEN_MINUTES)
+    close(math.inf)
+    return dict(minutes), dict(priorities), parser.invalid_lines
+
+
+def _measure_node(args):
+    return measure_node(*args)
+
+
+def measure(paths, workers=None, start=None, end=None):
+    # Merged per-minute counts of the files of all the nodes
+    workers = workers or os.cpu_count() or 1
+    tasks = [(files, start, end) for files in node_files(paths)]
+    if workers == 1 or len(tasks) == 1:
+        return merge(map(_measure_node, tasks))
+    with Pool(workers) as pool:
+        return merge(pool.imap_unordered(_measure_node, tasks))
+
+
+def merge(results):
+    # The connections of the nodes are distinct, so the counts of the nodes add up
+    minutes, priorities, invalid_lines = defaultdict(lambda: [0, 0, 0, 0]), defaultdict(set), 0
+    for node_minutes, node_priorities, node_invalid_lines in results:
+        for key, counts in node_minutes.items():
+            total = minutes[key]
+            for i, count in enumerate(counts):
+                total[i] += count
+        for elb, values in node_priorities.items():
+            priorities[elb] |= values
+        invalid_lines += node_invalid_lines
+    return dict(minutes), dict(priorities), invalid_lines
+
+
+def minute_lcus(minutes, priorities, rules=None):
+    # [(elb, minute, {dimension: LCU}, LCU)] in time order
+    rows = []
+    for (elb, minute), (requests, processed_bytes, new_connections, active_connections) in sorted(minutes.items()):
+        elb_rules = rules if rules is not None else len(priorities.get(elb, ()))
+        dimensions = lcus(new_connections, active_connections, processed_bytes, requests, elb_rules)
+        rows.append((elb, minute, dimensions, max(dimensions.values())))
+    return rows
+
+
+def percentile(values, q):
+    # Nearest rank percentile of sorted values
+    return values[min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))]
+
+
+def summary(rows):
+    # Per elb: minutes, peak LCU, its minute and dimension, percentiles, peak of each dimension and
+    # the LCU-SET value (peak rounded up)
+    per_elb = defaultdict(list)
+    for row in rows:
+        per_elb[row[0]].append(row)
+    summaries = []
+    for elb, elb_rows in sorted(per_elb.items()):
+        values = sorted(row[3] for row in elb_rows)
+        _, peak_minute, peak_dimensions, peak = max(elb_rows, key=lambda row: row[3])
+        summaries.append({
+            'elb': elb,
+            'minutes': len(elb_rows),
+            'peak_lcu': round(peak, 2),
+            'peak_minute': peak_minute,
+            'peak_dimension': max(peak_dimensions, key=peak_dimensions.get),
+            'p50_lcu': round(percentile(values, 0.5), 2),
+            'p90_lcu': round(percentile(values, 0.9), 2),
+            'p99_lcu': round(percentile(values, 0.99), 2),
+            **{f'peak_{dimension}_lcu': round(max(row[2][dimension] for row in elb_rows), 2)
+               for dimension in DIMENSIONS},
+            'lcu_set': max(1, math.ceil(peak)),
+        })
+    return summaries
+
+
+def hourly_peaks(rows):
+    # Peak LCU per elb and hour of the day (UTC), for the schedules of LCU reservations
+    peaks = defaultdict(float)
+    for elb, minute, _, lcu in rows:
+        key = (elb, int(minute[11:13]))
+        peaks[key] = max(peaks[key], lcu)
+    return [(elb, hour, round(lcu, 2), max(1, math.ceil(lcu))) for (elb, hour), lcu in sorted(peaks.items())]
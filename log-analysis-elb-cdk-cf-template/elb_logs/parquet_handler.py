@@ -0,0 +1,157 @@
+# Lambda function of the live Parquet tables of AthenaStack (live_parquet=True): converts each
+# new log file to a Parquet file and registers its partition in Glue, so that the table is
+# minutes behind the load balancer instead of a day.
+#
+# The log file is read from S3 as a stream (gzip decompressed on the fly) and written to Parquet
+# in row groups of BATCH_ROWS rows, the columns and the location come from the Glue table.
+# The Parquet file is named after the log file, so a retried event overwrites the same file.
+#
+# Needs pyarrow (Lambda layer). For tests against a local S3 / Glue stand-in set
+# AWS_ENDPOINT_URL_S3 and AWS_ENDPOINT_URL_GLUE and run:
+# python -m elb_logs.parquet_handler --database <db> --table <table> --type alb s3://<bucket>/<key>
+
+import argparse
+import gzip
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+from datetime import datetime
+from itertools import islice
+
+import boto3
+import pyarrow as pa
+import pyarrow.parquet as pq
+from botocore.exceptions import ClientError
+
+from elb_logs.parser import LogParser
+from elb_logs.s3_events import log_objects
+
+BATCH_ROWS = 100000
+
+# Arrow types of the Glue column types
+ARROW_TYPES = {
+    'string': pa.string(),
+    'int': pa.int32(),
+    'bigint': pa.int64(),
+    'double': pa.float64(),
+    'timestamp': pa.timestamp('us'),
+}
+
+# [<prefix>/]AWSLogs/<account>/elasticloadbalancing/<region>/<year>/<month>/<day>/<file>.log.gz,
+# except the connection logs (conn_log.<file>.log.gz) that ALB writes to the same path
+LOG_KEY = re.compile(r'AWSLogs/(\d{12})/elasticloadbalancing/([a-z0-9-]+)/(\d{4})/(\d{2})/(\d{2})/(?!conn_log\.)([^/]+)\.log\.gz$')
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Kept between invocations of the same Lambda environment
+s3 = boto3.client('s3')
+glue = boto3.client('glue')
+tables = {}
+partitions = set()
+
+
+def get_table(glue, database, table_name):
+    if (database, table_name) not in tables:
+        tables[database, table_name] = glue.get_table(DatabaseName=database, Name=table_name)['Table']
+    return tables[database, table_name]
+
+
+def to_timestamp(value):
+    # ALB / CLB times end with Z, NLB times have no time zone, all of them are UTC
+    try:
+        return datetime.fromisoformat(value.rstrip('Z'))
+    except (TypeError, ValueError):
+        return None
+
+
+def register_partition(glue, database, table, values, location):
+    if (database, table['Name'], tuple(values)) in partitions:
+        return
+    storage_descriptor = dict(table['StorageDescriptor'], Location=location)
+    try:
+        glue.create_partition(DatabaseName=database, TableName=table['Name'], PartitionInput={
+            'Values': values,
+            'StorageDescriptor': storage_descriptor,
+        })
+        logger.info('Registered partition %s', location)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'AlreadyExistsException':
+            raise
+    partitions.add((database, table['Name'], tuple(values)))
+
+
+def convert_object(s3, glue, bucket, key, database, table_name, log_type):
+    # Returns the S3 URL of the Parquet file, None when the key is not a log file
+    match = LOG_KEY.search(key)
+    if match is None:
+        logger.warning('Skipping %s, not an ELB log file', key)
+        return None
+    account, region, year, month, day, file_name = match.groups()
+
+    table = get_table(glue, database, table_name)
+    columns = [(column['Name'], column['Type']) for column in table['StorageDescriptor']['Columns']]
+    schema = pa.schema([(name, ARROW_TYPES[column_type]) for name, column_type in columns])
+    # account / region are not in the log lines, they come from the key
+    constants = {'account': account, 'region': region}
+    parser = LogParser(log_type, fields=[name for name, _ in columns if name not in constants])
+
+    partition_values = [str(int(year)), str(int(month)), str(int(day))]
+    partition = f'year={partition_values[0]}/month={partition_values[1]}/day={partition_values[2]}'
+    location = f"{table['StorageDescriptor']['Location'].rstrip('/')}/{partition}/"
+    output_bucket, _, output_prefix = location[len('s3://'):].partition('/')
+    output_key = f'{output_prefix}{file_name}.parquet'
+
+    body = s3.get_object(Bucket=bucket, Key=key)['Body']
+    lines = io.TextIOWrapper(gzip.GzipFile(fileobj=body), encoding='utf-8', errors='replace')
+    rows_total = 0
+    with tempfile.NamedTemporaryFile(suffix='.parquet') as output:
+        with pq.ParquetWriter(output.name, schema, compression='snappy') as writer:
+            rows = parser.parse(lines)
+            for batch in iter(lambda: list(islice(rows, BATCH_ROWS)), []):
+                values = iter(zip(*batch))
+                arrays = []
+                for name, column_type in columns:
+                    if name in constants:
+                        column = [constants[name]] * len(batch)
+                    else:
+                        column = next(values)
+                        if column_type == 'timestamp':
+                            column = [to_timestamp(value) for value in column]
+                    arrays.append(pa.array(column, type=ARROW_TYPES[column_type]))
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+                rows_total += len(batch)
+        s3.upload_file(output.name, output_bucket, output_key)
+
+    register_partition(glue, database, table, partition_values, location)
+    logger.info('Converted s3://%s/%s to s3://%s/%s: %d rows, %d invalid lines',
+                bucket, key, output_bucket, output_key, rows_total, parser.invalid_lines)
+    return f's3://{output_bucket}/{output_key}'
+
+
+def handler(event, context):
+    database, table_name, log_type = os.environ['DATABASE_NAME'], os.environ['TABLE_NAME'], os.environ['LOG_TYPE']
+    outputs = []
+    for bucket, key in log_objects(event):
+        outputs.append(convert_object(s3, glue, bucket, key, database, table_name, log_type))
+    return {'statusCode': 200, 'body': json.dumps(outputs)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert ELB log files to Parquet in a live table')
+    parser.add_argument('--database', required=True)
+    parser.add_argument('--table', required=True)
+    parser.add_argument('--type', choices=['alb', 'clb', 'nlb'], required=True)
+    parser.add_argument('urls', nargs='+', help='s3://<bucket>/<key> of log files')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    for url in args.urls:
+        bucket, _, key = url[len('s3://'):].partition('/')
+        print(convert_object(s3, glue, bucket, key, args.database, args.table, args.type))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# Streaming parser of ELB access log files, with the field definitions and regexes of the
+# Athena tables (elb_logs.formats), so that local results match the results of the named queries.
+#
+# Files are read line by line (gzip or plain text) and each line yields a tuple of typed values,
+# in field order or in the order of the selected fields:
+#
+#     parser = LogParser('alb', fields=('elb', 'client_ip', 'elb_status_code'))
+#     for elb, client_ip, status in parser.parse_file('logs/123456789012_elasticloadbalancing_....log.gz'):
+#         ...
+#
+# Like the Athena RegexSerDe, 'int', 'bigint' and 'double' fields that are not numbers ('-') are
+# None, and lines that do not match the regex are skipped (counted in invalid_lines).
+
+import gzip
+import re
+from collections import namedtuple
+
+from elb_logs.formats import FORMATS
+
+
+def _int(value):
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+CONVERTERS = {
+    'string': None,
+    'int': _int,
+    'bigint': _int,
+    'double': _float,
+}
+
+
+def open_log(path):
+    # Log files are delivered gzip compressed, uncompressed files are read as they are
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, encoding='utf-8', errors='replace')
+
+
+class LogParser:
+    __slots__ = ('log_type', 'fields', 'record', 'invalid_lines', '_match', '_groups', '_converters')
+
+    def __init__(self, log_type, fields=None):
+        if log_type not in FORMATS:
+            raise ValueError(f'Unknown log type {log_type}, expected one of {", ".join(FORMATS)}')
+        format_fields, regex = FORMATS[log_type]
+        names = [name for name, _ in format_fields]
+        self.log_type = log_type
+        self.fields = tuple(fields or names)
+        unknown = set(self.fields) - set(names)
+        if unknown:
+            raise ValueError(f'Unknown {log_type} fields: {", ".join(sorted(unknown))}')
+        types = dict(format_fields)
+
+        # Record type with the field names, for callers that prefer attributes to indexes
+        self.record = namedtuple(f'{log_type}_record', self.fields, rename=True)
+        self.invalid_lines = 0
+        self._match = re.compile(regex).fullmatch
+        # Group numbers of the selected fields, match.group(*groups) returns them as a tuple
+        self._groups = tuple(names.index(name) + 1 for name in self.fields)
+        self._converters = tuple((i, CONVERTERS[types[name]]) for i, name in enumerate(self.fields)
+                                 if CONVERTERS[types[name]])
+
+    def parse_line(self, line):
+        # Returns the tuple of the selected fields of a log line, None when the line does not match
+        match = self._match(line.rstrip('\n'))
+        if match is None:
+            return None
+        if len(self._groups) == 1:
+            values = [match.group(self._groups[0])]
+        else:
+            values = list(match.group(*self._groups))
+        for i, convert in self._converters:
+            values[i] = convert(values[i])
+        return tuple(values)
+
+    def parse(self, lines):
+        parse_line = self.parse_line
+        for line in lines:
+            row = parse_line(line)
+            if row is None:
+                if line.strip():
+                    self.invalid_lines += 1
+                continue
+            yield row
+
+    def parse_file(self, path):
+        with open_log(path) as f:
+            yield from self.parse(f)
@@ -0,0 +1,14 @@
+# Log files of the S3 object created events that the Lambda functions of AthenaStack receive,
+# from the SNS topic that fans out the notifications of a log bucket or directly from S3.
+
+import json
+from urllib.parse import unquote_plus
+
+
+def log_objects(event):
+    # Yields the (bucket, key) of the objects of the event
+    for record in event.get('Records', []):
+        if 'Sns' in record:
+            yield from log_objects(json.loads(record['Sns']['Message']))
+        elif 's3' in record:
+            yield record['s3']['bucket']['name'], unquote_plus(record['s3']['object']['key'])
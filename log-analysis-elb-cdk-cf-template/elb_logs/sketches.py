@@ -0,0 +1,297 @@
+# Mergeable sketches of log values, with bounded memory.
+#
+# LatencySketch (DDSketch): values are counted in logarithmic bins, so that every quantile is
+# within relative_accuracy of the exact value (1% by default: a p99 of 2.000 s is reported between
+# 1.980 s and 2.020 s). Sketches of different files, nodes or days are merged by adding the bins.
+#
+# https://arxiv.org/abs/1908.10693
+#
+# DistinctSketch (HyperLogLog): number of distinct values (client IPs), 0.8% standard error with
+# 16 KB of registers however many values there are. Sketches are merged by taking the maximum of
+# each register.
+#
+# CountMinSketch: count (or sum) of any value, never below the exact count and above it by at most
+# e / width of the total with 98% probability (depth 4). Sketches are merged by adding the counters.
+#
+# TopKSketch (space-saving): the values with the highest counts (top talkers) among at most
+# capacity counters, each with the maximum error of its count. Values that have more than
+# total / capacity are always kept.
+#
+# Values are hashed with blake2b, not hash(), so that sketches of different processes and days
+# can be merged.
+
+import base64
+import heapq
+import math
+from array import array
+from hashlib import blake2b
+
+# Values up to MIN_VALUE (1 microsecond) are counted as 0
+MIN_VALUE = 1e-6
+
+
+class LatencySketch:
+    __slots__ = ('relative_accuracy', 'max_bins', 'bins', 'zero_count', 'count', 'sum', 'min', 'max',
+                 '_gamma', '_log_gamma')
+
+    def __init__(self, relative_accuracy=0.01, max_bins=2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+
+    def add(self, value, count=1):
+        self.count += count
+        self.sum += value * count
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if value <= MIN_VALUE:
+            self.zero_count += count
+            return
+        key = math.ceil(math.log(value) / self._log_gamma)
+        self.bins[key] = self.bins.get(key, 0) + count
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+
+    def _collapse(self):
+        # Keeps the accuracy of the high quantiles: the lowest bins are merged into one
+        keys = sorted(self.bins)
+        excess = len(keys) - self.max_bins + 1
+        merged = sum(self.bins.pop(key) for key in keys[:excess])
+        self.bins[keys[excess]] += merged
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError('Sketches with different relative accuracy cannot be merged')
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+        return self
+
+    def _value(self, key):
+        return 2 * self._gamma ** key / (self._gamma + 1)
+
+    def quantile(self, q):
+        # Value of quantile q (0 to 1), None when the sketch is empty
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+        seen = self.zero_count
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                return min(max(self._value(key), self.min), self.max)
+        return self.max
+
+    def histogram(self, max_values=150):
+        # (values, counts) of at most max_values bins (the limit of a CloudWatch metric datum),
+        # adjacent bins are merged when the sketch has more
+        items = sorted((self._value(key), count) for key, count in self.bins.items())
+        if self.zero_count:
+            items.insert(0, (0.0, self.zero_count))
+        if len(items) > max_values:
+            size = math.ceil(len(items) / max_values)
+            items = [(sum(value * count for value, count in group) / sum(count for _, count in group),
+                      sum(count for _, count in group))
+                     for group in (items[i:i + size] for i in range(0, len(items), size))]
+        return [value for value, _ in items], [count for _, count in items]
+
+    def to_dict(self):
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'bins': {str(key): count for key, count in self.bins.items()},
+            'zero_count': self.zero_count,
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['relative_accuracy'])
+        sketch.bins = {int(key): count for key, count in data['bins'].items()}
+        sketch.zero_count = data['zero_count']
+        sketch.count = data['count']
+        sketch.sum = data['sum']
+        if sketch.count:
+            sketch.min, sketch.max = data['min'], data['max']
+        return sketch
+
+
+def hash64(value):
+    return int.from_bytes(blake2b(value.encode(), digest_size=8).digest(), 'little')
+
+
+class DistinctSketch:
+    __slots__ = ('precision', 'registers')
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        hashed = hash64(value)
+        index = hashed >> (64 - self.precision)
+        # Rank of the first 1 bit of the other bits
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError('Sketches with different precision cannot be merged')
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        size = len(self.registers)
+        estimate = (0.7213 / (1 + 1.079 / size)) * size * size / sum(2.0 ** -rank for rank in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * size and zeros:
+            # Linear counting for the small cardinalities
+            estimate = size * math.log(size / zeros)
+        return round(estimate)
+
+    def to_dict(self):
+        return {'precision': self.precision, 'registers': base64.b64encode(self.registers).decode()}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['precision'])
+        sketch.registers = bytearray(base64.b64decode(data['registers']))
+        return sketch
+
+
+class CountMinSketch:
+    __slots__ = ('width', 'depth', 'rows', 'total')
+
+    def __init__(self, width=4096, depth=4):
+        self.width = width
+        self.depth = depth
+        self.rows = [array('q', bytes(8 * width)) for _ in range(depth)]
+        self.total = 0
+
+    def _indexes(self, value):
+        # Double hashing: the row hashes are derived from the two halves of one 64 bits hash
+        hashed = hash64(value)
+        low, high = hashed & 0xFFFFFFFF, hashed >> 32
+        return [(low + i * high) % self.width for i in range(self.depth)]
+
+    def add(self, value, count=1):
+        self.total += count
+        for row, index in zip(self.rows, self._indexes(value)):
+            row[index] += count
+
+    def estimate(self, value):
+        return min(row[index] for row, index in zip(self.rows, self._indexes(value)))
+
+    def merge(self, other):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError('Sketches with different sizes cannot be merged')
+        for row, other_row in zip(self.rows, other.rows):
+            for index, count in enumerate(other_row):
+                if count:
+                    row[index] += count
+        self.total += other.total
+        return self
+
+    def to_dict(self):
+        return {'width': self.width, 'depth': self.depth, 'total': self.total,
+                'rows': [base64.b64encode(row.tobytes()).decode() for row in self.rows]}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['width'], data['depth'])
+        sketch.total = data['total']
+        for row, encoded in zip(sketch.rows, data['rows']):
+            row[:] = array('q', base64.b64decode(encoded))
+        return sketch
+
+
+class TopKSketch:
+    # Space-saving with batched evictions: up to 2 * capacity values are counted, then the
+    # capacity values with the highest counts are kept. A new value starts from the highest
+    # evicted count (floor), its possible count before it was evicted, which is its error.
+    __slots__ = ('capacity', 'counts', 'errors', 'floor', 'total')
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.floor = 0
+        self.total = 0
+
+    def add(self, value, count=1):
+        self.total += count
+        counts = self.counts
+        if value in counts:
+            counts[value] += count
+            return
+        counts[value] = self.floor + count
+        if self.floor:
+            self.errors[value] = self.floor
+        if len(counts) >= 2 * self.capacity:
+            self._prune()
+
+    def _prune(self):
+        kept = heapq.nlargest(self.capacity, self.counts.items(), key=lambda item: item[1])
+        kept_values = {value for value, _ in kept}
+        evicted = [count for value, count in self.counts.items() if value not in kept_values]
+        self.floor = max(self.floor, max(evicted, default=0))
+        self.counts = dict(kept)
+        self.errors = {value: error for value, error in self.errors.items() if value in kept_values}
+
+    def merge(self, other):
+        # A value missing from one sketch may have up to the floor of that sketch there
+        for value in self.counts.keys() - other.counts.keys():
+            self.counts[value] += other.floor
+            self.errors[value] = self.errors.get(value, 0) + other.floor
+        for value, count in other.counts.items():
+            error = other.errors.get(value, 0)
+            if value not in self.counts:
+                self.counts[value] = self.floor
+                self.errors[value] = self.floor
+            self.counts[value] += count
+            if error:
+                self.errors[value] = self.errors.get(value, 0) + error
+        self.floor += other.floor
+        self.total += other.total
+        if len(self.counts) >= 2 * self.capacity:
+            self._prune()
+        return self
+
+    def top(self, limit=None):
+        # [(value, count, error)] by count, the exact count is between count - error and count
+        items = heapq.nlargest(limit or len(self.counts), self.counts.items(), key=lambda item: item[1])
+        return [(value, count, self.errors.get(value, 0)) for value, count in items]
+
+    def to_dict(self):
+        return {'capacity': self.capacity, 'floor': self.floor, 'total': self.total,
+                'counts': self.counts, 'errors': self.errors}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['capacity'])
+        sketch.floor = data['floor']
+        sketch.total = data['total']
+        sketch.counts = dict(data['counts'])
+        sketch.errors = dict(data['errors'])
+        return sketch
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# Writes synthetic ALB, CLB or NLB access log files (.log.gz, named as the files that ELB
+# delivers) to test and benchmark the log tables and the local parser.
+#
+# Usage:
+# generate_logs.py --type alb|clb|nlb --output <directory>
+# [--lines <value> | --size <MB>] [--files <value>] [--start <time>] [--hours <value>]
+# [--error-rate <value>] [--tls-mix <protocol=weight,...>] [--escape-rate <value>]
+# [--clients <value>] [--seed <value>]
+#
+# e.g. 100 MB of an hour of ALB logs, 10% of errors, TLS 1.0 for 20% of the requests:
+# generate_logs.py --type alb --output logs/ --size 100 --error-rate 0.1 --tls-mix "TLSv1.2=0.8,TLSv1=0.2"
+
+import argparse
+import logging
+from datetime import datetime, timedelta, timezone
+
+from elb_logs.generator import LogGenerator
+
+logger = logging.getLogger(__name__)
+
+
+def tls_mix(value):
+    # "TLSv1.2=0.7,TLSv1.3=0.2,-=0.1" to {'TLSv1.2': 0.7, 'TLSv1.3': 0.2, '-': 0.1}
+    mix = {}
+    for item in value.split(','):
+        protocol, _, weight = item.partition('=')
+        mix[protocol.strip()] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic ELB access log files')
+    parser.add_argument('--type', choices=['alb', 'clb', 'nlb'], required=True)
+    parser.add_argument('--output', required=True, help='Directory of the log files')
+    parser.add_argument('--lines', type=int, default=100000, help='Number of lines')
+    parser.add_argument('--size', type=float, help='Uncompressed size in MB, instead of --lines')
+    parser.add_argument('--files', type=int, default=1, help='Number of files (load balancer nodes)')
+    parser.add_argument('--start', help='First time, ISO 8601 UTC, default the previous hour')
+    parser.add_argument('--hours', type=float, default=1, help='Time span of the logs in hours')
+    parser.add_argument('--error-rate', type=float, default=0.02, help='Rate of 4xx and 5xx responses')
+    parser.add_argument('--tls-mix', type=tls_mix, help="Weights of the TLS protocols, '-' for no TLS, "
+                                                        "e.g. TLSv1.2=0.7,TLSv1.3=0.2,-=0.1")
+    parser.add_argument('--escape-rate', type=float, default=0.0,
+                        help='Rate of user agents with escaped double quotes')
+    parser.add_argument('--clients', type=int, default=1000, help='Number of client IPs')
+    parser.add_argument('--seed', type=int, help='Random seed, for reproducible files')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    start = None
+    if args.start:
+        start = datetime.fromisoformat(args.start).replace(tzinfo=timezone.utc)
+    generator = LogGenerator(args.type, start, timedelta(hours=args.hours), args.error_rate, args.tls_mix,
+                             args.escape_rate, args.clients, seed=args.seed)
+    lines = generator.line_count(args.size * 1024 ** 2) if args.size else args.lines
+    for path in generator.write_files(args.output, lines, args.files):
+        logger.info(path)
+    logger.info('%d lines', lines)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# Runs the named queries and prepared statements created by AthenaStack, by name.
+#
+# Athena query result reuse is turned on for every execution, and the results are also kept
+# in a local cache keyed by the region, workgroup and database, the normalized SQL, the
+# parameters and the partition range that the query reads, so repeated report runs do not
+# scan the log bucket again.
+#
+# Usage:
+# query_runner.py --list
+# query_runner.py --query <name> [--param <value> ...]
+# [--stack <value>] [--region <value>] [--format csv|json] [--output <file>]
+# [--reuse-minutes <value>] [--cache-dir <value>] [--cache-ttl <value>] [--no-cache]
+#
+# Prepared statement parameters are SQL literals, in the order of the '?' in the statement, e.g.
+# query_runner.py --query alb_tls_version_<bucket> --param -30 --param "'app/my-alb/1234567890abcdef'"
+
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import time
+from configparser import ConfigParser
+from datetime import datetime, timedelta, timezone
+
+import boto3
+from botocore.exceptions import ClientError
+
+STACK_NAME = 'AthenaElbLogStack'
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'elb-logs-athena')
+CACHE_TTL = 3600
+REUSE_MINUTES = 60
+POLL_MAX_INTERVAL = 2
+
+logger = logging.getLogger(__name__)
+
+# String literals are kept as they are, comments are dropped and whitespace is collapsed
+SQL_TOKENS = re.compile(r"('(?:[^']|'')*')|((?:\s|--[^\n]*)+)")
+RELATIVE_RANGE = re.compile(r"current_date - interval '(\d+)' day")
+PARAMETER_RANGE = re.compile(r"date_add\('day', \?, current_date\)")
+FIXED_RANGE = re.compile(r'BETWEEN (\d{8}) AND (\d{8})')
+
+
+def stack_names(stack_name):
+    # Workgroup and database names of an AthenaStack
+    name = f'elb_logs_{stack_name.lower()}'
+    return f'wg_{name}', f'db_{name}'
+
+
+def normalize_sql(sql):
+    return SQL_TOKENS.sub(lambda match: match.group(1) or ' ', sql).strip().rstrip(';').strip()
+
+
+def partition_range(sql, parameters, today=None):
+    # Returns the first and last day of the log partitions a query reads, None when the query
+    # has no partition predicate
+    today = today or datetime.now(timezone.utc).date()
+    match = RELATIVE_RANGE.search(sql)
+    if match:
+        return today - timedelta(days=int(match.group(1))), today
+    match = PARAMETER_RANGE.search(sql)
+    if match:
+        # Number of '?' before the predicate is the index of its parameter
+        days = int(parameters[sql[:match.start()].count('?')])
+        return today + timedelta(days=days), today
+    match = FIXED_RANGE.search(sql)
+    if match:
+        return tuple(datetime.strptime(day, '%Y%m%d').date() for day in match.groups())
+    return None
+
+
+def cache_key(region, work_group, database, sql, parameters, days):
+    key = json.dumps([region, work_group, database, normalize_sql(sql), list(parameters),
+                      [day.isoformat() for day in days] if days else None])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def cache_read(cache_dir, key, days, ttl):
+    path = os.path.join(cache_dir, f'{key}.json')
+    try:
+        with open(path) as f:
+            result = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # Partitions of past days no longer change, results that only read them never expire
+    closed = days is not None and days[1] < datetime.now(timezone.utc).date()
+    if not closed and ttl is not None and time.time() - result['created'] > ttl:
+        return None
+    return result
+
+
+def cache_write(cache_dir, key, result):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f'{key}.json')
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(result, f)
+    os.replace(f'{path}.tmp', path)
+
+
+def list_queries(athena, work_group):
+    # Returns {name: (database, sql, is_prepared_statement, named query id)} of the queries of
+    # the workgroup
+    queries = {}
+    ids = []
+    for page in athena.get_paginator('list_named_queries').paginate(WorkGroup=work_group):
+        ids.extend(page['NamedQueryIds'])
+    for i in range(0, len(ids), 50):
+        response = athena.batch_get_named_query(NamedQueryIds=ids[i:i + 50])
+        for query in response['NamedQueries']:
+            queries[query['Name']] = (query['Database'], query['QueryString'], False, query['NamedQueryId'])
+    paginator = athena.get_paginator('list_prepared_statements')
+    for page in paginator.paginate(WorkGroup=work_group):
+        for statement in page['PreparedStatements']:
+            queries[statement['StatementName']] = (None, None, True, None)
+    return queries
+
+
+def query_definition(athena, work_group, name, query_id):
+    # Current SQL of a named query (by id) or of a prepared statement (by name), None when it
+    # no longer exists
+    try:
+        if query_id:
+            return athena.get_named_query(NamedQueryId=query_id)['NamedQuery']['QueryString']
+        statement = athena.get_prepared_statement(StatementName=name, WorkGroup=work_group)
+        return statement['PreparedStatement']['QueryStatement']
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('InvalidRequestException', 'ResourceNotFoundException'):
+            return None
+        raise
+
+
+def get_query(athena, work_group, database, name, cache_dir=None):
+    # Returns (database, sql, query string to execute). The definition is kept in the cache
+    # directory and checked with one get call instead of listing the queries of the workgroup;
+    # it is dropped when the named query was replaced (new id) or the SQL changed
+    if cache_dir:
+        key = hashlib.sha256(json.dumps(['query', athena.meta.region_name, work_group, database,
+                                         name]).encode()).hexdigest()
+        cached = cache_read(cache_dir, key, None, None)
+        if cached and query_definition(athena, work_group, name, cached['query_id']) == cached['sql']:
+            return cached['database'], cached['sql'], cached['query_string']
+        query, query_id = find_query(athena, work_group, database, name)
+        cache_write(cache_dir, key, {'created': time.time(), 'database': query[0], 'sql': query[1],
+                                     'query_string': query[2], 'query_id': query_id})
+        return query
+    return find_query(athena, work_group, database, name)[0]
+
+
+def find_query(athena, work_group, database, name):
+    # Returns ((database, sql, query string to execute), named query id) from the queries of the
+    # workgroup
+    queries = list_queries(athena, work_group)
+    if name not in queries:
+        raise KeyError(f'No named query or prepared statement {name} in workgroup {work_group}')
+    query_database, sql, prepared, query_id = queries[name]
+    if prepared:
+        sql = query_definition(athena, work_group, name, None)
+        return (database, sql, f'EXECUTE {name}'), None
+    return (query_database, sql, sql), query_id
+
+
+def wait_for_query(athena, execution_id):
+    # Returns the query execution once it is SUCCEEDED, FAILED or CANCELLED
+    interval = 0.2
+    while True:
+        execution = athena.get_query_execution(QueryExecutionId=execution_id)['QueryExecution']
+        if execution['Status']['State'] in ('SUCCEEDED', 'FAILED', 'CANCELLED'):
+            return execution
+        time.sleep(interval)
+        interval = min(interval * 2, POLL_MAX_INTERVAL)
+
+
+def execute_query(athena, work_group, database, query_string, parameters, reuse_minutes):
+    kwargs = {}
+    if parameters:
+        kwargs['ExecutionParameters'] = list(parameters)
+    if reuse_minutes:
+        kwargs['ResultReuseConfiguration'] = {'ResultReuseByAgeConfiguration': {
+            'Enabled': True, 'MaxAgeInMinutes': reuse_minutes}}
+    execution_id = athena.start_query_execution(
+        QueryString=query_string,
+        QueryExecutionContext={'Database': database},
+        WorkGroup=work_group,
+        **kwargs)['QueryExecutionId']
+
+    execution = wait_for_query(athena, execution_id)
+    state = execution['Status']['State']
+    if state != 'SUCCEEDED':
+        raise RuntimeError(f"Query {execution_id} {state}: "
+                           f"{execution['Status'].get('StateChangeReason', '')}")
+
+    columns = None
+    rows = []
+    paginator = athena.get_paginator('get_query_results')
+    for page in paginator.paginate(QueryExecutionId=execution_id):
+        if columns is None:
+            columns = [column['Name'] for column in page['ResultSet']['ResultSetMetadata']['ColumnInfo']]
+        for row in page['ResultSet']['Rows']:
+            rows.append([value.get('VarCharValue') for value in row['Data']])
+    # The first row of a SELECT result is the header
+    if rows and rows[0] == columns:
+        rows = rows[1:]
+    return {
+        'query_execution_id': execution_id,
+        'columns': columns or [],
+        'rows': rows,
+        'statistics': execution.get('Statistics', {}),
+    }
+
+
+def run_query(athena, work_group, database, name, parameters=(), reuse_minutes=REUSE_MINUTES,
+              cache_dir=CACHE_DIR, cache_ttl=CACHE_TTL):
+    # Returns the result of the named query / prepared statement and whether it came from the cache
+    database, sql, query_string = get_query(athena, work_group, database, name, cache_dir)
+    days = partition_range(sql, parameters)
+    key = cache_key(athena.meta.region_name, work_group, database, sql, parameters, days)
+    if cache_dir:
+        result = cache_read(cache_dir, key, days, cache_ttl)
+        if result:
+            return result, True
+    result = execute_query(athena, work_group, database, query_string, parameters, reuse_minutes)
+    result['created'] = time.time()
+    result['partition_range'] = [day.isoformat() for day in days] if days else None
+    if cache_dir:
+        cache_write(cache_dir, key, result)
+    return result, False
+
+
+def write_result(result, output_format, output):
+    if output_format == 'json':
+        json.dump([dict(zip(result['columns'], row)) for row in result['rows']], output, indent=2)
+        output.write('\n')
+    else:
+        writer = csv.writer(output)
+        writer.writerow(result['columns'])
+        writer.writerows(result['rows'])
+
+
+def main():
+    config_object = ConfigParser()
+    config_object.read(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.ini'))
+    default_region = config_object['defaults']['region'] if config_object.has_section('defaults') else None
+
+    parser = argparse.ArgumentParser(description='Run the named queries and prepared statements of AthenaStack')
+    parser.add_argument('--stack', default=STACK_NAME, help='Name of the AthenaStack stack')
+    parser.add_argument('--region', default=default_region, help='Region of the stack')
+    parser.add_argument('--list', action='store_true', help='List the named queries and prepared statements')
+    parser.add_argument('--query', help='Name of the named query or prepared statement')
+    parser.add_argument('--param', action='append', default=[],
+                        help='Prepared statement parameter (SQL literal), repeat in order')
+    parser.add_argument('--format', choices=['csv', 'json'], default='csv')
+    parser.add_argument('--output', help='Output file, default stdout')
+    parser.add_argument('--reuse-minutes', type=int, default=REUSE_MINUTES,
+                        help='Max age of Athena results to reuse, 0 to disable')
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help='Local result cache directory')
+    parser.add_argument('--cache-ttl', type=int, default=CACHE_TTL,
+                        help='Seconds to keep results of ranges that include today')
+    parser.add_argument('--no-cache', action='store_true', help='Do not use the local result cache')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    athena = boto3.client('athena', region_name=args.region)
+    work_group, database = stack_names(args.stack)
+
+    try:
+        if args.list:
+            for name, (_, _, prepared, _) in sorted(list_queries(athena, work_group).items()):
+                print(f"{'prepared statement' if prepared else 'named query'}\t{name}")
+            return
+        if not args.query:
+            parser.error('--query or --list is required')
+
+        result, cached = run_query(athena, work_group, database, args.query, args.param,
+                                   args.reuse_minutes, None if args.no_cache else args.cache_dir,
+                                   args.cache_ttl)
+    except (ClientError, KeyError, RuntimeError) as e:
+        logger.error(e)
+        sys.exit(1)
+
+    statistics = result['statistics']
+    if cached:
+        logger.info('Result from local cache (%s)', result['query_execution_id'])
+    elif statistics.get('ResultReuseInformation', {}).get('ReusedPreviousResult'):
+        logger.info('Result reused by Athena (%s)', result['query_execution_id'])
+    else:
+        logger.info('Scanned %d bytes in %d ms (%s)', statistics.get('DataScannedInBytes', 0),
+                    statistics.get('EngineExecutionTimeInMillis', 0), result['query_execution_id'])
+
+    if args.output:
+        with open(args.output, 'w', newline='') as f:
+            write_result(result, args.format, f)
+    else:
+        write_result(result, args.format, sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
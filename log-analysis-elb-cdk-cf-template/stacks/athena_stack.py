@@ -1,19 +1,54 @@
 #!/usr/bin/env python3
+import os
+from datetime import date, timedelta
+
 from constructs import Construct
-from aws_cdk import Stack, CfnTag, Aws
+from aws_cdk import Stack, NestedStack, CfnTag, Aws, Duration, IgnoreMode
 
 from aws_cdk import (
     aws_s3 as s3,
+    aws_s3_notifications as s3n,
     aws_glue_alpha as glue,
     aws_kms as kms,
     aws_iam as iam,
-    aws_athena as athena
+    aws_lambda as lambda_,
+    aws_athena as athena,
+    aws_cloudwatch as cloudwatch,
+    aws_cloudwatch_actions as cloudwatch_actions,
+    aws_events as events,
+    aws_events_targets as events_targets,
+    aws_stepfunctions as sfn,
+    aws_stepfunctions_tasks as sfn_tasks,
+    aws_sns as sns,
+    aws_sns_subscriptions as sns_subscriptions
 )
 
+from elb_logs.formats import (ALB_CONNECTION_FIELDS, ALB_CONNECTION_REGEX, ALB_FIELDS, ALB_REGEX, CLB_FIELDS,
+                              CLB_REGEX, NLB_FIELDS, NLB_REGEX)
+from elb_logs.lcu import (ACTIVE_CONNECTIONS_PER_MINUTE, FREE_RULES, NEW_CONNECTIONS_PER_SECOND,
+                          PROCESSED_BYTES_PER_HOUR, RULE_EVALUATIONS_PER_SECOND)
+
+# Log columns stored as Parquet timestamps instead of ISO 8601 strings
+TIMESTAMP_COLUMNS = ('time', 'request_creation_time')
+
+# Lambda functions are packaged from the project directory with the elb_logs package only
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_CODE_EXCLUDE = ['*', '!elb_logs/', '!elb_logs/**', '__pycache__/']
+
+# Glue types of the field types of elb_logs.formats
+GLUE_TYPES = {
+    'string': glue.Schema.STRING,
+    'int': glue.Schema.INTEGER,
+    'bigint': glue.Schema.BIG_INT,
+    'double': glue.Schema.DOUBLE,
+}
+
 
 class AthenaStack(Stack):
 
-    def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
+    def __init__(self, scope: Construct, construct_id: str,
+                 bytes_scanned_cutoff_per_query=None, daily_bytes_scanned_limit=None,
+                 alarm_email=None, nested_stacks=False, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
         # Create Glue Databse
@@ -39,10 +74,18 @@ class AthenaStack(Stack):
             resources=['*']
         ))
 
+        # SNS topics of the new log files per log table, see __subscribe_to_log_files
+        self.log_file_topics = {}
+        # Resources of each athena_* call in a nested stack of their own, see __bucket_stack
+        self.nested_stacks = nested_stacks
+
         self.work_group = self.__create_work_group(
-            self.elb_logs_bucket.bucket_name)
+            self.elb_logs_bucket.bucket_name, bytes_scanned_cutoff_per_query)
 
-    def __create_work_group(self, bucket_name):
+        if daily_bytes_scanned_limit:
+            self.__create_usage_alarm(daily_bytes_scanned_limit, alarm_email)
+
+    def __create_work_group(self, bucket_name, bytes_scanned_cutoff_per_query):
         cfn_work_group = athena.CfnWorkGroup(
             self, f'wg_elb_logs_{self.stack_name.lower()}',
             name=f'wg_elb_logs_{self.stack_name.lower()}',
@@ -50,7 +93,9 @@ class AthenaStack(Stack):
             recursive_delete_option=True,
             state='ENABLED',
             work_group_configuration=athena.CfnWorkGroup.WorkGroupConfigurationProperty(
-                publish_cloud_watch_metrics_enabled=False,
+                # Queries that scan more than the cutoff are cancelled
+                bytes_scanned_cutoff_per_query=bytes_scanned_cutoff_per_query,
+                publish_cloud_watch_metrics_enabled=True,
                 requester_pays_enabled=False,
                 result_configuration=athena.CfnWorkGroup.ResultConfigurationProperty(
                     output_location=f's3://{bucket_name}/logs_query_results/'
@@ -63,12 +108,49 @@ class AthenaStack(Stack):
         )
         return cfn_work_group
 
+    def __create_usage_alarm(self, daily_bytes_scanned_limit, alarm_email):
+        # Workgroup-wide limit: alarm when the queries of the workgroup scan more than the
+        # limit in a day (UTC)
+        processed_bytes = cloudwatch.Metric(
+            namespace='AWS/Athena',
+            metric_name='ProcessedBytes',
+            dimensions_map={'WorkGroup': self.work_group.name},
+            statistic='Sum',
+            period=Duration.days(1))
+
+        alarm = cloudwatch.Alarm(
+            self, f'alarm_{self.work_group.name}_daily_bytes_scanned',
+            alarm_description=f'Bytes scanned by the queries of {self.work_group.name} in a day',
+            metric=processed_bytes,
+            threshold=daily_bytes_scanned_limit,
+            evaluation_periods=1,
+            comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING)
+
+        self.alarm_topic = sns.Topic(self, f'topic_{self.work_group.name}_alarms',
+                                     master_key=self.encryption_key)
+        self.encryption_key.grant_encrypt_decrypt(iam.ServicePrincipal('cloudwatch.amazonaws.com'))
+        if alarm_email:
+            self.alarm_topic.add_subscription(sns_subscriptions.EmailSubscription(alarm_email))
+        alarm.add_alarm_action(cloudwatch_actions.SnsAction(self.alarm_topic))
+        return alarm
+
+    def __bucket_stack(self, kind, name):
+        # Scope of the resources of one athena_* call. With nested_stacks=True they go to a nested
+        # stack of their own: each log bucket stays far below the CloudFormation resource limit,
+        # the buckets deploy in parallel and a change to one bucket only updates its template.
+        # The shared database, work group and key stay in this stack.
+        if not self.nested_stacks:
+            return self
+        return NestedStack(self, f'nested_{kind}_{name}',
+                           description=f'{kind.upper()} logs {name} of {self.stack_name}')
+
     def __create_named_query(
-            self, query_name,
+            self, stack, query_name,
             query_description, query_string):
 
         named_query = athena.CfnNamedQuery(
-            self, query_name,
+            stack, query_name,
             database=self.logs_db.database_name,
             query_string=query_string,
             description=query_description,
@@ -78,9 +160,9 @@ class AthenaStack(Stack):
         named_query.node.add_dependency(self.work_group)
         return named_query
 
-    def __create_prepared_statement(self, name, description, statement):
+    def __create_prepared_statement(self, stack, name, description, statement):
         # Statement name does not support '-' character
-        ps = athena.CfnPreparedStatement(self, name,
+        ps = athena.CfnPreparedStatement(stack, name,
                                          query_statement=statement,
                                          statement_name=name.replace('-', '_'),
                                          work_group=self.work_group.name,
@@ -88,141 +170,636 @@ class AthenaStack(Stack):
         ps.node.add_dependency(self.work_group)
         return ps
 
+    def __log_path(self, bucket_prefix, account, accounts, regions):
+        # Returns the table location and the storage location template of the log files.
+        # Account and region are projected partition columns when accounts / regions are given.
+        prefix = f'{bucket_prefix}/AWSLogs' if bucket_prefix else 'AWSLogs'
+        account_path = '${account}' if accounts else account
+        region_path = '${region}' if regions else self.region
+        location_template = f'{prefix}/{account_path}/elasticloadbalancing/{region_path}'
+        return location_template.split('/$', 1)[0], location_template
+
+    @staticmethod
+    def __columns(fields):
+        return [glue.Column(name=name, type=GLUE_TYPES[field_type]) for name, field_type in fields]
+
+    @staticmethod
+    def __scope_columns(accounts, regions):
+        # account / region columns of the tables that hold the logs of several accounts / regions
+        return [glue.Column(name=column, type=glue.Schema.STRING)
+                for column, values in (('account', accounts), ('region', regions)) if values]
+
+    def __partition_keys(self, accounts, regions):
+        partition_keys = self.__scope_columns(accounts, regions)
+        return partition_keys + [
+            glue.Column(
+                name='year',
+                type=glue.Schema.INTEGER),
+            glue.Column(
+                name='month',
+                type=glue.Schema.INTEGER),
+            glue.Column(
+                name='day',
+                type=glue.Schema.INTEGER
+            )]
+
+    @staticmethod
+    def __project_partitions(logs_table_cfn, bucket_name, location_template, accounts, regions):
+        # accounts / regions are either a list of values (enum projection) or 'injected',
+        # in which case every query must filter on the column with '='
+        for column, values in (('account', accounts), ('region', regions)):
+            if not values:
+                continue
+            if values == 'injected':
+                logs_table_cfn.add_override(f'Properties.TableInput.Parameters.projection\.{column}\.type', 'injected')
+            else:
+                logs_table_cfn.add_override(f'Properties.TableInput.Parameters.projection\.{column}\.type', 'enum')
+                logs_table_cfn.add_override(f'Properties.TableInput.Parameters.projection\.{column}\.values', ','.join(values))
+        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.day\.digits', '2')
+        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.day\.range', '01,31')
+        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.day\.type', 'integer')
+        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.month\.digits', '2')
+        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.month\.range', '01,12')
+        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.month\.type', 'integer')
+        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.year\.digits', '4')
+        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.year\.type', 'integer')
+        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.year\.range', '2017,2050')
+        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.enabled', 'true')
+        logs_table_cfn.add_override('Properties.TableInput.Parameters.EXTERNAL', 'TRUE')
+        logs_table_cfn.add_override('Properties.TableInput.Parameters.storage\.location\.template', f's3://{bucket_name}/{location_template}/${{year}}/${{month}}/${{day}}')
+
+    def __scope_filter(self, account, accounts, regions):
+        # Injected partition columns must be filtered on, the named queries use the default
+        # account and region of the stack
+        scope = ''
+        if accounts == 'injected':
+            scope += f"account = '{account}' AND "
+        if regions == 'injected':
+            scope += f"region = '{self.region}' AND "
+        return scope
+
+    @staticmethod
+    def __partition_filter(days):
+        # Log files are stored under the year/month/day of their delivery (UTC), so the partitions
+        # of the last <days> days hold every entry of the last <days> days
+        return f"year * 10000 + month * 100 + day >= CAST(date_format(current_date - interval '{days}' day, '%Y%m%d') AS integer)"
+
+    @staticmethod
+    def __partition_range(start_date, end_date):
+        # Entries of the last minutes of a day are delivered in a file of the next day
+        start = date.fromisoformat(start_date)
+        end = date.fromisoformat(end_date) + timedelta(days=1)
+        return f"year * 10000 + month * 100 + day BETWEEN {start:%Y%m%d} AND {end:%Y%m%d}"
+
+    def __create_scheduled_queries(self, stack, name, schedule, queries, buckets):
+        # Step Functions runs the queries one after the other, each waiting for the previous one
+        chain = None
+        for query_name, query_string in queries:
+            task = sfn_tasks.AthenaStartQueryExecution(
+                stack, f'{name}_{query_name}',
+                query_string=query_string,
+                integration_pattern=sfn.IntegrationPattern.RUN_JOB,
+                query_execution_context=sfn_tasks.QueryExecutionContext(
+                    database_name=self.logs_db.database_name),
+                work_group=self.work_group.name)
+            chain = task if chain is None else chain.next(task)
+
+        state_machine = sfn.StateMachine(stack, f'sm_{name}', definition=chain)
+        state_machine.node.add_dependency(self.work_group)
+        self.elb_logs_bucket.grant_read_write(state_machine)
+        self.encryption_key.grant_encrypt_decrypt(state_machine)
+        for bucket in buckets:
+            bucket.grant_read(state_machine)
+
+        events.Rule(stack, f'rule_{name}',
+                    schedule=schedule,
+                    targets=[events_targets.SfnStateMachine(state_machine)])
+        return state_machine
+
+    def __create_columnar_table(self, stack, table_name, s3_prefix, columns, projection=True):
+        # Parquet table in the query results bucket, partitioned by year/month/day with the
+        # Hive layout (year=2024/month=1/day=2) that INSERT INTO writes. Without projection the
+        # partitions have to be registered in Glue
+        columnar_table = glue.Table(
+            stack, table_name,
+            database=self.logs_db,
+            table_name=table_name,
+            bucket=self.elb_logs_bucket,
+            s3_prefix=f'{s3_prefix}/{table_name}/',
+            columns=columns,
+            partition_keys=[
+                glue.Column(
+                    name='year',
+                    type=glue.Schema.INTEGER),
+                glue.Column(
+                    name='month',
+                    type=glue.Schema.INTEGER),
+                glue.Column(
+                    name='day',
+                    type=glue.Schema.INTEGER
+                )],
+            data_format=glue.DataFormat.PARQUET
+        )
+
+        columnar_table_cfn = columnar_table.node.default_child
+        columnar_table_cfn.add_override('Properties.TableInput.Parameters.parquet\.compression', 'SNAPPY')
+        if not projection:
+            return columnar_table
+        columnar_table_cfn.add_override('Properties.TableInput.Parameters.projection\.day\.range', '1,31')
+        columnar_table_cfn.add_override('Properties.TableInput.Parameters.projection\.day\.type', 'integer')
+        columnar_table_cfn.add_override('Properties.TableInput.Parameters.projection\.month\.range', '1,12')
+        columnar_table_cfn.add_override('Properties.TableInput.Parameters.projection\.month\.type', 'integer')
+        columnar_table_cfn.add_override('Properties.TableInput.Parameters.projection\.year\.type', 'integer')
+        columnar_table_cfn.add_override('Properties.TableInput.Parameters.projection\.year\.range', '2017,2050')
+        columnar_table_cfn.add_override('Properties.TableInput.Parameters.projection\.enabled', 'true')
+        return columnar_table
+
+    def __create_parquet_table(self, stack, table_name, raw_table_name, columns, raw_bucket, schedule):
+        # Parquet copy of a log table: typed timestamps, columnar reads and no regex parsing
+        parquet_table = self.__create_columnar_table(stack, table_name, 'parquet', [
+            glue.Column(name=column.name, type=glue.Schema.TIMESTAMP)
+            if column.name in TIMESTAMP_COLUMNS else column
+            for column in columns])
+
+        select_list = ', '.join(
+            f'CAST(from_iso8601_timestamp({column.name}) AS timestamp)' if column.name in TIMESTAMP_COLUMNS
+            else column.name
+            for column in columns)
+
+        def convert_days(first_day):
+            # Converts the complete days (up to yesterday) of the last <first_day> days that
+            # are not in the Parquet table yet, so running the conversion twice is harmless
+            days = (f"year * 10000 + month * 100 + day BETWEEN CAST(date_format(current_date - interval '{first_day}' day, '%Y%m%d') AS integer) "
+                    f"AND CAST(date_format(current_date - interval '1' day, '%Y%m%d') AS integer)")
+            return f"""INSERT INTO "{table_name}"
+            SELECT {select_list}, year, month, day
+            FROM "{raw_table_name}"
+            WHERE {days}
+                AND year * 10000 + month * 100 + day NOT IN (
+                    SELECT DISTINCT year * 10000 + month * 100 + day FROM "{table_name}" WHERE {days})"""
+
+        self.__create_named_query(
+            stack, f'Parquet backfill - 30 days - {table_name}', f'Convert the last 30 days of {raw_table_name} to Parquet',
+            convert_days(30))
+
+        # The last 3 days rather than yesterday only, so a day of a failed or missed run is
+        # converted by the next run; the days already converted are skipped
+        self.__create_scheduled_queries(
+            stack, f'parquet_{table_name}', schedule,
+            [('convert', convert_days(3))], [raw_bucket])
+        return parquet_table
+
+    def __create_live_parquet_table(self, stack, kind, table_name, columns, raw_table_name, raw_bucket, raw_prefix,
+                                    **kwargs):
+        # Parquet copy of a log table that a Lambda function fills as the log files are
+        # delivered, one Parquet file per log file, and registers the partitions of in Glue
+        if 'pyarrow_layer_arn' not in kwargs:
+            raise ValueError('live_parquet needs pyarrow_layer_arn, the ARN of a Lambda layer with pyarrow')
+        live_table = self.__create_columnar_table(stack, table_name, 'live', [
+            glue.Column(name=column.name, type=glue.Schema.TIMESTAMP)
+            if column.name in TIMESTAMP_COLUMNS else column
+            for column in columns], projection=False)
+
+        converter = lambda_.Function(
+            stack, f'fn_{table_name}',
+            description=f'Converts the new {kind.upper()} log files to Parquet in {table_name}',
+            runtime=lambda_.Runtime.PYTHON_3_12,
+            handler='elb_logs.parquet_handler.handler',
+            code=lambda_.Code.from_asset(PROJECT_DIR, exclude=LAMBDA_CODE_EXCLUDE, ignore_mode=IgnoreMode.GIT),
+            layers=[lambda_.LayerVersion.from_layer_version_arn(
+                stack, f'layer_{table_name}', kwargs['pyarrow_layer_arn'])],
+            memory_size=1024,
+            timeout=Duration.minutes(5),
+            environment={
+                'DATABASE_NAME': self.logs_db.database_name,
+                'TABLE_NAME': table_name,
+                'LOG_TYPE': kind,
+            })
+        live_table.grant_read_write(converter)
+        self.encryption_key.grant_encrypt_decrypt(converter)
+        self.__subscribe_to_log_files(stack, raw_table_name, converter, raw_bucket, raw_prefix)
+        return live_table
+
+    def __subscribe_to_log_files(self, stack, raw_table_name, function, raw_bucket, raw_prefix):
+        # S3 refuses two notifications of the same event for overlapping prefixes, so the new log
+        # files of a log table are notified to one SNS topic and every function subscribes to it
+        if raw_table_name not in self.log_file_topics:
+            if not self.log_file_topics:
+                self.encryption_key.grant(iam.ServicePrincipal('s3.amazonaws.com'),
+                                          'kms:GenerateDataKey*', 'kms:Decrypt')
+            topic = sns.Topic(stack, f'topic_{raw_table_name}_log_files',
+                              master_key=self.encryption_key)
+            # Notifications of an imported bucket are added next to the existing ones
+            raw_bucket.add_event_notification(
+                s3.EventType.OBJECT_CREATED,
+                s3n.SnsDestination(topic),
+                s3.NotificationKeyFilter(prefix=f'{raw_prefix}/', suffix='.log.gz'))
+            self.log_file_topics[raw_table_name] = topic
+        self.log_file_topics[raw_table_name].add_subscription(sns_subscriptions.LambdaSubscription(function))
+        raw_bucket.grant_read(function, f'{raw_prefix}/*')
+
+    def __create_latency_metrics(self, stack, table_name, raw_bucket, raw_prefix, **kwargs):
+        # CloudWatch latency percentiles per target IP and URL path prefix, published by a
+        # Lambda function from each new ALB log file
+        namespace = kwargs.get('latency_metrics_namespace', 'ELBLogs/Latency')
+        publisher = lambda_.Function(
+            stack, f'fn_{table_name}_latency',
+            description=f'Publishes the latency percentiles of the new log files of {table_name} to CloudWatch',
+            runtime=lambda_.Runtime.PYTHON_3_12,
+            handler='elb_logs.latency_handler.handler',
+            code=lambda_.Code.from_asset(PROJECT_DIR, exclude=LAMBDA_CODE_EXCLUDE, ignore_mode=IgnoreMode.GIT),
+            memory_size=512,
+            timeout=Duration.minutes(5),
+            environment={
+                'NAMESPACE': namespace,
+                'PATH_DEPTH': str(kwargs.get('latency_path_depth', 1)),
+            })
+        publisher.add_to_role_policy(iam.PolicyStatement(
+            actions=['cloudwatch:PutMetricData'],
+            resources=['*'],
+            conditions={'StringEquals': {'cloudwatch:namespace': namespace}}))
+        self.__subscribe_to_log_files(stack, table_name, publisher, raw_bucket, raw_prefix)
+        return publisher
+
+    def __create_rollup_tables(self, stack, kind, table_id, raw_table_name, raw_bucket, **kwargs):
+        # Pre-aggregated tables for dashboards: requests, bytes and latency sums per
+        # elb/type/status/hour, and requests and bytes per elb/client_ip/ssl_protocol/day
+        lb_type = kind.upper()
+        hourly_table_name = f'tb_{kind}_rollup_hourly_{table_id}'
+        clients_table_name = f'tb_{kind}_rollup_clients_daily_{table_id}'
+        # Only ALB logs have a request type column
+        type_column = 'type, ' if kind == 'alb' else ''
+        log_time = 'from_iso8601_timestamp(time)'
+        last_30_days = self.__partition_filter(30)
+
+        self.__create_columnar_table(stack, hourly_table_name, 'rollup', [
+            glue.Column(name='hour', type=glue.Schema.TIMESTAMP),
+            glue.Column(name='elb', type=glue.Schema.STRING)] + (
+            [glue.Column(name='type', type=glue.Schema.STRING)] if type_column else []) + [
+            glue.Column(name='elb_status_code', type=glue.Schema.INTEGER),
+            glue.Column(name='requests', type=glue.Schema.BIG_INT),
+            glue.Column(name='received_bytes', type=glue.Schema.BIG_INT),
+            glue.Column(name='sent_bytes', type=glue.Schema.BIG_INT),
+            # Processing times are -1 when the target did not answer, these requests are not timed
+            glue.Column(name='timed_requests', type=glue.Schema.BIG_INT),
+            glue.Column(name='request_processing_time_sum', type=glue.Schema.DOUBLE),
+            glue.Column(name='target_processing_time_sum', type=glue.Schema.DOUBLE),
+            glue.Column(name='response_processing_time_sum', type=glue.Schema.DOUBLE),
+            glue.Column(name='target_processing_time_max', type=glue.Schema.DOUBLE)])
+
+        self.__create_columnar_table(stack, clients_table_name, 'rollup', [
+            glue.Column(name='elb', type=glue.Schema.STRING),
+            glue.Column(name='client_ip', type=glue.Schema.STRING),
+            glue.Column(name='ssl_protocol', type=glue.Schema.STRING),
+            glue.Column(name='requests', type=glue.Schema.BIG_INT),
+            glue.Column(name='received_bytes', type=glue.Schema.BIG_INT),
+            glue.Column(name='sent_bytes', type=glue.Schema.BIG_INT)])
+
+        def refresh_hourly(hours):
+            # Aggregates the complete hours of the last <hours> hours that are not in the rollup yet.
+            # Entries of an hour are delivered in log files of the same or of the next day.
+            hour = f'CAST(date_trunc(\'hour\', {log_time}) AS timestamp)'
+            window = (f"{log_time} >= date_trunc('hour', current_timestamp - interval '{hours}' hour) "
+                      f"AND {log_time} < date_trunc('hour', current_timestamp)")
+            return f"""INSERT INTO "{hourly_table_name}"
+            SELECT {hour} AS hour, elb, {type_column}elb_status_code,
+                COUNT(*) AS requests,
+                sum(received_bytes) AS received_bytes,
+                sum(sent_bytes) AS sent_bytes,
+                count_if(target_processing_time >= 0) AS timed_requests,
+                sum(IF(target_processing_time >= 0, request_processing_time, 0)) AS request_processing_time_sum,
+                sum(IF(target_processing_time >= 0, target_processing_time, 0)) AS target_processing_time_sum,
+                sum(IF(target_processing_time >= 0, response_processing_time, 0)) AS response_processing_time_sum,
+                max(target_processing_time) AS target_processing_time_max,
+                year({hour}) AS year, month({hour}) AS month, day({hour}) AS day
+            FROM "{raw_table_name}"
+            WHERE {window}
+                AND year * 10000 + month * 100 + day >= CAST(date_format(current_timestamp - interval '{hours}' hour, '%Y%m%d') AS integer)
+                AND {hour} NOT IN (
+                    SELECT DISTINCT hour FROM "{hourly_table_name}"
+                    WHERE year * 10000 + month * 100 + day >= CAST(date_format(current_timestamp - interval '{hours}' hour, '%Y%m%d') AS integer))
+            GROUP BY {hour}, elb, {type_column}elb_status_code"""
+
+        def refresh_clients(days):
+            # Aggregates the complete days of the last <days> days that are not in the rollup yet
+            log_date = f'date({log_time})'
+            return f"""INSERT INTO "{clients_table_name}"
+            SELECT elb, client_ip, ssl_protocol,
+                COUNT(*) AS requests,
+                sum(received_bytes) AS received_bytes,
+                sum(sent_bytes) AS sent_bytes,
+                year({log_date}) AS year, month({log_date}) AS month, day({log_date}) AS day
+            FROM "{raw_table_name}"
+            WHERE {log_date} BETWEEN current_date - interval '{days}' day AND current_date - interval '1' day
+                AND year * 10000 + month * 100 + day >= CAST(date_format(current_date - interval '{days}' day, '%Y%m%d') AS integer)
+                AND year({log_date}) * 10000 + month({log_date}) * 100 + day({log_date}) NOT IN (
+                    SELECT DISTINCT year * 10000 + month * 100 + day FROM "{clients_table_name}"
+                    WHERE year * 10000 + month * 100 + day >= CAST(date_format(current_date - interval '{days}' day, '%Y%m%d') AS integer))
+            GROUP BY elb, client_ip, ssl_protocol, {log_date}"""
+
+        self.__create_named_query(
+            stack, f'Rollup backfill - 30 days - {hourly_table_name}', f'Aggregate the last 30 days of {raw_table_name} per hour',
+            refresh_hourly(30 * 24))
+        self.__create_named_query(
+            stack, f'Rollup backfill - 30 days - {clients_table_name}', f'Aggregate the last 30 days of {raw_table_name} per client and day',
+            refresh_clients(30))
+
+        # Trailing windows (3 hours, 3 days) rather than the previous hour / day only, so the
+        # hours and days of a failed or missed run are aggregated by the next run; those already
+        # in the rollups are skipped
+        self.__create_scheduled_queries(
+            stack, f'rollup_hourly_{kind}_{table_id}',
+            kwargs.get('rollup_hourly_schedule', events.Schedule.cron(minute='20')),
+            [('refresh', refresh_hourly(3))], [raw_bucket])
+        self.__create_scheduled_queries(
+            stack, f'rollup_daily_{kind}_{table_id}',
+            kwargs.get('rollup_daily_schedule', events.Schedule.cron(minute='40', hour='0')),
+            [('refresh', refresh_clients(3))], [raw_bucket])
+
+        if type_column:
+            self.__create_named_query(
+                stack, f'{lb_type} - Request Type - 30 days - rollup - {table_id}', f'{lb_type} - Request Type - 30 days (hourly rollup)',
+                f"""SELECT elb, type, ROUND((sum(requests) * 100.0 / (SELECT sum(requests) FROM "{hourly_table_name}" WHERE hour > current_timestamp - interval '30' day AND {last_30_days})),2) AS percentage, sum(requests) AS requests
+            FROM "{hourly_table_name}"
+            WHERE hour > current_timestamp - interval '30' day
+                AND {last_30_days}
+            GROUP BY elb, type
+            ORDER BY percentage DESC""")
+
+        self.__create_named_query(
+            stack, f'{lb_type} - LB 4xx and 5xx errors per hour - 30 days - rollup - {table_id}', f'{lb_type} - LB 4xx and 5xx errors per hour - 30 days (hourly rollup)',
+            f"""SELECT elb, hour,
+                sum(requests) AS requests,
+                sum(IF(elb_status_code BETWEEN 400 AND 499, requests, 0)) AS lb_4xx,
+                sum(IF(elb_status_code BETWEEN 500 AND 599, requests, 0)) AS lb_5xx
+            FROM "{hourly_table_name}"
+            WHERE hour > current_timestamp - interval '30' day
+                AND {last_30_days}
+            GROUP BY elb, hour
+            ORDER BY elb, hour""")
+
+        self.__create_named_query(
+            stack, f'{lb_type} - Latency per hour - 30 days - rollup - {table_id}', f'{lb_type} - Latency per hour - 30 days (hourly rollup)',
+            f"""SELECT elb, hour,
+                sum(requests) AS requests,
+                ROUND(sum(request_processing_time_sum) / sum(timed_requests), 6) AS avg_request_processing_time,
+                ROUND(sum(target_processing_time_sum) / sum(timed_requests), 6) AS avg_target_processing_time,
+                ROUND(sum(response_processing_time_sum) / sum(timed_requests), 6) AS avg_response_processing_time,
+                max(target_processing_time_max) AS max_target_processing_time
+            FROM "{hourly_table_name}"
+            WHERE hour > current_timestamp - interval '30' day
+                AND {last_30_days}
+            GROUP BY elb, hour
+            ORDER BY elb, hour""")
+
+        self.__create_named_query(
+            stack, f'{lb_type} - Avg Request/Response size - 30 days - rollup - {table_id}', f'{lb_type} - Avg Request/Response size - 30 days (hourly rollup)',
+            f"""SELECT elb, ROUND(((sum(sent_bytes) + sum(received_bytes)) / 1000.0 / sum(requests)),2) as avg_request_response_kilobytes
+            FROM "{hourly_table_name}"
+            WHERE hour > current_timestamp - interval '30' day
+                AND {last_30_days}
+            GROUP BY elb""")
+
+        self.__create_named_query(
+            stack, f'{lb_type} - Top 10 talkers - Requests - 30 days - rollup - {table_id}', f'{lb_type} - Top 10 talkers - Requests - 30 days (daily rollup)',
+            f"""SELECT elb, client_ip, sum(requests) AS requests
+            FROM "{clients_table_name}"
+            WHERE {last_30_days}
+            GROUP BY elb, client_ip
+            ORDER BY requests DESC
+            LIMIT 10""")
+
+        self.__create_named_query(
+            stack, f'{lb_type} - Top 10 talkers - Megabytes - 30 days - rollup - {table_id}', f'{lb_type} - Top 10 talkers - Megabytes - 30 days (daily rollup)',
+            f"""SELECT elb, client_ip, ROUND(sum(received_bytes/1000000.0),2) as client_data_received_megabytes
+            FROM "{clients_table_name}"
+            WHERE {last_30_days}
+            GROUP by elb, client_ip
+            ORDER by client_data_received_megabytes DESC
+            LIMIT 10""")
+
+        self.__create_named_query(
+            stack, f'{lb_type} - Top 10 TLS 1.0 talkers - 30 days - rollup - {table_id}', f'{lb_type} - Top 10 TLS 1.0 talkers - 30 days (daily rollup)',
+            f"""SELECT elb, client_ip, sum(requests) AS requests
+            FROM "{clients_table_name}"
+            WHERE {last_30_days}
+                AND ssl_protocol = 'TLSv1'
+            GROUP BY elb, client_ip
+            ORDER BY requests DESC
+            LIMIT 10""")
+
+    def __create_approximate_queries(self, stack, kind, table_id, query_table, log_time, last_30_days,
+                                     tls_column, tls10, user_agents=True):
+        # Variants of the client queries with the approximate aggregations of Athena, which keep
+        # a fixed size state per group instead of a row per client: approx_distinct (HyperLogLog,
+        # 2.3% standard error), approx_most_frequent (space-saving, exact below the capacity of
+        # 10000 clients per elb) and approx_percentile
+        lb_type = kind.upper()
+
+        self.__create_named_query(
+            stack, f'{lb_type} - Distinct clients - 30 days - approximate - {table_id}', f'{lb_type} - Distinct clients - 30 days (approximate)',
+            f"""SELECT elb,
+                approx_distinct(client_ip) AS distinct_clients,
+                approx_distinct(IF({tls_column} = '{tls10}', client_ip)) AS distinct_tls10_clients,
+                COUNT(*) AS requests
+            FROM "{query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
+            GROUP BY elb
+            ORDER BY distinct_clients DESC""")
+
+        self.__create_named_query(
+            stack, f'{lb_type} - Distinct clients per day - 30 days - approximate - {table_id}', f'{lb_type} - Distinct clients per day - 30 days (approximate)',
+            f"""SELECT elb, year, month, day,
+                approx_distinct(client_ip) AS distinct_clients,
+                COUNT(*) AS requests
+            FROM "{query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
+            GROUP BY elb, year, month, day
+            ORDER BY elb, year, month, day""")
+
+        self.__create_named_query(
+            stack, f'{lb_type} - Top 10 talkers - Requests - 30 days - approximate - {table_id}', f'{lb_type} - Top 10 talkers - Requests - 30 days (approximate)',
+            f"""SELECT elb, client_ip, requests
+            FROM (
+                SELECT elb, approx_most_frequent(10, client_ip, 10000) AS talkers
+                FROM "{query_table}"
+                WHERE {log_time} > current_timestamp - interval '30' day
+                    AND {last_30_days}
+                GROUP BY elb)
+            CROSS JOIN UNNEST(talkers) AS talker (client_ip, requests)
+            ORDER BY requests DESC
+            LIMIT 10""")
+
+        if user_agents:
+            # approx_most_frequent takes one value: client IP and user agent are joined by a space,
+            # which IP addresses do not have
+            self.__create_named_query(
+                stack, f'{lb_type} - Top 100 Clients and User Agents for TLS 1.0 - 30 days - approximate - {table_id}', f'{lb_type} - Top 100 Clients and User Agents for TLS 1.0 - 30 days (approximate)',
+                f"""SELECT elb,
+                split_part(client, ' ', 1) AS client_ip,
+                substr(client, strpos(client, ' ') + 1) AS user_agent,
+                requests
+            FROM (
+                SELECT elb, approx_most_frequent(100, concat(client_ip, ' ', user_agent), 10000) AS clients
+                FROM "{query_table}"
+                WHERE {log_time} > current_timestamp - interval '30' day
+                    AND {last_30_days}
+                    AND {tls_column} = '{tls10}'
+                GROUP BY elb)
+            CROSS JOIN UNNEST(clients) AS client_requests (client, requests)
+            ORDER BY requests DESC
+            LIMIT 100""")
+
+        self.__create_named_query(
+            stack, f'{lb_type} - Request/Response size percentiles - 30 days - approximate - {table_id}', f'{lb_type} - Request/Response size percentiles - 30 days (approximate)',
+            f"""SELECT elb,
+                approx_percentile(received_bytes, 0.5) AS p50_received_bytes,
+                approx_percentile(received_bytes, 0.99) AS p99_received_bytes,
+                approx_percentile(sent_bytes, 0.5) AS p50_sent_bytes,
+                approx_percentile(sent_bytes, 0.99) AS p99_sent_bytes,
+                COUNT(*) AS requests
+            FROM "{query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
+            GROUP BY elb""")
+
+    def __create_lcu_queries(self, stack, table_id, query_table, log_time, scope, rules=None):
+        # LCUs per minute of the ALBs, like elb_logs.lcu: a connection is a client ip:port, new
+        # when it had no request in the previous minute. The rules processed per request are
+        # lcu_rules, else the number of matched rule priorities of the period
+        if rules is None:
+            rules = "count(DISTINCT NULLIF(matched_rule_priority, '-'))"
+
+        def minute_lcus(days):
+            return f"""WITH requests AS (
+                SELECT elb, date_trunc('minute', {log_time}) AS minute, client_ip, client_port,
+                    coalesce(received_bytes, 0) + coalesce(sent_bytes, 0) AS processed_bytes,
+                    matched_rule_priority
+                FROM "{query_table}"
+                WHERE {log_time} > current_timestamp - interval '{days}' day
+                    AND {scope}{self.__partition_filter(days)}
+            ),
+            connections AS (
+                SELECT elb, minute, COUNT(*) AS requests, sum(processed_bytes) AS processed_bytes,
+                    lag(minute) OVER (PARTITION BY elb, client_ip, client_port ORDER BY minute) AS previous_minute
+                FROM requests
+                GROUP BY elb, minute, client_ip, client_port
+            ),
+            listener_rules AS (
+                SELECT elb, {rules} AS rules
+                FROM requests
+                GROUP BY elb
+            ),
+            minutes AS (
+                SELECT elb, minute,
+                    sum(requests) AS requests,
+                    sum(processed_bytes) AS processed_bytes,
+                    COUNT(*) AS active_connections,
+                    count_if(previous_minute IS NULL OR previous_minute < minute - interval '1' minute) AS new_connections
+                FROM connections
+                GROUP BY elb, minute
+            ),
+            dimensions AS (
+                SELECT minutes.elb, minute,
+                    CAST(new_connections AS double) / 60 / {NEW_CONNECTIONS_PER_SECOND} AS new_connections_lcu,
+                    CAST(active_connections AS double) / {ACTIVE_CONNECTIONS_PER_MINUTE} AS active_connections_lcu,
+                    CAST(processed_bytes AS double) * 60 / {PROCESSED_BYTES_PER_HOUR} AS processed_bytes_lcu,
+                    CAST(requests AS double) / 60 * greatest(listener_rules.rules - {FREE_RULES}, 0) / {RULE_EVALUATIONS_PER_SECOND} AS rule_evaluations_lcu
+                FROM minutes
+                JOIN listener_rules ON listener_rules.elb = minutes.elb
+            ),
+            lcus AS (
+                SELECT *,
+                    greatest(new_connections_lcu, active_connections_lcu, processed_bytes_lcu, rule_evaluations_lcu) AS lcu
+                FROM dimensions
+            )"""
+
+        self.__create_named_query(
+            stack, f'ALB - LCU per minute - 1 day - {table_id}', 'ALB - LCU per minute - 1 day',
+            f"""{minute_lcus(1)}
+            SELECT elb, minute,
+                ROUND(new_connections_lcu, 3) AS new_connections_lcu,
+                ROUND(active_connections_lcu, 3) AS active_connections_lcu,
+                ROUND(processed_bytes_lcu, 3) AS processed_bytes_lcu,
+                ROUND(rule_evaluations_lcu, 3) AS rule_evaluations_lcu,
+                ROUND(lcu, 3) AS lcu
+            FROM lcus
+            ORDER BY elb, minute""")
+
+        # lcu_set is the peak rounded up, the value of an LCU reservation that covers every minute
+        self.__create_named_query(
+            stack, f'ALB - LCU peak and percentiles - 7 days - {table_id}', 'ALB - LCU peak and percentiles - 7 days',
+            f"""{minute_lcus(7)}
+            SELECT elb, COUNT(*) AS minutes,
+                ROUND(max(lcu), 2) AS peak_lcu,
+                max_by(minute, lcu) AS peak_minute,
+                max_by(CASE lcu
+                    WHEN new_connections_lcu THEN 'new_connections'
+                    WHEN active_connections_lcu THEN 'active_connections'
+                    WHEN processed_bytes_lcu THEN 'processed_bytes'
+                    ELSE 'rule_evaluations' END, lcu) AS peak_dimension,
+                ROUND(approx_percentile(lcu, 0.5), 2) AS p50_lcu,
+                ROUND(approx_percentile(lcu, 0.9), 2) AS p90_lcu,
+                ROUND(approx_percentile(lcu, 0.99), 2) AS p99_lcu,
+                ROUND(max(new_connections_lcu), 2) AS peak_new_connections_lcu,
+                ROUND(max(active_connections_lcu), 2) AS peak_active_connections_lcu,
+                ROUND(max(processed_bytes_lcu), 2) AS peak_processed_bytes_lcu,
+                ROUND(max(rule_evaluations_lcu), 2) AS peak_rule_evaluations_lcu,
+                CAST(greatest(ceil(max(lcu)), 1) AS integer) AS lcu_set
+            FROM lcus
+            GROUP BY elb
+            ORDER BY peak_lcu DESC""")
+
+        # Peaks per hour of the day (UTC), for the schedules of LCU reservations
+        self.__create_named_query(
+            stack, f'ALB - LCU peak per hour of day - 7 days - {table_id}', 'ALB - LCU peak per hour of day - 7 days',
+            f"""{minute_lcus(7)}
+            SELECT elb, hour(minute) AS hour_utc,
+                ROUND(max(lcu), 2) AS peak_lcu,
+                CAST(greatest(ceil(max(lcu)), 1) AS integer) AS lcu_set
+            FROM lcus
+            GROUP BY elb, hour(minute)
+            ORDER BY elb, hour_utc""")
+
     def athena_alb(self, name, bucket_name, **kwargs):
         bkt_acc_id = kwargs.get('bucket_account', self.account)
-        bucket_logs = s3.Bucket.from_bucket_name(self, f'alb_logs_{name}', bucket_name)
+        stack = self.__bucket_stack('alb', name)
+        bucket_logs = s3.Bucket.from_bucket_name(stack, f'alb_logs_{name}', bucket_name)
 
         if 'bucket_prefix' in kwargs:
             bucket_prefix = kwargs['bucket_prefix']
-            bucket_path = f'{bucket_prefix}/AWSLogs/{bkt_acc_id}/elasticloadbalancing/{self.region}'
             alb_table_id = f'{bucket_name}_{bucket_prefix}'
             alb_table_id = alb_table_id.replace('/', '_')
         else:
-            bucket_path = f'AWSLogs/{bkt_acc_id}/elasticloadbalancing/{self.region}'
             alb_table_id = f'{bucket_name}'
 
         alb_table_id = alb_table_id.lower()
+        accounts, regions = kwargs.get('accounts'), kwargs.get('regions')
+        if 'injected' in (accounts, regions) and (kwargs.get('parquet') or kwargs.get('rollups')):
+            raise ValueError('parquet and rollups need the accounts and regions of the logs, '
+                             'injected projection is not supported')
+        bucket_path, location_template = self.__log_path(
+            kwargs.get('bucket_prefix'), bkt_acc_id, accounts, regions)
         alb_table_name = f'tb_alb_logs_{alb_table_id}'
 
+        # Partition predicates, so that each query reads only the log files of its time window
+        scope = self.__scope_filter(bkt_acc_id, accounts, regions)
+        last_30_days = scope + self.__partition_filter(30)
+        time_range = scope + self.__partition_range('2022-09-12', '2022-09-19')
+
+        alb_columns = self.__columns(ALB_FIELDS)
+
         logs_table = glue.Table(
-            self, alb_table_name,
+            stack, alb_table_name,
             database=self.logs_db,
             table_name=alb_table_name,
             bucket=bucket_logs,
             s3_prefix=bucket_path,
-            columns=[
-                glue.Column(
-                    name='type',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='time',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='elb',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='client_ip',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='client_port',
-                    type=glue.Schema.INTEGER),
-                glue.Column(
-                    name='target_ip',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='target_port',
-                    type=glue.Schema.INTEGER),
-                glue.Column(
-                    name='request_processing_time',
-                    type=glue.Schema.DOUBLE),
-                glue.Column(
-                    name='target_processing_time',
-                    type=glue.Schema.DOUBLE),
-                glue.Column(
-                    name='response_processing_time',
-                    type=glue.Schema.DOUBLE),
-                glue.Column(
-                    name='elb_status_code',
-                    type=glue.Schema.INTEGER),
-                glue.Column(
-                    name='target_status_code',
-                    type=glue.Schema.INTEGER),
-                glue.Column(
-                    name='received_bytes',
-                    type=glue.Schema.BIG_INT),
-                glue.Column(
-                    name='sent_bytes',
-                    type=glue.Schema.BIG_INT),
-                glue.Column(
-                    name='request_verb',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='request_url',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='request_proto',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='user_agent',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='ssl_cipher',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='ssl_protocol',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='target_group_arn',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='trace_id',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='domain_name',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='chosen_cert_arn',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='matched_rule_priority',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='request_creation_time',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='actions_executed',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='redirect_url',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='lambda_error_reason',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='target_port_list',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='target_status_code_list',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='classification',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='classification_reason',
-                    type=glue.Schema.STRING)
-            ],
+            columns=alb_columns,
 
-            partition_keys=[
-                glue.Column(
-                    name='year',
-                    type=glue.Schema.INTEGER),
-                glue.Column(
-                    name='month',
-                    type=glue.Schema.INTEGER),
-                glue.Column(
-                    name='day',
-                    type=glue.Schema.INTEGER
-                )],
+            partition_keys=self.__partition_keys(accounts, regions),
 
             data_format=glue.DataFormat(
                 input_format=glue.InputFormat('org.apache.hadoop.mapred.TextInputFormat'),
@@ -233,195 +810,230 @@ class AthenaStack(Stack):
 
         logs_table_cfn = logs_table.node.default_child
         logs_table_cfn.add_override('Properties.TableInput.StorageDescriptor.SerdeInfo.Parameters.serialization\.format', 1)
-        input_regex = '([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*):([0-9]*) ([^ ]*)[:-]([0-9]*) ([-.0-9]*) ([-.0-9]*) ([-.0-9]*) (|[-0-9]*) (-|[-0-9]*) ([-0-9]*) ([-0-9]*) \"([^ ]*) ([^ ]*) (- |[^ ]*)\" \"([^\"]*)\" ([A-Z0-9-]+) ([A-Za-z0-9.-]*) ([^ ]*) \"([^\"]*)\" \"([^\"]*)\" \"([^\"]*)\" ([-.0-9]*) ([^ ]*) \"([^\"]*)\" \"([^\"]*)\" \"([^ ]*)\" \"([^s]+?)\" \"([^s]+)\" \"([^ ]*)\" \"([^ ]*)\"'
-        logs_table_cfn.add_override('Properties.TableInput.StorageDescriptor.SerdeInfo.Parameters.input\.regex', input_regex)
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.day\.digits', '2')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.day\.range', '01,31')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.day\.type', 'integer')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.month\.digits', '2')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.month\.range', '01,12')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.month\.type', 'integer')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.year\.digits', '4')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.year\.type', 'integer')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.year\.range', '2017,2050')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.enabled', 'true')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.EXTERNAL', 'TRUE')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.storage\.location\.template', f's3://{bucket_name}/{bucket_path}/${{year}}/${{month}}/${{day}}')
+        logs_table_cfn.add_override('Properties.TableInput.StorageDescriptor.SerdeInfo.Parameters.input\.regex', ALB_REGEX)
+        self.__project_partitions(logs_table_cfn, bucket_name, location_template, accounts, regions)
+
+        # Named queries read the Parquet table when there is one
+        alb_query_table = alb_table_name
+        log_time = 'from_iso8601_timestamp(time)'
+        range_start, range_end = "'2022-09-12T00:00:00.000000Z'", "'2022-09-19T23:59:59.9999999Z'"
+        if kwargs.get('parquet'):
+            alb_query_table = f'tb_alb_logs_parquet_{alb_table_id}'
+            self.__create_parquet_table(stack, alb_query_table, alb_table_name,
+                                        alb_columns + self.__scope_columns(accounts, regions), bucket_logs,
+                                        kwargs.get('parquet_schedule', events.Schedule.cron(minute='30', hour='0')))
+            log_time = 'time'
+            range_start, range_end = "timestamp '2022-09-12 00:00:00'", "timestamp '2022-09-19 23:59:59.999'"
+        if kwargs.get('live_parquet'):
+            self.__create_live_parquet_table(stack, 'alb', f'tb_alb_logs_live_{alb_table_id}',
+                                             alb_columns + self.__scope_columns(accounts, regions),
+                                             alb_table_name, bucket_logs, bucket_path, **kwargs)
+        if kwargs.get('latency_metrics'):
+            self.__create_latency_metrics(stack, alb_table_name, bucket_logs, bucket_path, **kwargs)
+        if kwargs.get('rollups'):
+            self.__create_rollup_tables(stack, 'alb', alb_table_id, alb_table_name, bucket_logs, **kwargs)
+
+        self.__create_approximate_queries(stack, 'alb', alb_table_id, alb_query_table, log_time, last_30_days,
+                                          'ssl_protocol', 'TLSv1')
+        self.__create_lcu_queries(stack, alb_table_id, alb_query_table, log_time, scope, kwargs.get('lcu_rules'))
 
         self.__create_named_query(
-            f'ALB - TLS Version - 30 days - {alb_table_id}', 'ALB - TLS Version - 30 days',
+            stack, f'ALB - TLS Version - 30 days - {alb_table_id}', 'ALB - TLS Version - 30 days',
             f"""WITH var as (
                 SELECT current_timestamp - interval '30' day as intrvl
             )
-            SELECT elb, ssl_protocol, ROUND((COUNT(ssl_protocol)* 100.0 / (SELECT COUNT(*) FROM "{alb_table_name}" WHERE ssl_protocol != '-'  AND from_iso8601_timestamp(time) > var.intrvl)),2) AS percentage, COUNT() AS requests
-            FROM "{alb_table_name}", var
-            WHERE from_iso8601_timestamp(time) > var.intrvl
+            SELECT elb, ssl_protocol, ROUND((COUNT(ssl_protocol)* 100.0 / (SELECT COUNT(*) FROM "{alb_query_table}" WHERE ssl_protocol != '-'  AND {log_time} > var.intrvl AND {last_30_days})),2) AS percentage, COUNT() AS requests
+            FROM "{alb_query_table}", var
+            WHERE {log_time} > var.intrvl
+                AND {last_30_days}
                 AND NOT ssl_protocol = '-'
             GROUP BY elb, ssl_protocol, var.intrvl
             ORDER BY percentage DESC""")
 
         self.__create_named_query(
-            f'ALB - TLS Ciphersuites - 30 days - {alb_table_id}', 'ALB - TLS Ciphersuites - 30 days',
+            stack, f'ALB - TLS Ciphersuites - 30 days - {alb_table_id}', 'ALB - TLS Ciphersuites - 30 days',
             f"""WITH var as (
                 SELECT current_timestamp - interval '30' day as intrvl
             )
-            SELECT elb, ssl_cipher, ROUND((COUNT(ssl_cipher)* 100.0 / (SELECT COUNT(*) FROM "{alb_table_name}" WHERE ssl_cipher != '-' AND from_iso8601_timestamp(time) > var.intrvl)),2) AS percentage, COUNT() AS requests
-            FROM "{alb_table_name}", var
-            WHERE from_iso8601_timestamp(time) > var.intrvl
+            SELECT elb, ssl_cipher, ROUND((COUNT(ssl_cipher)* 100.0 / (SELECT COUNT(*) FROM "{alb_query_table}" WHERE ssl_cipher != '-' AND {log_time} > var.intrvl AND {last_30_days})),2) AS percentage, COUNT() AS requests
+            FROM "{alb_query_table}", var
+            WHERE {log_time} > var.intrvl
+                AND {last_30_days}
                 AND NOT ssl_cipher = '-'
             GROUP BY elb, ssl_cipher, var.intrvl
             ORDER BY percentage DESC""")
 
         self.__create_named_query(
-            f'ALB - Request Type - 30 days - {alb_table_id}', 'ALB - Request Type - 30 days',
+            stack, f'ALB - Request Type - 30 days - {alb_table_id}', 'ALB - Request Type - 30 days',
             f"""WITH var as (
                 SELECT current_timestamp - interval '30' day as intrvl
             )
-            SELECT elb, type, round((Count(type)* 100.0 / (Select Count(*) From "{alb_table_name}" WHERE from_iso8601_timestamp(time) > var.intrvl)),2) AS percentage, COUNT(type) AS requests
-            FROM "{alb_table_name}", var
-            WHERE from_iso8601_timestamp(time) > var.intrvl
+            SELECT elb, type, round((Count(type)* 100.0 / (Select Count(*) From "{alb_query_table}" WHERE {log_time} > var.intrvl AND {last_30_days})),2) AS percentage, COUNT(type) AS requests
+            FROM "{alb_query_table}", var
+            WHERE {log_time} > var.intrvl
+                AND {last_30_days}
             GROUP BY  elb, type, var.intrvl
             ORDER BY percentage DESC""")
 
         self.__create_named_query(
-            f'ALB - TLS Version and Ciphersuites combined - 30 days - {alb_table_id}', 'ALB - TLS Version and Ciphersuites combined - 30 days',
+            stack, f'ALB - TLS Version and Ciphersuites combined - 30 days - {alb_table_id}', 'ALB - TLS Version and Ciphersuites combined - 30 days',
             f"""SELECT DISTINCT elb, ssl_cipher, ssl_protocol,  count(ssl_cipher) AS requests
-            FROM "{alb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
+            FROM "{alb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
                 AND NOT ssl_protocol = '-'
             GROUP BY elb, ssl_cipher,ssl_protocol
             ORDER BY requests DESC""")
 
         self.__create_named_query(
-            f'ALB - Top 10 TLS 1.0 talkers - 30 days - {alb_table_id}', 'ALB - Top 10 TLS 1.0 talkers - 30 days',
+            stack, f'ALB - Top 10 TLS 1.0 talkers - 30 days - {alb_table_id}', 'ALB - Top 10 TLS 1.0 talkers - 30 days',
             f"""SELECT elb, client_ip, COUNT(*) AS requests
-            FROM "{alb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
+            FROM "{alb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
                 AND ssl_protocol = 'TLSv1'
             GROUP BY elb, client_ip
             ORDER BY requests DESC
             LIMIT 10""")
 
         self.__create_named_query(
-            f'ALB - Top 100 Clients and User Agents for TLS 1.0 - 30 days - {alb_table_id}', 'ALB - Top 10 TLS 1.0 talkers - 30 days',
+            stack, f'ALB - Top 100 Clients and User Agents for TLS 1.0 - 30 days - {alb_table_id}', 'ALB - Top 10 TLS 1.0 talkers - 30 days',
             f"""SELECT DISTINCT(elb, client_ip, ssl_protocol, user_agent), COUNT(*) AS requests
-            FROM "{alb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
+            FROM "{alb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
                 AND ssl_protocol = 'TLSv1'
             GROUP BY (elb, client_ip, ssl_protocol, user_agent)
             ORDER BY requests DESC
             LIMIT 100""")
 
         self.__create_prepared_statement(
-            f'alb_tls_version_{alb_table_id}',
+            stack, f'alb_tls_version_{alb_table_id}',
             'ALB TLS Version Distribution',
             f"""SELECT elb, ssl_protocol, COUNT() AS requests
-            FROM "{alb_table_name}"
-            WHERE from_iso8601_timestamp(time) > date_add('day', ?, current_timestamp)
+            FROM "{alb_query_table}"
+            WHERE {scope}year * 10000 + month * 100 + day >= CAST(date_format(date_add('day', ?, current_date), '%Y%m%d') AS integer)
                 AND NOT ssl_protocol = '-'
                 AND elb = ?
             GROUP BY elb, ssl_protocol
             """)
 
         self.__create_named_query(
-            f'ALB - Top 10 talkers - Requests - 30 days - {alb_table_id}', 'ALB - Top 10 talkers - Requests - 30 days',
+            stack, f'ALB - Top 10 talkers - Requests - 30 days - {alb_table_id}', 'ALB - Top 10 talkers - Requests - 30 days',
             f"""SELECT elb, client_ip, COUNT(*) AS requests
-            FROM "{alb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
+            FROM "{alb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
             GROUP BY elb, client_ip
             ORDER BY requests DESC
             LIMIT 10""")
 
         self.__create_named_query(
-            f'ALB - Top 10 talkers - Requests - Time Range - {alb_table_id}', 'ALB - Top 10 talkers - Requests - Time Range days',
+            stack, f'ALB - Top 10 talkers - Requests - Time Range - {alb_table_id}', 'ALB - Top 10 talkers - Requests - Time Range days',
             f"""SELECT elb, client_ip, COUNT(*) AS requests
-            FROM "{alb_table_name}"
-            WHERE time >= '2022-09-12T00:00:00.000000Z'
-            AND time <= '2022-09-19T23:59:59.9999999Z'
+            FROM "{alb_query_table}"
+            WHERE time >= {range_start}
+            AND time <= {range_end}
+            AND {time_range}
             GROUP BY elb, client_ip
             ORDER BY requests DESC
             LIMIT 10""")
 
         self.__create_named_query(
-            f'ALB - Top 10 talkers - Megabytes - 30 days - {alb_table_id}', 'ALB - Top 10 talkers - Megabytes - 30 days',
+            stack, f'ALB - Top 10 talkers - Megabytes - 30 days - {alb_table_id}', 'ALB - Top 10 talkers - Megabytes - 30 days',
             f"""SELECT elb, client_ip, ROUND(sum(received_bytes/1000000.0),2) as client_data_received_megabytes
-            FROM "{alb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
-            -- WHERE time >= '2022-09-12T00:00:00.000000Z'
-            -- AND time <= '2022-09-19T23:59:59.9999999Z'
+            FROM "{alb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
+            -- WHERE time >= {range_start}
+            -- AND time <= {range_end}
+            -- AND {time_range}
             GROUP by elb, client_ip
             ORDER by client_data_received_megabytes DESC;""")
 
         self.__create_named_query(
-            f'ALB - Avg Request/Response size - 30 days - {alb_table_id}', 'ALB - Avg Request/Response size - 30 days',
+            stack, f'ALB - Avg Request/Response size - 30 days - {alb_table_id}', 'ALB - Avg Request/Response size - 30 days',
             f"""SELECT elb, ROUND((avg(sent_bytes)/1000.0 + avg(received_bytes)/1000.0),2) as avg_request_response_kilobytes
-            FROM "{alb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
-            -- WHERE time >= '2022-09-12T00:00:00.000000Z'
-            -- AND time <= '2022-09-19T23:59:59.9999999Z'
+            FROM "{alb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
+            -- WHERE time >= {range_start}
+            -- AND time <= {range_end}
+            -- AND {time_range}
             GROUP BY elb""")
 
         self.__create_named_query(
-            f'ALB - Target Distribution - 30 days - {alb_table_id}', 'ALB - Target Distribution - 30 days',
+            stack, f'ALB - Target Distribution - 30 days - {alb_table_id}', 'ALB - Target Distribution - 30 days',
             f"""WITH var as (
                 SELECT current_timestamp - interval '30' day as intrvl
             )
-            SELECT elb, target_ip, ROUND((Count(target_ip)* 100.0 / (Select Count(*) From "{alb_table_name}" WHERE from_iso8601_timestamp(time) > var.intrvl AND NOT target_ip = '')),2)
+            SELECT elb, target_ip, ROUND((Count(target_ip)* 100.0 / (Select Count(*) From "{alb_query_table}" WHERE {log_time} > var.intrvl AND {last_30_days} AND NOT target_ip = '')),2)
             as backend_traffic_percentage
-            FROM "{alb_table_name}", var
-            WHERE from_iso8601_timestamp(time) > var.intrvl
+            FROM "{alb_query_table}", var
+            WHERE {log_time} > var.intrvl
+                AND {last_30_days}
                 AND NOT target_ip = ''
             GROUP by elb, target_ip, var.intrvl
             ORDER By count() DESC;""")
 
         self.__create_named_query(
-            f'ALB - LB 4xx and 5xx errors - 30 days - {alb_table_id}', 'ALB - LB 4xx and 5xx errors - 30 days',
-            f"""SELECT * FROM "{alb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
-                -- WHERE time >= '2022-09-12T00:00:00.000000Z'
-                -- AND time <= '2022-09-19T23:59:59.9999999Z'
+            stack, f'ALB - LB 4xx and 5xx errors - 30 days - {alb_table_id}', 'ALB - LB 4xx and 5xx errors - 30 days',
+            f"""SELECT * FROM "{alb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
+                -- WHERE time >= {range_start}
+                -- AND time <= {range_end}
+                -- AND {time_range}
                 -- AND elb_status_code = 400
                 AND elb_status_code BETWEEN 400 AND 599;""")
 
         self.__create_named_query(
-            f'ALB - Target 4xx and 5xx errors - 30 days - {alb_table_id}', 'ALB - Target 4xx and 5xx errors - 30 days',
-            f"""SELECT * FROM "{alb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
-                -- WHERE time >= '2022-09-12T00:00:00.000000Z'
-                -- AND time <= '2022-09-19T23:59:59.9999999Z'
+            stack, f'ALB - Target 4xx and 5xx errors - 30 days - {alb_table_id}', 'ALB - Target 4xx and 5xx errors - 30 days',
+            f"""SELECT * FROM "{alb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
+                -- WHERE time >= {range_start}
+                -- AND time <= {range_end}
+                -- AND {time_range}
                 -- AND target_status_code = 400
                 AND target_status_code BETWEEN 400 AND 599;""")
 
         self.__create_named_query(
-            f'ALB - Client IPs per URL hit - 30 days - {alb_table_id}', 'ALB - Client IPs per URL hit - 30 days',
-            f"""SELECT client_ip, elb, request_url, count(*) as count FROM "{alb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
-            -- WHERE time >= '2022-09-12T00:00:00.000000Z'
-            -- AND time <= '2022-09-19T23:59:59.9999999Z'
+            stack, f'ALB - Client IPs per URL hit - 30 days - {alb_table_id}', 'ALB - Client IPs per URL hit - 30 days',
+            f"""SELECT client_ip, elb, request_url, count(*) as count FROM "{alb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
+            -- WHERE time >= {range_start}
+            -- AND time <= {range_end}
+            -- AND {time_range}
             GROUP by client_ip, elb, request_url
             ORDER by count DESC;""")
 
         self.__create_named_query(
-            f'ALB - Top 100 user-agents - 30 days - {alb_table_id}', 'ALB - Top 100 user-agents - 30 days',
+            stack, f'ALB - Top 100 user-agents - 30 days - {alb_table_id}', 'ALB - Top 100 user-agents - 30 days',
             f"""SELECT elb, user_agent, COUNT(*) AS requests
-            FROM "{alb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
-            -- WHERE time >= '2022-09-12T00:00:00.000000Z'
-            -- AND time <= '2022-09-19T23:59:59.9999999Z'
+            FROM "{alb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
+            -- WHERE time >= {range_start}
+            -- AND time <= {range_end}
+            -- AND {time_range}
             GROUP BY elb, user_agent
             ORDER BY requests DESC
             LIMIT 100;""")
 
         self.__create_named_query(
-            f'ALB - Slow Responses - 30 days - {alb_table_id}', 'ALB - Slow Responses - 30 days',
-            f"""SELECT * FROM "{alb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
-            -- WHERE time >= '2022-09-12T00:00:00.000000Z'
-            -- AND time <= '2022-09-19T23:59:59.9999999Z'
+            stack, f'ALB - Slow Responses - 30 days - {alb_table_id}', 'ALB - Slow Responses - 30 days',
+            f"""SELECT * FROM "{alb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
+            -- WHERE time >= {range_start}
+            -- AND time <= {range_end}
+            -- AND {time_range}
             AND target_processing_time >= 5.0""")
 
         self.__create_named_query(
-            f'ALB - Aggregated Log Information - 30 days - {alb_table_id}', 'ALB - Aggregated Log Information - 30 days',
+            stack, f'ALB - Aggregated Log Information - 30 days - {alb_table_id}', 'ALB - Aggregated Log Information - 30 days',
             f"""SELECT elb,
                 count(1) AS requestCount,
                 min(time) as firstLogTime,
@@ -430,15 +1042,18 @@ class AthenaStack(Stack):
                 sum(received_bytes) as totalBytesReceived,
                 sum(sent_bytes) as totalBytesSent,
                 sum(received_bytes+sent_bytes) AS totalBytes
-            FROM "{alb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
-            -- WHERE time >= '2022-09-12T00:00:00.000000Z'
-            -- AND time <= '2022-09-19T23:59:59.9999999Z'
+            FROM "{alb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
+            -- WHERE time >= {range_start}
+            -- AND time <= {range_end}
+            -- AND {time_range}
             GROUP BY elb
             ORDER BY requestCount DESC limit 10;""")
 
         self.__create_named_query(
-            f'ALB - Processed Traffic by ELB & Target IP - 30 days - {alb_table_id}', 'ALB - Processed Traffic by ELB & Target IP - 30 days',
+            stack, f'ALB - Processed Traffic by ELB & Target IP - 30 days - {alb_table_id}', 'ALB - Processed Traffic by ELB & Target IP - 30 days',
+            # elb_ip comes from the name of the raw log file, so this query always reads the raw table
             f"""SELECT target_ip AS target,
                 count(target_ip) AS count,
                 sum(received_bytes) as totalRecvBytes,
@@ -456,105 +1071,178 @@ class AthenaStack(Stack):
                 approx_percentile(response_processing_time, 0.999) as P999Response
             FROM "{alb_table_name}"
             WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
+                AND {last_30_days}
             -- WHERE time >= '2022-09-12T00:00:00.000000Z'
             -- AND time <= '2022-09-19T23:59:59.9999999Z'
+            -- AND {time_range}
             GROUP BY  target_ip, regexp_extract("$path",'((1?[0-9][0-9]?|2[0-4][0-9]|25[0-5])\.){{3}}(1?[0-9][0-9]?|2[0-4][0-9]|25[0-5])')
             ORDER BY count DESC limit 1000;
             """)
 
+    def athena_alb_connection(self, name, bucket_name, **kwargs):
+        # ALB connection logs: one entry per client connection with the TLS handshake latency and
+        # the result of the client certificate verification (mTLS). ALB writes them under the same
+        # AWSLogs/ path as the access logs, so they need their own bucket or prefix.
+        bkt_acc_id = kwargs.get('bucket_account', self.account)
+        stack = self.__bucket_stack('alb_connection', name)
+        bucket_logs = s3.Bucket.from_bucket_name(stack, f'alb_connection_logs_{name}', bucket_name)
+
+        if 'bucket_prefix' in kwargs:
+            bucket_prefix = kwargs['bucket_prefix']
+            connection_table_id = f'{bucket_name}_{bucket_prefix}'
+            connection_table_id = connection_table_id.replace('/', '_')
+        else:
+            connection_table_id = f'{bucket_name}'
+
+        connection_table_id = connection_table_id.lower()
+        accounts, regions = kwargs.get('accounts'), kwargs.get('regions')
+        bucket_path, location_template = self.__log_path(
+            kwargs.get('bucket_prefix'), bkt_acc_id, accounts, regions)
+        connection_table_name = f'tb_alb_connection_logs_{connection_table_id}'
+
+        # Partition predicates, so that each query reads only the log files of its time window
+        scope = self.__scope_filter(bkt_acc_id, accounts, regions)
+        last_30_days = scope + self.__partition_filter(30)
+        last_7_days = scope + self.__partition_filter(7)
+
+        logs_table = glue.Table(
+            stack, connection_table_name,
+            database=self.logs_db,
+            table_name=connection_table_name,
+            bucket=bucket_logs,
+            s3_prefix=bucket_path,
+            columns=self.__columns(ALB_CONNECTION_FIELDS),
+
+            partition_keys=self.__partition_keys(accounts, regions),
+
+            data_format=glue.DataFormat(
+                input_format=glue.InputFormat('org.apache.hadoop.mapred.TextInputFormat'),
+                output_format=glue.OutputFormat('org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat'),
+                serialization_library=glue.SerializationLibrary('org.apache.hadoop.hive.serde2.RegexSerDe')
+            )
+        )
+
+        logs_table_cfn = logs_table.node.default_child
+        logs_table_cfn.add_override('Properties.TableInput.StorageDescriptor.SerdeInfo.Parameters.serialization\.format', 1)
+        logs_table_cfn.add_override('Properties.TableInput.StorageDescriptor.SerdeInfo.Parameters.input\.regex', ALB_CONNECTION_REGEX)
+        self.__project_partitions(logs_table_cfn, bucket_name, location_template, accounts, regions)
+
+        # Client subnets: /24 for IPv4 and /48 for IPv6 clients
+        client_subnet = "CAST(ip_prefix(CAST(client_ip AS IPADDRESS), IF(strpos(client_ip, ':') > 0, 48, 24)) AS varchar)"
+
+        self.__create_named_query(
+            stack, f'ALB Connections - TLS handshake latency per client subnet - 7 days - {connection_table_id}', 'ALB Connections - TLS handshake latency per client subnet - 7 days',
+            f"""SELECT {client_subnet} AS client_subnet,
+                COUNT(*) AS connections,
+                ROUND(approx_percentile(tls_handshake_latency, 0.5), 3) AS p50_handshake_seconds,
+                ROUND(approx_percentile(tls_handshake_latency, 0.9), 3) AS p90_handshake_seconds,
+                ROUND(approx_percentile(tls_handshake_latency, 0.99), 3) AS p99_handshake_seconds,
+                ROUND(max(tls_handshake_latency), 3) AS max_handshake_seconds
+            FROM "{connection_table_name}"
+            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '7' day
+                AND {last_7_days}
+                AND tls_handshake_latency IS NOT NULL
+            GROUP BY 1
+            HAVING COUNT(*) >= 100
+            ORDER BY p99_handshake_seconds DESC
+            LIMIT 100""")
+
+        self.__create_named_query(
+            stack, f'ALB Connections - TLS handshake latency per hour - 7 days - {connection_table_id}', 'ALB Connections - TLS handshake latency per hour - 7 days',
+            f"""SELECT date_trunc('hour', from_iso8601_timestamp(time)) AS hour,
+                listener_port,
+                COUNT(*) AS connections,
+                ROUND(approx_percentile(tls_handshake_latency, 0.5), 3) AS p50_handshake_seconds,
+                ROUND(approx_percentile(tls_handshake_latency, 0.99), 3) AS p99_handshake_seconds
+            FROM "{connection_table_name}"
+            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '7' day
+                AND {last_7_days}
+                AND tls_handshake_latency IS NOT NULL
+            GROUP BY 1, 2
+            ORDER BY 1, 2""")
+
+        self.__create_named_query(
+            stack, f'ALB Connections - TLS protocol and cipher cost - 30 days - {connection_table_id}', 'ALB Connections - TLS protocol and cipher cost - 30 days',
+            f"""SELECT tls_protocol, tls_cipher,
+                COUNT(*) AS connections,
+                ROUND(COUNT(*) * 100.0 / sum(COUNT(*)) OVER (), 2) AS percentage,
+                ROUND(avg(tls_handshake_latency), 4) AS avg_handshake_seconds,
+                ROUND(approx_percentile(tls_handshake_latency, 0.99), 3) AS p99_handshake_seconds,
+                ROUND(sum(tls_handshake_latency), 1) AS total_handshake_seconds
+            FROM "{connection_table_name}"
+            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
+                AND {last_30_days}
+                AND NOT tls_protocol = '-'
+            GROUP BY tls_protocol, tls_cipher
+            ORDER BY total_handshake_seconds DESC""")
+
+        self.__create_named_query(
+            stack, f'ALB Connections - mTLS failure rate per day - 30 days - {connection_table_id}', 'ALB Connections - mTLS failure rate per day - 30 days',
+            f"""SELECT year, month, day, listener_port,
+                COUNT(*) AS connections,
+                count_if(tls_verify_status LIKE 'Failed%') AS failed_verifications,
+                ROUND(count_if(tls_verify_status LIKE 'Failed%') * 100.0 / COUNT(*), 3) AS failure_percentage,
+                approx_distinct(IF(tls_verify_status LIKE 'Failed%', client_ip)) AS failed_clients
+            FROM "{connection_table_name}"
+            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
+                AND {last_30_days}
+                AND NOT tls_verify_status = '-'
+            GROUP BY year, month, day, listener_port
+            ORDER BY year, month, day, listener_port""")
+
+        self.__create_named_query(
+            stack, f'ALB Connections - mTLS failures per reason - 7 days - {connection_table_id}', 'ALB Connections - mTLS failures per reason - 7 days',
+            f"""SELECT tls_verify_status,
+                {client_subnet} AS client_subnet,
+                COUNT(*) AS failed_verifications,
+                approx_distinct(client_ip) AS clients,
+                arbitrary(leaf_client_cert_subject) AS example_cert_subject,
+                max(time) AS last_failure
+            FROM "{connection_table_name}"
+            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '7' day
+                AND {last_7_days}
+                AND tls_verify_status LIKE 'Failed%'
+            GROUP BY 1, 2
+            ORDER BY failed_verifications DESC
+            LIMIT 100""")
+
     def athena_clb(self, name, bucket_name, **kwargs):
         bkt_acc_id = kwargs.get('bucket_account', self.account)
-        bucket_logs = s3.Bucket.from_bucket_name(self, f'clb_logs_{name}', bucket_name)
+        stack = self.__bucket_stack('clb', name)
+        bucket_logs = s3.Bucket.from_bucket_name(stack, f'clb_logs_{name}', bucket_name)
 
         if 'bucket_prefix' in kwargs:
             bucket_prefix = kwargs['bucket_prefix']
-            bucket_path = f'{bucket_prefix}/AWSLogs/{bkt_acc_id}/elasticloadbalancing/{self.region}'
             clb_table_id = f'{bucket_name}_{bucket_prefix}'
             clb_table_id = clb_table_id.replace('/', '_')
         else:
-            bucket_path = f'AWSLogs/{bkt_acc_id}/elasticloadbalancing/{self.region}'
             clb_table_id = bucket_name
 
         clb_table_id = clb_table_id.lower()
+        accounts, regions = kwargs.get('accounts'), kwargs.get('regions')
+        if 'injected' in (accounts, regions) and (kwargs.get('parquet') or kwargs.get('rollups')):
+            raise ValueError('parquet and rollups need the accounts and regions of the logs, '
+                             'injected projection is not supported')
+        bucket_path, location_template = self.__log_path(
+            kwargs.get('bucket_prefix'), bkt_acc_id, accounts, regions)
         clb_table_name = f'tb_clb_logs_{clb_table_id}'
 
+        # Partition predicates, so that each query reads only the log files of its time window
+        scope = self.__scope_filter(bkt_acc_id, accounts, regions)
+        last_30_days = scope + self.__partition_filter(30)
+        time_range = scope + self.__partition_range('2022-09-12', '2022-09-19')
+
+        clb_columns = self.__columns(CLB_FIELDS)
+
         logs_table = glue.Table(
-            self, clb_table_name,
+            stack, clb_table_name,
             database=self.logs_db,
             table_name=clb_table_name,
             bucket=bucket_logs,
             s3_prefix=bucket_path,
-            columns=[
-                glue.Column(
-                    name='time',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='elb',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='client_ip',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='client_port',
-                    type=glue.Schema.INTEGER),
-                glue.Column(
-                    name='target_ip',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='target_port',
-                    type=glue.Schema.INTEGER),
-                glue.Column(
-                    name='request_processing_time',
-                    type=glue.Schema.DOUBLE),
-                glue.Column(
-                    name='target_processing_time',
-                    type=glue.Schema.DOUBLE),
-                glue.Column(
-                    name='response_processing_time',
-                    type=glue.Schema.DOUBLE),
-                glue.Column(
-                    name='elb_status_code',
-                    type=glue.Schema.INTEGER),
-                glue.Column(
-                    name='target_status_code',
-                    type=glue.Schema.INTEGER),
-                glue.Column(
-                    name='received_bytes',
-                    type=glue.Schema.BIG_INT),
-                glue.Column(
-                    name='sent_bytes',
-                    type=glue.Schema.BIG_INT),
-                glue.Column(
-                    name='request_verb',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='request_url',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='request_proto',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='user_agent',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='ssl_cipher',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='ssl_protocol',
-                    type=glue.Schema.STRING)
-            ],
+            columns=clb_columns,
 
-            partition_keys=[
-                glue.Column(
-                    name='year',
-                    type=glue.Schema.INTEGER),
-                glue.Column(
-                    name='month',
-                    type=glue.Schema.INTEGER),
-                glue.Column(
-                    name='day',
-                    type=glue.Schema.INTEGER
-                )],
+            partition_keys=self.__partition_keys(accounts, regions),
 
             data_format=glue.DataFormat(
                 input_format=glue.InputFormat('org.apache.hadoop.mapred.TextInputFormat'),
@@ -565,193 +1253,225 @@ class AthenaStack(Stack):
 
         logs_table_cfn = logs_table.node.default_child
         logs_table_cfn.add_override('Properties.TableInput.StorageDescriptor.SerdeInfo.Parameters.serialization\.format', 1)
-        input_regex = '([^ ]*) ([^ ]*) ([^ ]*):([0-9]*) ([^ ]*)[:\-]([0-9]*) ([-.0-9]*) ([-.0-9]*) ([-.0-9]*) (|[-0-9]*) (-|[-0-9]*) ([-0-9]*) ([-0-9]*) \\\"([^ ]*) ([^ ]*) (- |[^ ]*)\\\" (\"[^\"]*\") ([A-Z0-9-]+) ([A-Za-z0-9.-]*)$'
-        logs_table_cfn.add_override('Properties.TableInput.StorageDescriptor.SerdeInfo.Parameters.input\.regex', input_regex)
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.day\.digits', '2')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.day\.range', '01,31')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.day\.type', 'integer')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.month\.digits', '2')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.month\.range', '01,12')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.month\.type', 'integer')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.year\.digits', '4')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.year\.type', 'integer')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.year\.range', '2017,2050')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.enabled', 'true')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.EXTERNAL', 'TRUE')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.storage\.location\.template', f's3://{bucket_name}/{bucket_path}/${{year}}/${{month}}/${{day}}')
+        logs_table_cfn.add_override('Properties.TableInput.StorageDescriptor.SerdeInfo.Parameters.input\.regex', CLB_REGEX)
+        self.__project_partitions(logs_table_cfn, bucket_name, location_template, accounts, regions)
+
+        # Named queries read the Parquet table when there is one
+        clb_query_table = clb_table_name
+        log_time = 'from_iso8601_timestamp(time)'
+        range_start, range_end = "'2022-09-12T00:00:00.000000Z'", "'2022-09-19T23:59:59.9999999Z'"
+        if kwargs.get('parquet'):
+            clb_query_table = f'tb_clb_logs_parquet_{clb_table_id}'
+            self.__create_parquet_table(stack, clb_query_table, clb_table_name,
+                                        clb_columns + self.__scope_columns(accounts, regions), bucket_logs,
+                                        kwargs.get('parquet_schedule', events.Schedule.cron(minute='30', hour='0')))
+            log_time = 'time'
+            range_start, range_end = "timestamp '2022-09-12 00:00:00'", "timestamp '2022-09-19 23:59:59.999'"
+        if kwargs.get('live_parquet'):
+            self.__create_live_parquet_table(stack, 'clb', f'tb_clb_logs_live_{clb_table_id}',
+                                             clb_columns + self.__scope_columns(accounts, regions),
+                                             clb_table_name, bucket_logs, bucket_path, **kwargs)
+        if kwargs.get('rollups'):
+            self.__create_rollup_tables(stack, 'clb', clb_table_id, clb_table_name, bucket_logs, **kwargs)
+
+        self.__create_approximate_queries(stack, 'clb', clb_table_id, clb_query_table, log_time, last_30_days,
+                                          'ssl_protocol', 'TLSv1')
 
         self.__create_named_query(
-            f'CLB - TLS Version - 30 days - {clb_table_id}', 'CLB - TLS Version - 30 days',
+            stack, f'CLB - TLS Version - 30 days - {clb_table_id}', 'CLB - TLS Version - 30 days',
             f"""WITH var as (
                 SELECT current_timestamp - interval '30' day as intrvl
             )
-            SELECT elb, ssl_protocol, ROUND((COUNT(ssl_protocol)* 100.0 / (SELECT COUNT(*) FROM "{clb_table_name}" WHERE ssl_protocol != '-' AND from_iso8601_timestamp(time) > var.intrvl)),2) AS percentage, COUNT() AS requests
-            FROM "{clb_table_name}", var
-            WHERE from_iso8601_timestamp(time) > var.intrvl
+            SELECT elb, ssl_protocol, ROUND((COUNT(ssl_protocol)* 100.0 / (SELECT COUNT(*) FROM "{clb_query_table}" WHERE ssl_protocol != '-' AND {log_time} > var.intrvl AND {last_30_days})),2) AS percentage, COUNT() AS requests
+            FROM "{clb_query_table}", var
+            WHERE {log_time} > var.intrvl
+                AND {last_30_days}
                 AND NOT ssl_protocol = '-'
             GROUP BY elb, ssl_protocol, var.intrvl
             ORDER BY percentage DESC""")
 
         self.__create_named_query(
-            f'CLB - TLS Ciphersuites - 30 days - {clb_table_id}', 'CLB - TLS Ciphersuites - 30 days',
+            stack, f'CLB - TLS Ciphersuites - 30 days - {clb_table_id}', 'CLB - TLS Ciphersuites - 30 days',
             f"""WITH var as (
                 SELECT current_timestamp - interval '30' day as intrvl
             )
-            SELECT elb, ssl_cipher, ROUND((COUNT(ssl_cipher)* 100.0 / (SELECT COUNT(*) FROM "{clb_table_name}" WHERE ssl_cipher != '-' AND from_iso8601_timestamp(time) > var.intrvl)),2) AS percentage, COUNT() AS requests
-            FROM "{clb_table_name}", var
-            WHERE from_iso8601_timestamp(time) > var.intrvl
+            SELECT elb, ssl_cipher, ROUND((COUNT(ssl_cipher)* 100.0 / (SELECT COUNT(*) FROM "{clb_query_table}" WHERE ssl_cipher != '-' AND {log_time} > var.intrvl AND {last_30_days})),2) AS percentage, COUNT() AS requests
+            FROM "{clb_query_table}", var
+            WHERE {log_time} > var.intrvl
+                AND {last_30_days}
                 AND NOT ssl_cipher = '-'
             GROUP BY elb, ssl_cipher, var.intrvl
             ORDER BY percentage DESC""")
 
         self.__create_named_query(
-            f'CLB - TLS Version and Ciphersuites combined - 30 days - {clb_table_id}', 'CLB - TLS Version and Ciphersuites combined - 30 days',
+            stack, f'CLB - TLS Version and Ciphersuites combined - 30 days - {clb_table_id}', 'CLB - TLS Version and Ciphersuites combined - 30 days',
             f"""SELECT DISTINCT elb, ssl_cipher, ssl_protocol,  count(ssl_cipher) AS requests
-            FROM "{clb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
+            FROM "{clb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
                 AND NOT ssl_protocol = '-'
             GROUP BY elb, ssl_cipher,ssl_protocol
             ORDER BY requests DESC""")
 
         self.__create_named_query(
-            f'CLB - Top 10 TLS 1.0 talkers - 30 days - {clb_table_id}', 'CLB - Top 10 TLS 1.0 talkers - 30 days',
+            stack, f'CLB - Top 10 TLS 1.0 talkers - 30 days - {clb_table_id}', 'CLB - Top 10 TLS 1.0 talkers - 30 days',
             f"""SELECT elb, client_ip, COUNT(*) as requests
-            FROM "{clb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
+            FROM "{clb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
                 AND ssl_protocol = 'TLSv1'
             GROUP BY elb, client_ip
             ORDER BY requests DESC
             LIMIT 10""")
 
         self.__create_named_query(
-            f'CLB - Top 100 Clients and User Agents for TLS 1.0 - 30 days - {clb_table_id}', 'CLB - Top 10 TLS 1.0 talkers - 30 days',
+            stack, f'CLB - Top 100 Clients and User Agents for TLS 1.0 - 30 days - {clb_table_id}', 'CLB - Top 10 TLS 1.0 talkers - 30 days',
             f"""SELECT DISTINCT(elb, client_ip, ssl_protocol, user_agent), COUNT(*) AS requests
-            FROM "{clb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
+            FROM "{clb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
                 AND ssl_protocol = 'TLSv1'
             GROUP BY (elb, client_ip, ssl_protocol, user_agent)
             ORDER BY requests DESC
             LIMIT 100""")
 
         self.__create_prepared_statement(
-            f'clb_tls_version_{clb_table_id}',
+            stack, f'clb_tls_version_{clb_table_id}',
             'CLB TLS Version Distribution',
             f"""SELECT elb, ssl_protocol, COUNT() AS requests
-            FROM "{clb_table_name}"
-            WHERE from_iso8601_timestamp(time) > date_add('day', ?, current_timestamp)
+            FROM "{clb_query_table}"
+            WHERE {scope}year * 10000 + month * 100 + day >= CAST(date_format(date_add('day', ?, current_date), '%Y%m%d') AS integer)
                 AND NOT ssl_protocol = '-'
                 AND elb = ?
             GROUP BY elb, ssl_protocol
             """)
 
         self.__create_named_query(
-            f'CLB - Top 10 talkers - 30 days - {clb_table_id}', 'CLB - Top 10 talkers - 30 days',
+            stack, f'CLB - Top 10 talkers - 30 days - {clb_table_id}', 'CLB - Top 10 talkers - 30 days',
             f"""SELECT elb, client_ip, COUNT(*) as requests
-            FROM "{clb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
+            FROM "{clb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
             GROUP BY elb, client_ip
             ORDER BY requests DESC
             LIMIT 10""")
 
         self.__create_named_query(
-            f'CLB - Top 10 talkers - Requests - 30 days - {clb_table_id}', 'CLB - Top 10 talkers - Requests - 30 days',
+            stack, f'CLB - Top 10 talkers - Requests - 30 days - {clb_table_id}', 'CLB - Top 10 talkers - Requests - 30 days',
             f"""SELECT elb, client_ip, COUNT(*) AS requests
-            FROM "{clb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
+            FROM "{clb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
             GROUP BY elb, client_ip
             ORDER BY requests DESC
             LIMIT 10""")
 
         self.__create_named_query(
-            f'CLB - Top 10 talkers - Requests - Time Range - {clb_table_id}', 'CLB - Top 10 talkers - Requests - Time Range days',
+            stack, f'CLB - Top 10 talkers - Requests - Time Range - {clb_table_id}', 'CLB - Top 10 talkers - Requests - Time Range days',
             f"""SELECT elb, client_ip, COUNT(*) AS requests
-            FROM "{clb_table_name}"
-            WHERE time >= '2022-09-12T00:00:00.000000Z'
-            AND time <= '2022-09-19T23:59:59.9999999Z'
+            FROM "{clb_query_table}"
+            WHERE time >= {range_start}
+            AND time <= {range_end}
+            AND {time_range}
             GROUP BY elb, client_ip
             ORDER BY requests DESC
             LIMIT 10""")
 
         self.__create_named_query(
-            f'CLB - Top 10 talkers - Megabytes - 30 days - {clb_table_id}', 'CLB - Top 10 talkers - Megabytes - 30 days',
+            stack, f'CLB - Top 10 talkers - Megabytes - 30 days - {clb_table_id}', 'CLB - Top 10 talkers - Megabytes - 30 days',
             f"""SELECT elb, client_ip, ROUND(sum(received_bytes/1000000.0),2) as client_data_received_megabytes
-            FROM "{clb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
-            -- WHERE time >= '2022-09-12T00:00:00.000000Z'
-            -- AND time <= '2022-09-19T23:59:59.9999999Z'
+            FROM "{clb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
+            -- WHERE time >= {range_start}
+            -- AND time <= {range_end}
+            -- AND {time_range}
             GROUP by elb, client_ip
             ORDER by client_data_received_megabytes DESC;""")
 
         self.__create_named_query(
-            f'CLB - Avg Request/Response size - 30 days - {clb_table_id}', 'CLB - Avg Request/Response size - 30 days',
+            stack, f'CLB - Avg Request/Response size - 30 days - {clb_table_id}', 'CLB - Avg Request/Response size - 30 days',
             f"""SELECT elb, ROUND((avg(sent_bytes)/1000.0 + avg(received_bytes)/1000.0),2) as avg_request_response_kilobytes
-            FROM "{clb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
-            -- WHERE time >= '2022-09-12T00:00:00.000000Z'
-            -- AND time <= '2022-09-19T23:59:59.9999999Z'
+            FROM "{clb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
+            -- WHERE time >= {range_start}
+            -- AND time <= {range_end}
+            -- AND {time_range}
             GROUP BY elb""")
 
         self.__create_named_query(
-            f'CLB - Target Distribution - 30 days - {clb_table_id}', 'CLB - Target Distribution - 30 days',
+            stack, f'CLB - Target Distribution - 30 days - {clb_table_id}', 'CLB - Target Distribution - 30 days',
             f"""WITH var as (
                 SELECT current_timestamp - interval '30' day as intrvl
             )
-            SELECT elb, target_ip, ROUND((Count(target_ip)* 100.0 / (Select Count(*) From "{clb_table_name}" WHERE from_iso8601_timestamp(time) > var.intrvl AND NOT target_ip = '')),2)
+            SELECT elb, target_ip, ROUND((Count(target_ip)* 100.0 / (Select Count(*) From "{clb_query_table}" WHERE {log_time} > var.intrvl AND {last_30_days} AND NOT target_ip = '')),2)
             as backend_traffic_percentage
-            FROM "{clb_table_name}", var
-            WHERE from_iso8601_timestamp(time) > var.intrvl
+            FROM "{clb_query_table}", var
+            WHERE {log_time} > var.intrvl
+                AND {last_30_days}
                 AND NOT target_ip = ''
             GROUP by elb, target_ip, var.intrvl
             ORDER By count() DESC;""")
 
         self.__create_named_query(
-            f'CLB - LB 4xx and 5xx errors - 30 days - {clb_table_id}', 'CLB - LB 4xx and 5xx errors - 30 days',
-            f"""SELECT * FROM "{clb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
-                -- WHERE time >= '2022-09-12T00:00:00.000000Z'
-                -- AND time <= '2022-09-19T23:59:59.9999999Z'
+            stack, f'CLB - LB 4xx and 5xx errors - 30 days - {clb_table_id}', 'CLB - LB 4xx and 5xx errors - 30 days',
+            f"""SELECT * FROM "{clb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
+                -- WHERE time >= {range_start}
+                -- AND time <= {range_end}
+                -- AND {time_range}
                 -- AND elb_status_code = 400
                 AND elb_status_code BETWEEN 400 AND 599;""")
 
         self.__create_named_query(
-            f'CLB - Target 4xx and 5xx errors - 30 days - {clb_table_id}', 'CLB - Target 4xx and 5xx errors - 30 days',
-            f"""SELECT * FROM "{clb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
-                -- WHERE time >= '2022-09-12T00:00:00.000000Z'
-                -- AND time <= '2022-09-19T23:59:59.9999999Z'
+            stack, f'CLB - Target 4xx and 5xx errors - 30 days - {clb_table_id}', 'CLB - Target 4xx and 5xx errors - 30 days',
+            f"""SELECT * FROM "{clb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
+                -- WHERE time >= {range_start}
+                -- AND time <= {range_end}
+                -- AND {time_range}
                 -- AND target_status_code = 400
                 AND target_status_code BETWEEN 400 AND 599;""")
 
         self.__create_named_query(
-            f'CLB - Client IPs per URL hit - 30 days - {clb_table_id}', 'CLB - Client IPs per URL hit - 30 days',
-            f"""SELECT client_ip, elb, request_url, count(*) as count FROM "{clb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
-            -- WHERE time >= '2022-09-12T00:00:00.000000Z'
-            -- AND time <= '2022-09-19T23:59:59.9999999Z'
+            stack, f'CLB - Client IPs per URL hit - 30 days - {clb_table_id}', 'CLB - Client IPs per URL hit - 30 days',
+            f"""SELECT client_ip, elb, request_url, count(*) as count FROM "{clb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
+            -- WHERE time >= {range_start}
+            -- AND time <= {range_end}
+            -- AND {time_range}
             GROUP by client_ip, elb, request_url
             ORDER by count DESC;""")
 
         self.__create_named_query(
-            f'CLB - Top 100 user-agents - 30 days - {clb_table_id}', 'CLB - Top 100 user-agents - 30 days',
+            stack, f'CLB - Top 100 user-agents - 30 days - {clb_table_id}', 'CLB - Top 100 user-agents - 30 days',
             f"""SELECT elb, user_agent, COUNT(*) AS requests
-            FROM "{clb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
-            -- WHERE time >= '2022-09-12T00:00:00.000000Z'
-            -- AND time <= '2022-09-19T23:59:59.9999999Z'
+            FROM "{clb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
+            -- WHERE time >= {range_start}
+            -- AND time <= {range_end}
+            -- AND {time_range}
             GROUP BY elb, user_agent
             ORDER BY requests DESC
             LIMIT 100;""")
 
         self.__create_named_query(
-            f'CLB - Slow Responses - 30 days - {clb_table_id}', 'CLB - Slow Responses - 30 days',
-            f"""SELECT * FROM "{clb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
-            -- WHERE time >= '2022-09-12T00:00:00.000000Z'
-            -- AND time <= '2022-09-19T23:59:59.9999999Z'
+            stack, f'CLB - Slow Responses - 30 days - {clb_table_id}', 'CLB - Slow Responses - 30 days',
+            f"""SELECT * FROM "{clb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
+            -- WHERE time >= {range_start}
+            -- AND time <= {range_end}
+            -- AND {time_range}
             AND target_processing_time >= 5.0""")
 
         self.__create_named_query(
-            f'CLB - Aggregated Log Information - 30 days - {clb_table_id}', 'CLB - Aggregated Log Information - 30 days',
+            stack, f'CLB - Aggregated Log Information - 30 days - {clb_table_id}', 'CLB - Aggregated Log Information - 30 days',
             f"""SELECT elb,
                 count(1) AS requestCount,
                 min(time) as firstLogTime,
@@ -760,15 +1480,18 @@ class AthenaStack(Stack):
                 sum(received_bytes) as totalBytesReceived,
                 sum(sent_bytes) as totalBytesSent,
                 sum(received_bytes+sent_bytes) AS totalBytes
-            FROM "{clb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
-            -- WHERE time >= '2022-09-12T00:00:00.000000Z'
-            -- AND time <= '2022-09-19T23:59:59.9999999Z'
+            FROM "{clb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
+            -- WHERE time >= {range_start}
+            -- AND time <= {range_end}
+            -- AND {time_range}
             GROUP BY elb
             ORDER BY requestCount DESC limit 10;""")
 
         self.__create_named_query(
-            f'CLB - Processed Traffic by ELB & Target IP - 30 days - {clb_table_id}', 'CLB - Processed Traffic by ELB & Target IP - 30 days',
+            stack, f'CLB - Processed Traffic by ELB & Target IP - 30 days - {clb_table_id}', 'CLB - Processed Traffic by ELB & Target IP - 30 days',
+            # elb_ip comes from the name of the raw log file, so this query always reads the raw table
             f"""SELECT target_ip AS target,
                 count(target_ip) AS count,
                 sum(received_bytes) as totalRecvBytes,
@@ -786,117 +1509,51 @@ class AthenaStack(Stack):
                 approx_percentile(response_processing_time, 0.999) as P999Response
             FROM "{clb_table_name}"
             WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
+                AND {last_30_days}
             -- WHERE time >= '2022-09-12T00:00:00.000000Z'
             -- AND time <= '2022-09-19T23:59:59.9999999Z'
+            -- AND {time_range}
             GROUP BY  target_ip, regexp_extract("$path",'((1?[0-9][0-9]?|2[0-4][0-9]|25[0-5])\.){{3}}(1?[0-9][0-9]?|2[0-4][0-9]|25[0-5])')
             ORDER BY count DESC limit 1000;
             """)
 
     def athena_nlb(self, name, bucket_name, **kwargs):
         bkt_acc_id = kwargs.get('bucket_account', self.account)
-        bucket_logs = s3.Bucket.from_bucket_name(self, f'nlb_logs_{name}', bucket_name)
+        stack = self.__bucket_stack('nlb', name)
+        bucket_logs = s3.Bucket.from_bucket_name(stack, f'nlb_logs_{name}', bucket_name)
                     
         if 'bucket_prefix' in kwargs:
             bucket_prefix = kwargs['bucket_prefix']
-            bucket_path = f'{bucket_prefix}/AWSLogs/{bkt_acc_id}/elasticloadbalancing/{self.region}'
             nlb_table_id = f'{bucket_name}_{bucket_prefix}'
             nlb_table_id = nlb_table_id.replace('/', '_')
         else:
-            bucket_path = f'AWSLogs/{bkt_acc_id}/elasticloadbalancing/{self.region}'
             nlb_table_id = bucket_name
 
         nlb_table_id = nlb_table_id.lower()
+        accounts, regions = kwargs.get('accounts'), kwargs.get('regions')
+        if 'injected' in (accounts, regions) and (kwargs.get('parquet') or kwargs.get('rollups')):
+            raise ValueError('parquet and rollups need the accounts and regions of the logs, '
+                             'injected projection is not supported')
+        bucket_path, location_template = self.__log_path(
+            kwargs.get('bucket_prefix'), bkt_acc_id, accounts, regions)
         nlb_table_name = f'tb_nlb_logs_{nlb_table_id}'
 
+        # Partition predicates, so that each query reads only the log files of its time window
+        scope = self.__scope_filter(bkt_acc_id, accounts, regions)
+        last_30_days = scope + self.__partition_filter(30)
+        time_range = scope + self.__partition_range('2022-09-12', '2022-09-19')
+
+        nlb_columns = self.__columns(NLB_FIELDS)
+
         logs_table = glue.Table(
-            self, nlb_table_name,
+            stack, nlb_table_name,
             database=self.logs_db,
             table_name=nlb_table_name,
             bucket=bucket_logs,
             s3_prefix=bucket_path,
-            columns=[
-                glue.Column(
-                    name='type',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='version',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='time',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='elb',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='listener',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='client_ip',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='client_port',
-                    type=glue.Schema.INTEGER),
-                glue.Column(
-                    name='destination_ip',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='destination_port',
-                    type=glue.Schema.INTEGER),
-                glue.Column(
-                    name='connection_time',
-                    type=glue.Schema.DOUBLE),
-                glue.Column(
-                    name='tls_handshake_time',
-                    type=glue.Schema.DOUBLE),
-                glue.Column(
-                    name='received_bytes',
-                    type=glue.Schema.BIG_INT),
-                glue.Column(
-                    name='sent_bytes',
-                    type=glue.Schema.BIG_INT),
-                glue.Column(
-                    name='incoming_tls_alert',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='chosen_cert_arn',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='chosen_cert_serial',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='tls_cipher',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='tls_protocol_version',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='tls_named_group',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='domain_name',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='alpn_fe_protocol',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='alpn_be_protocol',
-                    type=glue.Schema.STRING),
-                glue.Column(
-                    name='alpn_client_preference_list',
-                    type=glue.Schema.STRING)
-            ],
+            columns=nlb_columns,
 
-            partition_keys=[
-                glue.Column(
-                    name='year',
-                    type=glue.Schema.INTEGER),
-                glue.Column(
-                    name='month',
-                    type=glue.Schema.INTEGER),
-                glue.Column(
-                    name='day',
-                    type=glue.Schema.INTEGER
-                )],
+            partition_keys=self.__partition_keys(accounts, regions),
 
             data_format=glue.DataFormat(
                 input_format=glue.InputFormat('org.apache.hadoop.mapred.TextInputFormat'),
@@ -907,80 +1564,92 @@ class AthenaStack(Stack):
 
         logs_table_cfn = logs_table.node.default_child
         logs_table_cfn.add_override('Properties.TableInput.StorageDescriptor.SerdeInfo.Parameters.serialization\.format', 1)
-        input_regex = '([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*):([0-9]*) ([^ ]*)[:-]([0-9]*) ([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*)'
-        logs_table_cfn.add_override('Properties.TableInput.StorageDescriptor.SerdeInfo.Parameters.input\.regex', input_regex)
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.day\.digits', '2')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.day\.range', '01,31')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.day\.type', 'integer')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.month\.digits', '2')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.month\.range', '01,12')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.month\.type', 'integer')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.year\.digits', '4')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.year\.type', 'integer')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.year\.range', '2017,2050')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.projection\.enabled', 'true')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.EXTERNAL', 'TRUE')
-        logs_table_cfn.add_override('Properties.TableInput.Parameters.storage\.location\.template', f's3://{bucket_name}/{bucket_path}/${{year}}/${{month}}/${{day}}')
+        logs_table_cfn.add_override('Properties.TableInput.StorageDescriptor.SerdeInfo.Parameters.input\.regex', NLB_REGEX)
+        self.__project_partitions(logs_table_cfn, bucket_name, location_template, accounts, regions)
+
+        # Named queries read the Parquet table when there is one
+        nlb_query_table = nlb_table_name
+        log_time = 'from_iso8601_timestamp(time)'
+        range_start, range_end = "'2022-09-12T00:00:00.000000Z'", "'2022-09-19T23:59:59.9999999Z'"
+        if kwargs.get('parquet'):
+            nlb_query_table = f'tb_nlb_logs_parquet_{nlb_table_id}'
+            self.__create_parquet_table(stack, nlb_query_table, nlb_table_name,
+                                        nlb_columns + self.__scope_columns(accounts, regions), bucket_logs,
+                                        kwargs.get('parquet_schedule', events.Schedule.cron(minute='30', hour='0')))
+            log_time = 'time'
+            range_start, range_end = "timestamp '2022-09-12 00:00:00'", "timestamp '2022-09-19 23:59:59.999'"
+        if kwargs.get('live_parquet'):
+            self.__create_live_parquet_table(stack, 'nlb', f'tb_nlb_logs_live_{nlb_table_id}',
+                                             nlb_columns + self.__scope_columns(accounts, regions),
+                                             nlb_table_name, bucket_logs, bucket_path, **kwargs)
+
+        self.__create_approximate_queries(stack, 'nlb', nlb_table_id, nlb_query_table, log_time, last_30_days,
+                                          'tls_protocol_version', 'tlsv1', user_agents=False)
 
         self.__create_named_query(
-            f'NLB - TLS Version - 30 days - {nlb_table_id}', 'NLB - TLS Version - 30 days',
+            stack, f'NLB - TLS Version - 30 days - {nlb_table_id}', 'NLB - TLS Version - 30 days',
             f"""WITH var as (
                 SELECT current_timestamp - interval '30' day as intrvl
             )
-            SELECT elb, tls_protocol_version, ROUND((COUNT(tls_protocol_version)* 100.0 / (SELECT COUNT(*) FROM "{nlb_table_name}" WHERE tls_protocol_version != '-' AND from_iso8601_timestamp(time) > var.intrvl)),2) AS percentage, COUNT() AS requests
-            FROM "{nlb_table_name}", var
-            WHERE from_iso8601_timestamp(time) > var.intrvl
+            SELECT elb, tls_protocol_version, ROUND((COUNT(tls_protocol_version)* 100.0 / (SELECT COUNT(*) FROM "{nlb_query_table}" WHERE tls_protocol_version != '-' AND {log_time} > var.intrvl AND {last_30_days})),2) AS percentage, COUNT() AS requests
+            FROM "{nlb_query_table}", var
+            WHERE {log_time} > var.intrvl
+                AND {last_30_days}
                 AND NOT tls_protocol_version = '-'
             GROUP BY elb, tls_protocol_version, var.intrvl
             ORDER BY percentage DESC""")
 
         self.__create_named_query(
-            f'NLB - TLS Ciphersuites - 30 days - {nlb_table_id}', 'NLB - TLS Ciphersuites - 30 days',
+            stack, f'NLB - TLS Ciphersuites - 30 days - {nlb_table_id}', 'NLB - TLS Ciphersuites - 30 days',
             f"""WITH var as (
                 SELECT current_timestamp - interval '30' day as intrvl
             )
-            SELECT elb, tls_cipher, ROUND((COUNT(tls_cipher)* 100.0 / (SELECT COUNT(*) FROM "{nlb_table_name}" WHERE tls_cipher != '-' AND from_iso8601_timestamp(time) > var.intrvl)),2) AS percentage, COUNT() AS requests
-            FROM "{nlb_table_name}", var
-            WHERE from_iso8601_timestamp(time) > var.intrvl
+            SELECT elb, tls_cipher, ROUND((COUNT(tls_cipher)* 100.0 / (SELECT COUNT(*) FROM "{nlb_query_table}" WHERE tls_cipher != '-' AND {log_time} > var.intrvl AND {last_30_days})),2) AS percentage, COUNT() AS requests
+            FROM "{nlb_query_table}", var
+            WHERE {log_time} > var.intrvl
+                AND {last_30_days}
                 AND NOT tls_cipher = '-'
             GROUP BY elb, tls_cipher, var.intrvl
             ORDER BY percentage DESC""")
 
         self.__create_named_query(
-            f'NLB - TLS Version and Ciphersuites combined - 30 days - {nlb_table_id}', 'NLB - TLS Version and Ciphersuites combined - 30 days',
+            stack, f'NLB - TLS Version and Ciphersuites combined - 30 days - {nlb_table_id}', 'NLB - TLS Version and Ciphersuites combined - 30 days',
             f"""SELECT DISTINCT elb, tls_cipher, tls_protocol_version,  count(tls_cipher) AS requests
-            FROM "{nlb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
+            FROM "{nlb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
                 AND NOT tls_protocol_version = '-'
             GROUP BY elb, tls_cipher,tls_protocol_version
             ORDER BY requests DESC""")
 
         self.__create_named_query(
-            f'NLB - Top 10 TLS 1.0 talkers - 30 days - {nlb_table_id}', 'NLB - Top 10 TLS 1.0 talkers - 30 days',
+            stack, f'NLB - Top 10 TLS 1.0 talkers - 30 days - {nlb_table_id}', 'NLB - Top 10 TLS 1.0 talkers - 30 days',
             f"""SELECT elb, client_ip, COUNT(*) as requests
-            FROM "{nlb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
+            FROM "{nlb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
                 AND tls_protocol_version = 'tlsv1'
             GROUP BY elb, client_ip
             ORDER BY requests DESC
             LIMIT 10""")
 
         self.__create_prepared_statement(
-            f'nlb_tls_version_{nlb_table_id}',
+            stack, f'nlb_tls_version_{nlb_table_id}',
             'NLB TLS Version Distribution',
             f"""SELECT elb, tls_protocol_version, COUNT() AS requests
-            FROM "{nlb_table_name}"
-            WHERE from_iso8601_timestamp(time) > date_add('day', ?, current_timestamp)
+            FROM "{nlb_query_table}"
+            WHERE {scope}year * 10000 + month * 100 + day >= CAST(date_format(date_add('day', ?, current_date), '%Y%m%d') AS integer)
                 AND NOT tls_protocol_version = '-'
                 AND elb = ?
             GROUP BY elb, tls_protocol_version
             """)
 
         self.__create_named_query(
-            f'NLB - Top 10 talkers - 30 days - {nlb_table_id}', 'NLB - Top 10 talkers - 30 days',
+            stack, f'NLB - Top 10 talkers - 30 days - {nlb_table_id}', 'NLB - Top 10 talkers - 30 days',
             f"""SELECT elb, client_ip, COUNT(*) as requests
-            FROM "{nlb_table_name}"
-            WHERE from_iso8601_timestamp(time) > current_timestamp - interval '30' day
+            FROM "{nlb_query_table}"
+            WHERE {log_time} > current_timestamp - interval '30' day
+                AND {last_30_days}
             GROUP BY elb, client_ip
             ORDER BY requests DESC
             LIMIT 10""")